@@ -171,6 +171,9 @@ def args() -> argparse.Namespace:
     parser.add_argument("--sync", dest='sync',
                         help="Run Libem in synchronous mode.",
                         action='store_true', default=False)
+    parser.add_argument("--prompt-cache", dest='prompt_cache',
+                        help="Lay out prompts for provider-side prompt caching.",
+                        action='store_true', default=False)
     parser.add_argument("--rpm", dest='rpm',
                         help="Limit Libem's request rate to the model.",
                         type=int, default=-1)
@@ -1,6 +1,11 @@
 from benchmark.suite import (
     block,
     batch,
+    cluster,
+    records,
+    preprocess,
+    prompt,
+    mock,
     llama3,
     openai,
 )
@@ -8,6 +13,11 @@ from benchmark.suite import (
 suites = {
     'block': block.run,
     'batch': batch.run,
+    'cluster': cluster.run,
+    'records': records.run,
+    'preprocess': preprocess.run,
+    'prompt': prompt.run,
+    'mock': mock.run,
     'gpt-3.5-turbo': openai.run('gpt-3.5-turbo'),
     'gpt-4': openai.run('gpt-4'),
     'gpt-4-turbo': openai.run('gpt-4-turbo'),
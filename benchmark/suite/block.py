@@ -1,6 +1,7 @@
 import os
 import time
 
+import libem
 import benchmark as bm
 from benchmark.classic import block_similarities
 from benchmark.suite.util import (
@@ -26,15 +27,24 @@ def run(args):
     start = time.time()
     
 
+    # compare the blocking engines on each benchmark
+    engines = ["pairwise", "vectorized"]
+
     reports = {}
     for benchmark in benchmarks:
-        try:
-            report = run_benchmark(benchmark, args)
-        except NotImplementedError:
-            continue
-        
-        reports[benchmark] = report["stats"]["block"]
-        reports[benchmark]["similarity_cutoff"] = block_similarities[benchmark]
+        for engine in engines:
+            libem.calibrate({
+                "libem.block.parameter.engine": engine,
+            })
+            try:
+                report = run_benchmark(benchmark, args)
+            except NotImplementedError:
+                break
+            
+            key = f"{benchmark} ({engine})"
+            reports[key] = report["stats"]["block"]
+            reports[key]["engine"] = engine
+            reports[key]["similarity_cutoff"] = block_similarities[benchmark]
 
     print(f"Benchmark: Suite done in: {time.time() - start:.2f}s.")
     
@@ -42,9 +52,10 @@ def run(args):
     save(df, name)
     
     # generate markdown table
-    df = df[["benchmark", "similarity_cutoff", "percent_blocked", "f1", "throughput"]]
+    df = df[["benchmark", "engine", "similarity_cutoff", "percent_blocked", "f1", "throughput"]]
     field_names = {
         "benchmark": "Benchmark",
+        "engine": "Engine",
         "total_pairs": "Total Pairs",
         "similarity_cutoff": "Similarity Cutoff (0-100)",
         "percent_blocked": "Percent Blocked",
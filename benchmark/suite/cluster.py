@@ -0,0 +1,123 @@
+import os
+import time
+import random
+
+import sklearn.metrics as metrics
+
+import libem
+from libem.prepare.datasets.clustering import febrl
+from libem.resolve.cluster import parameter
+from benchmark.suite.util import (
+    report_to_dataframe,
+    tabulate, plot, save, show
+)
+
+name = os.path.basename(__file__).replace(".py", "")
+
+
+def run(args):
+    # scale the febrl clustering dataset up by replicating
+    # it, each copy with its own set of clusters
+    df = febrl.load_test()
+    rows = df.to_dict(orient="records")
+    max_cluster_id = df["cluster_id"].max() + 1
+    sizes = [10_000, 50_000, 100_000, 200_000]
+    num_negatives = 2
+
+    print(f"Benchmark: Clustering febrl at {sizes} records "
+          f"with oracle blocking and matching:")
+    start = time.time()
+
+    reports = {}
+    for size in sizes:
+        records, truths = [], {}
+        for i in range(size):
+            row = dict(rows[i % len(rows)])
+            cluster_id = row.pop("cluster_id") + \
+                (i // len(rows)) * max_cluster_id
+            row["copy"] = i // len(rows)
+            records.append(row)
+            truths[id(row)] = cluster_id
+
+        def block(records):
+            # all pairs within each true cluster and a few
+            # random pairs across clusters for each record
+            members = {}
+            for record in records:
+                members.setdefault(truths[id(record)], []).append(record)
+
+            pairs = []
+            for cluster in members.values():
+                pairs.extend(
+                    {"left": left, "right": right}
+                    for i, left in enumerate(cluster)
+                    for right in cluster[i + 1:]
+                )
+            for left in records:
+                pairs.extend(
+                    {"left": left, "right": random.choice(records)}
+                    for _ in range(num_negatives)
+                )
+            return pairs
+
+        def match(pairs):
+            return [
+                {"answer": "yes"
+                 if truths[id(pair["left"])] == truths[id(pair["right"])]
+                 else "no"}
+                for pair in pairs
+            ]
+
+        parameter.block_func.update(block)
+        parameter.match_func.update(match)
+
+        for conflict in ["ignore", "veto"]:
+            libem.calibrate({
+                "libem.resolve.cluster.parameter.conflict": conflict,
+            })
+
+            cluster_start = time.time()
+            clusters = libem.cluster(records)
+            duration = time.time() - cluster_start
+
+            preds = [cluster_id for cluster_id, _ in clusters]
+            reports[f"{size} ({conflict})"] = {
+                "num_records": size,
+                "conflict": conflict,
+                "num_clusters": len(set(preds)),
+                "latency": libem.round(duration),
+                "throughput": libem.round(size / duration),
+                # the mutual information scores are too slow at this scale
+                "adjusted_rand_score": metrics.adjusted_rand_score(
+                    [truths[id(r)] for _, r in clusters], preds
+                ),
+            }
+
+    # the oracles are not set through calibrate,
+    # so libem.reset() does not restore the defaults
+    libem.reset()
+    parameter.block_func.update(parameter.block_func.default)
+    parameter.match_func.update(parameter.match_func.default)
+    print(f"Benchmark: Suite done in: {time.time() - start:.2f}s.")
+
+    df = report_to_dataframe(reports, key_col="setting")
+    save(df, name)
+
+    # generate markdown table
+    df = df[["num_records", "conflict", "num_clusters", "latency",
+             "throughput", "adjusted_rand_score"]]
+    field_names = {
+        "num_records": "Records",
+        "conflict": "Conflict Policy",
+        "num_clusters": "Clusters",
+        "latency": "Latency (s)",
+        "throughput": "Throughput (rps)",
+        "adjusted_rand_score": "ARI",
+    }
+    df = df.rename(columns=field_names)
+
+    tabulate(df, name)
+    plot(df)
+    show(df)
+
+    return reports
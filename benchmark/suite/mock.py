@@ -0,0 +1,135 @@
+import os
+import time
+import random
+import tempfile
+
+import libem
+from libem.core import eval, model, transport
+from libem.core.model import mock
+from libem.match import struct
+from benchmark.suite.util import (
+    report_to_dataframe,
+    tabulate, plot, save, show
+)
+
+name = os.path.basename(__file__).replace(".py", "")
+
+
+def pairs(num_pairs: int, seed: int) -> tuple[list, list, list]:
+    ''' Synthetic product pairs, half of which match. '''
+    rng = random.Random(seed)
+    brands = ["apple", "samsung", "google", "sony", "lg", "huawei"]
+    colors = ["black", "white", "blue", "red"]
+
+    left, right, labels = [], [], []
+    for i in range(num_pairs):
+        brand, color = rng.choice(brands), rng.choice(colors)
+        product = {"name": f"{brand} phone {i}", "color": color,
+                   "price": rng.randint(100, 1000)}
+        label = i % 2 == 0
+        if label:
+            other = {**product, "name": f"{brand.upper()} Phone {i}"}
+        else:
+            other = {**product, "name": f"{brand} phone {i + 1}"}
+        left.append(product)
+        right.append(other)
+        labels.append(label)
+    return left, right, labels
+
+
+def run(args):
+    # throughput of matching against the mock server,
+    # which answers by the labels with simulated latency
+    # and rate limit errors, under different configurations
+    num_pairs = 2000
+    latency, error_rate = 0.2, 0.02
+
+    left, right, labels = pairs(num_pairs, args.seed)
+
+    configs = {
+        "once": {},
+        "adaptive": {
+            "libem.match.parameter.adaptive_concurrency": True,
+        },
+        "batch-8": {
+            "libem.match.parameter.batch_size": 8,
+        },
+        "cached": {
+            "libem.match.parameter.cache": True,
+            "libem.optimize.cache.parameter.path": tempfile.mkdtemp(),
+        },
+    }
+
+    print(f"Benchmark: Matching {num_pairs} pairs against a mock server "
+          f"with {latency}s mean latency and {error_rate:.0%} 429s:")
+    start = time.time()
+
+    reports = {}
+    with mock.Server(latency=latency, distribution="exponential",
+                     error_rate=error_rate, seed=args.seed) as server:
+        # label the pairs by the text they are prompted with
+        parsed_left, parsed_right = struct.parse_input(left, right)
+        for l, r, label in zip(parsed_left, parsed_right, labels):
+            server.label(l.text, r.text, label)
+
+        for config, calibration in configs.items():
+            libem.calibrate({
+                "libem.parameter.base_url": server.base_url,
+                **calibration,
+            })
+            # a warm run fills the result cache
+            if config == "cached":
+                libem.match(left, right)
+                model.reset()
+
+            num_requests, num_errors = server.num_requests, server.num_errors
+            transport.reset_stats()
+            with libem.trace as t:
+                match_start = time.time()
+                output = libem.match(left, right)
+                match_latency = time.time() - match_start
+            model.reset()
+            libem.reset()
+
+            preds = [o["answer"] == "yes" for o in output]
+            stats = t.stats()
+            connections = sum(s["num_connections"]
+                              for s in transport.stats().values())
+            reports[config] = {
+                "num_pairs": num_pairs,
+                "f1": libem.round(eval.f1(labels, preds)),
+                "latency": libem.round(match_latency),
+                "throughput": libem.round(num_pairs / match_latency),
+                "num_requests": server.num_requests - num_requests,
+                "num_429s": server.num_errors - num_errors,
+                "num_connections": connections,
+                "num_input_tokens": stats["model"]["num_input_tokens"]["sum"] or 0,
+            }
+
+    print(f"Benchmark: Suite done in: {time.time() - start:.2f}s.")
+
+    df = report_to_dataframe(reports, key_col="config")
+    save(df, name)
+
+    # generate markdown table
+    df = df[["config", "num_pairs", "f1", "latency", "throughput",
+             "num_requests", "num_429s", "num_connections",
+             "num_input_tokens"]]
+    field_names = {
+        "config": "Configuration",
+        "num_pairs": "Pairs",
+        "f1": "F1",
+        "latency": "Latency (s)",
+        "throughput": "Throughput (pps)",
+        "num_requests": "Requests",
+        "num_429s": "429s",
+        "num_connections": "Connections",
+        "num_input_tokens": "Input Tokens",
+    }
+    df = df.rename(columns=field_names)
+
+    tabulate(df, name)
+    plot(df)
+    show(df)
+
+    return reports
@@ -0,0 +1,91 @@
+import os
+import time
+import random
+
+import numpy as np
+from pydantic import BaseModel
+
+import libem
+from libem.match import struct
+from benchmark.suite.util import (
+    report_to_dataframe,
+    tabulate, plot, save, show
+)
+
+name = os.path.basename(__file__).replace(".py", "")
+
+
+class PydanticRecord(BaseModel):
+    ''' The pydantic model match records were before, as the baseline. '''
+    text: str | None = None
+    images: list[str | np.ndarray] | None = None
+
+    class Config:
+        arbitrary_types_allowed = True
+
+
+def run(args):
+    # per-pair overhead of parsing and encoding pairs
+    # before matching, without any model calls
+    num_pairs = 200_000
+    num_runs = 3
+
+    random.seed(1)
+    words = ["apple", "iphone", "samsung", "galaxy", "pixel",
+             "black", "white", "64gb", "128gb", "pro", "max"]
+    pairs = [
+        {"left": {"name": " ".join(random.sample(words, 4)), "price": i},
+         "right": " ".join(random.sample(words, 3))}
+        for i in range(num_pairs)
+    ]
+
+    print(f"Benchmark: Preprocessing {num_pairs} pairs for matching:")
+    start = time.time()
+
+    records = {
+        "dataclass": struct._MultimodalRecord,
+        "pydantic": PydanticRecord,
+    }
+
+    reports = {}
+    for record, record_type in records.items():
+        struct._MultimodalRecord = record_type
+        try:
+            latencies = []
+            for _ in range(num_runs):
+                run_start = time.perf_counter()
+                struct.parse_input(pairs, None)
+                latencies.append(time.perf_counter() - run_start)
+        finally:
+            struct._MultimodalRecord = records["dataclass"]
+
+        latency = min(latencies)
+        reports[record] = {
+            "num_pairs": num_pairs,
+            "latency": libem.round(latency),
+            "per_pair_latency": libem.round(latency / num_pairs * 1e6),
+            "throughput": libem.round(num_pairs / latency),
+        }
+
+    print(f"Benchmark: Suite done in: {time.time() - start:.2f}s.")
+
+    df = report_to_dataframe(reports, key_col="record")
+    save(df, name)
+
+    # generate markdown table
+    df = df[["record", "num_pairs", "latency",
+             "per_pair_latency", "throughput"]]
+    field_names = {
+        "record": "Record Type",
+        "num_pairs": "Pairs",
+        "latency": "Latency (s)",
+        "per_pair_latency": "Per Pair Latency (us)",
+        "throughput": "Throughput (pps)",
+    }
+    df = df.rename(columns=field_names)
+
+    tabulate(df, name)
+    plot(df)
+    show(df)
+
+    return reports
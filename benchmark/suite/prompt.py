@@ -0,0 +1,78 @@
+import os
+import time
+import random
+
+import libem
+from libem.match import function, struct
+from benchmark.suite.util import (
+    report_to_dataframe,
+    tabulate, plot, save, show
+)
+
+name = os.path.basename(__file__).replace(".py", "")
+
+
+def run(args):
+    # per-pair overhead of building the match calls
+    # from parsed pairs, without any model calls
+    num_pairs = 100_000
+
+    random.seed(1)
+    words = ["apple", "iphone", "samsung", "galaxy", "pixel",
+             "black", "white", "64gb", "128gb", "pro", "max"]
+    left = [struct._MultimodalRecord(text=" ".join(random.sample(words, 4)))
+            for _ in range(num_pairs)]
+    right = [struct._MultimodalRecord(text=" ".join(random.sample(words, 3)))
+             for _ in range(num_pairs)]
+
+    print(f"Benchmark: Building match calls for {num_pairs} pairs:")
+    start = time.time()
+
+    libem.calibrate({
+        "libem.match.prompt.rules": libem.core.struct.Rules(
+            ["Color distinguishes entities."]
+        ),
+        "libem.match.parameter.structured": True,
+        "libem.match.parameter.cot": True,
+    })
+
+    reports = {}
+    for mode in ["compiled", "per-pair"]:
+        call_start = time.perf_counter()
+        for l, r in zip(left, right):
+            if mode == "per-pair":
+                # rebuild the static parts as before compilation
+                function.compile_call.cache_clear()
+            function.once_call(l, r)
+        latency = time.perf_counter() - call_start
+
+        reports[mode] = {
+            "num_pairs": num_pairs,
+            "latency": libem.round(latency),
+            "per_pair_latency": libem.round(latency / num_pairs * 1e6),
+            "throughput": libem.round(num_pairs / latency),
+        }
+
+    libem.reset()
+    print(f"Benchmark: Suite done in: {time.time() - start:.2f}s.")
+
+    df = report_to_dataframe(reports, key_col="mode")
+    save(df, name)
+
+    # generate markdown table
+    df = df[["mode", "num_pairs", "latency",
+             "per_pair_latency", "throughput"]]
+    field_names = {
+        "mode": "Prompt",
+        "num_pairs": "Pairs",
+        "latency": "Latency (s)",
+        "per_pair_latency": "Per Pair Latency (us)",
+        "throughput": "Throughput (pps)",
+    }
+    df = df.rename(columns=field_names)
+
+    tabulate(df, name)
+    plot(df)
+    show(df)
+
+    return reports
@@ -0,0 +1,106 @@
+import os
+import time
+import random
+import tracemalloc
+
+import pandas as pd
+import pyarrow as pa
+
+import libem
+from libem.struct import digest
+from libem.block.function import convert_to_str
+from libem.resolve.cluster.integrations.pandas import to_records
+from benchmark.suite.util import (
+    report_to_dataframe,
+    tabulate, plot, save, show
+)
+
+name = os.path.basename(__file__).replace(".py", "")
+
+
+def frame(num_rows: int, seed: int) -> pd.DataFrame:
+    ''' Synthetic person records, some with missing values. '''
+    rng = random.Random(seed)
+    first = ["alice", "bob", "carol", "dave", "erin", "frank", "grace"]
+    last = ["smith", "jones", "brown", "lee", "garcia", "miller"]
+    cities = ["nyc", "sf", "la", "boston", "austin", None]
+
+    return pd.DataFrame({
+        "name": [f"{rng.choice(first)} {rng.choice(last)} {i}"
+                 for i in range(num_rows)],
+        "city": [rng.choice(cities) for _ in range(num_rows)],
+        "age": [rng.randint(18, 90) if rng.random() > 0.1 else float("nan")
+                for _ in range(num_rows)],
+    })
+
+
+def run(args):
+    # memory and latency of reading the rows of a DataFrame as
+    # per-row dicts and as rows of arrow columns, and of the
+    # passes blocking and clustering make over the records:
+    # their strings and their digests
+    sizes = [10_000, 100_000, 500_000]
+    readers = {
+        "dict": lambda df: df.to_dict(orient="records"),
+        "arrow": to_records,
+    }
+
+    print(f"Benchmark: Reading DataFrames of {sizes} rows "
+          f"as {list(readers)}:")
+    start = time.time()
+
+    reports = {}
+    for size in sizes:
+        df = frame(size, args.seed)
+        for reader, read in readers.items():
+            arrow_bytes = pa.total_allocated_bytes()
+            tracemalloc.start()
+            read_start = time.time()
+
+            records = read(df)
+            read_memory, _ = tracemalloc.get_traced_memory()
+            arrow_memory = pa.total_allocated_bytes() - arrow_bytes
+            read_duration = time.time() - read_start
+
+            strs = [convert_to_str(r) for r in records]
+            digests = [digest(r) for r in records]
+
+            duration = time.time() - read_start
+            _, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del records, strs, digests
+
+            reports[f"{size} ({reader})"] = {
+                "num_rows": size,
+                "reader": reader,
+                "read_latency": libem.round(read_duration),
+                "records_mb": libem.round((read_memory + arrow_memory) / 2 ** 20),
+                "peak_mb": libem.round((peak_memory + arrow_memory) / 2 ** 20),
+                "latency": libem.round(duration),
+                "throughput": libem.round(size / duration),
+            }
+
+    print(f"Benchmark: Suite done in: {time.time() - start:.2f}s.")
+
+    df = report_to_dataframe(reports, key_col="setting")
+    save(df, name)
+
+    # generate markdown table
+    df = df[["num_rows", "reader", "read_latency", "records_mb",
+             "peak_mb", "latency", "throughput"]]
+    field_names = {
+        "num_rows": "Rows",
+        "reader": "Records",
+        "read_latency": "Read Latency (s)",
+        "records_mb": "Records (MB)",
+        "peak_mb": "Peak (MB)",
+        "latency": "Latency (s)",
+        "throughput": "Throughput (rps)",
+    }
+    df = df.rename(columns=field_names)
+
+    tabulate(df, name)
+    plot(df)
+    show(df)
+
+    return reports
@@ -242,6 +242,7 @@ def run_match(train_set, test_set, args):
             "libem.match.parameter.record_batch": args.record_batch,
             "libem.match.parameter.sync": args.sync,
             "libem.match.prompt.shots": shots,
+            "libem.optimize.cache.parameter.provider": args.prompt_cache,
         })
 
         if args.sync and args.batch_size == 1:
@@ -351,10 +352,13 @@ def run_match(train_set, test_set, args):
                         'tokens': {
                             'num_input_tokens': model_usage['num_input_tokens'],
                             'num_output_tokens': model_usage['num_output_tokens'],
+                            'num_cached_tokens': model_usage.get('num_cached_tokens', 0),
                             'cost': libem.round(cost_util.get_cost(
                                 args.model,
                                 model_usage['num_input_tokens'],
                                 model_usage['num_output_tokens'],
+                                num_cached_tokens=model_usage.get('num_cached_tokens', 0),
+                                num_cache_write_tokens=model_usage.get('num_cache_write_tokens', 0),
                             ), 4)
                         }
                     }
@@ -392,10 +396,13 @@ def run_match(train_set, test_set, args):
         'tokens': {
             'num_input_tokens': telemetry['model.num_input_tokens']['sum'],
             'num_output_tokens': telemetry['model.num_output_tokens']['sum'],
+            'num_cached_tokens': telemetry['model.num_cached_tokens']['sum'] or 0,
             'cost': libem.round(cost_util.get_cost(
                 args.model,
                 telemetry['model.num_input_tokens']['sum'],
                 telemetry['model.num_output_tokens']['sum'],
+                num_cached_tokens=telemetry['model.num_cached_tokens']['sum'],
+                num_cache_write_tokens=telemetry['model.num_cache_write_tokens']['sum'],
             ), 4)
         },
         'confusion_matrix': {
@@ -0,0 +1,143 @@
+"""
+Local process-pool backend for the pairwise comparisons of blocking.
+
+The text of the records is written once into shared memory, so the
+worker processes receive only (left, right) index pairs and return
+the pairs that pass the similarity cutoff, instead of pickling the
+records of every pair back and forth.
+"""
+import numpy as np
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from fuzzywuzzy import fuzz
+
+# the texts last attached to, in each worker process
+_texts = None
+
+
+class SharedTexts:
+    """
+    Strings packed into a shared memory block, with None standing
+    for records without text (images). The block holds the number
+    of strings, their offsets, the missing flags, then the data.
+    """
+
+    def __init__(self, texts: list[str | None]):
+        data = [b"" if t is None else t.encode() for t in texts]
+
+        n = len(data)
+        offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum([len(d) for d in data], out=offsets[1:])
+        header = 8 * (n + 2) + n
+
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=max(header + int(offsets[-1]), 1)
+        )
+        self.shm.buf[:8] = np.int64(n).tobytes()
+        self.shm.buf[8:8 * (n + 2)] = offsets.tobytes()
+        self.shm.buf[8 * (n + 2):header] = bytes(t is None for t in texts)
+        self.shm.buf[header:header + offsets[-1]] = b"".join(data)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+class _SharedTextsView:
+    """Read access to SharedTexts from a worker process."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.shm = shared_memory.SharedMemory(name=name)
+
+        n = int(np.frombuffer(self.shm.buf, dtype=np.int64, count=1)[0])
+        self.offsets = np.frombuffer(self.shm.buf, dtype=np.int64,
+                                     count=n + 1, offset=8).copy()
+        self.missing = bytes(self.shm.buf[8 * (n + 2):8 * (n + 2) + n])
+        self.header = 8 * (n + 2) + n
+
+    def __getitem__(self, i: int) -> str | None:
+        if self.missing[i]:
+            return None
+        return bytes(self.shm.buf[self.header + self.offsets[i]:
+                                  self.header + self.offsets[i + 1]]).decode()
+
+    def close(self):
+        self.shm.close()
+
+
+def _compare(name: str, pairs: np.ndarray, similarity: int) -> np.ndarray:
+    global _texts
+    if _texts is None or _texts.name != name:
+        if _texts is not None:
+            _texts.close()
+        _texts = _SharedTextsView(name)
+
+    return _compare_texts(_texts, pairs, similarity)
+
+
+def _compare_texts(texts, pairs: np.ndarray, similarity: int) -> np.ndarray:
+    keep = []
+    for k, (i, j) in enumerate(pairs):
+        left, right = texts[i], texts[j]
+        # If purely image, do not compare
+        if left is None or right is None or \
+                fuzz.token_set_ratio(left, right) >= similarity:
+            keep.append(k)
+    return pairs[keep]
+
+
+def pool(num_workers: int) -> Executor | None:
+    """A pool of num_workers processes, None to
+    compare in the current process."""
+    if num_workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=num_workers)
+
+
+def compare(texts: list[str | None],
+            pairs: Iterable[tuple[int, int]],
+            similarity: int,
+            batch_size: int = 10000,
+            executor: Executor | None = None) -> Iterator[np.ndarray]:
+    """
+    Compare the (i, j) pairs of texts in chunks of batch_size pairs,
+    yielding the pairs passing the similarity cutoff chunk by chunk
+    in order, on the executor or in the current process if None.
+    """
+
+    def _chunks():
+        chunk = []
+        for pair in pairs:
+            chunk.append(pair)
+            if len(chunk) == batch_size:
+                yield np.array(chunk, dtype=np.int64).reshape(-1, 2)
+                chunk = []
+        if chunk:
+            yield np.array(chunk, dtype=np.int64).reshape(-1, 2)
+
+    if executor is None:
+        for chunk in _chunks():
+            yield _compare_texts(texts, chunk, similarity)
+        return
+
+    shared = SharedTexts(texts)
+    try:
+        # bound the chunks in flight to keep memory flat
+        pending, max_pending = deque(), 2 * executor._max_workers
+        for chunk in _chunks():
+            pending.append(
+                executor.submit(_compare, shared.name, chunk, similarity)
+            )
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        shared.close()
@@ -0,0 +1,145 @@
+"""
+Candidate generation for blocking.
+
+Instead of enumerating every pair of records in a group, these
+generate only the pairs likely to pass the similarity filter:
+pairs of records sharing tokens (found via an inverted index)
+or records close to each other in sorted order. Records are
+given as normalized strings, None for records without text.
+Pairs are returned as sorted (left index, right index) tuples.
+"""
+import numpy as np
+from itertools import chain
+from collections import defaultdict
+from collections.abc import Iterable
+
+# stop tokens are only ignored in indexes of at least this many records
+MIN_INDEX_SIZE = 100
+
+
+class TokenIndex:
+    """
+    An inverted index from tokens to the ids of the records
+    containing them. Records are assigned consecutive ids in
+    the order they are added.
+
+    max_df: tokens found in more than this fraction of the
+            records (and in more than two records) are ignored
+            as stop tokens when querying.
+    min_size: the number of records the index must hold before
+              stop tokens are ignored, as document frequencies
+              over a few records say little about a token.
+    """
+
+    def __init__(self, max_df: float = 1.0, min_size: int = MIN_INDEX_SIZE):
+        self.max_df = max_df
+        self.min_size = min_size
+        self.postings: dict[str, list[int]] = defaultdict(list)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, tokens: Iterable[str]) -> int:
+        id = self.size
+        for token in set(tokens):
+            self.postings[token].append(id)
+        self.size += 1
+        return id
+
+    def extend(self, token_sets: Iterable[Iterable[str]]):
+        for tokens in token_sets:
+            self.add(tokens)
+        return self
+
+    def is_stop(self, token: str) -> bool:
+        if self.size < self.min_size:
+            return False
+        return len(self.postings.get(token, ())) > max(self.max_df * self.size, 2)
+
+    def query(self, tokens: Iterable[str],
+              min_shared: int = 1) -> np.ndarray:
+        """The sorted ids of the records sharing at
+        least min_shared (non-stop) tokens."""
+        postings = [
+            self.postings[token] for token in set(tokens)
+            if token in self.postings and not self.is_stop(token)
+        ]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+
+        ids = np.fromiter(chain.from_iterable(postings), dtype=np.int64)
+        ids, counts = np.unique(ids, return_counts=True)
+        return ids[counts >= min_shared]
+
+
+def tokenize(text: str | None) -> set[str]:
+    return set(text.split()) if text else set()
+
+
+def token_pairs(left: list[str | None],
+                right: list[str | None] | None = None,
+                min_shared: int = 1,
+                max_df: float = 1.0) -> list[tuple[int, int]]:
+    """Pairs of records sharing at least min_shared tokens,
+    within left (i < j) if right is None."""
+    single = right is None
+
+    index = TokenIndex(max_df=max_df).extend(
+        tokenize(text) for text in (left if single else right)
+    )
+
+    pairs = []
+    for i, text in enumerate(left):
+        if text is None:
+            continue
+        ids = index.query(tokenize(text), min_shared)
+        if single:
+            ids = ids[ids > i]
+        pairs.extend((i, int(j)) for j in ids)
+    return pairs
+
+
+def sorted_neighborhood_pairs(left: list[str | None],
+                              right: list[str | None] | None = None,
+                              window: int = 10) -> list[tuple[int, int]]:
+    """Pairs of records within a sliding window over the records
+    sorted by their text, within left if right is None."""
+    single = right is None
+
+    # (key, side, index) with side 0 for left and 1 for right
+    keys = [(text, 0, i) for i, text in enumerate(left) if text is not None]
+    if not single:
+        keys.extend((text, 1, j) for j, text in enumerate(right)
+                    if text is not None)
+    keys.sort()
+
+    pairs = set()
+    for p, (_, side, i) in enumerate(keys):
+        for _, other_side, j in keys[p + 1:p + window]:
+            if single:
+                pairs.add((min(i, j), max(i, j)))
+            elif side != other_side:
+                pairs.add((i, j) if side == 0 else (j, i))
+    return sorted(pairs)
+
+
+def image_pairs(left: list[str | None],
+                right: list[str | None] | None = None) -> list[tuple[int, int]]:
+    """Pairs involving records without text, which are
+    always kept as the records cannot be compared."""
+    single = right is None
+    if single:
+        right = left
+
+    pairs = set()
+    for i, text in enumerate(left):
+        if text is None:
+            pairs.update((i, j) for j in range(len(right)))
+    for j, text in enumerate(right):
+        if text is None:
+            pairs.update((i, j) for i in range(len(left)))
+
+    if single:
+        pairs = {(min(i, j), max(i, j)) for i, j in pairs if i != j}
+    return sorted(pairs)
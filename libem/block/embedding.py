@@ -0,0 +1,159 @@
+"""
+Embedding-based candidate generation for blocking.
+
+Records are embedded into unit vectors and paired with their
+approximate nearest neighbors, found through a local vector index.
+Embeddings are cached on disk by record digest so that repeated
+runs skip re-embedding.
+"""
+import numpy as np
+
+from libem.struct import digest
+from libem.block import parameter
+from libem.optimize.cache.store import get_store
+
+name = "embedding"
+
+_models = {}
+
+
+def pairs(left: list[str | None],
+          right: list[str | None] | None = None) -> list[tuple[int, int]]:
+    """Pairs of records among the nearest neighbors of each other,
+    within left if right is None, as sorted (left, right) tuples."""
+    single = right is None
+    if single:
+        right = left
+
+    left_ids = [i for i, text in enumerate(left) if text is not None]
+    right_ids = left_ids if single else \
+                [j for j, text in enumerate(right) if text is not None]
+    if not left_ids or not right_ids:
+        return []
+
+    vectors = embed([left[i] for i in left_ids] +
+                    ([] if single else [right[j] for j in right_ids]))
+    left_vectors = vectors[:len(left_ids)]
+    right_vectors = left_vectors if single else vectors[len(left_ids):]
+
+    # one more neighbor for the record itself
+    k = min(parameter.num_neighbors() + single, len(right_ids))
+    neighbors, similarities = search(right_vectors, left_vectors, k)
+
+    threshold = parameter.embedding_threshold()
+    _pairs = set()
+    for a, (ids, sims) in enumerate(zip(neighbors, similarities)):
+        for b, sim in zip(ids, sims):
+            if b < 0 or sim < threshold:
+                continue
+            i, j = left_ids[a], right_ids[b]
+            if not single:
+                _pairs.add((i, j))
+            elif i != j:
+                _pairs.add((min(i, j), max(i, j)))
+    return sorted(_pairs)
+
+
+def embed(texts: list[str]) -> np.ndarray:
+    """Embed the texts into L2-normalized float32 vectors."""
+    embedder = parameter.embedder()
+
+    if embedder in {"hashing", "tfidf"}:
+        vectors = cached(texts, f"hashing-{parameter.embedding_dim()}",
+                         hashed_counts)
+        if embedder == "tfidf":
+            # weigh the n-grams by their inverse document
+            # frequency among the records being blocked
+            df = np.count_nonzero(vectors, axis=0)
+            vectors = vectors * (np.log((1 + len(texts)) / (1 + df)) + 1)
+    else:
+        vectors = cached(texts, embedder, sentence_embeddings)
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+def cached(texts: list[str], model: str, func) -> np.ndarray:
+    """Look up the embeddings of the texts in the cache,
+    computing and caching the missing ones with func."""
+    keys = [f"{model}:{digest(text)}" for text in texts]
+    store = get_store(name) if parameter.embedding_cache() else None
+
+    found = store.get_many(list(set(keys))) if store else {}
+    missing = sorted({k: i for i, k in enumerate(keys) if k not in found}.values())
+    if missing:
+        vectors = np.asarray(func([texts[i] for i in missing]), dtype=np.float32)
+        computed = {keys[i]: v.tobytes() for i, v in zip(missing, vectors)}
+        if store:
+            store.put_many(computed)
+        found.update(computed)
+
+    return np.stack([np.frombuffer(found[k], dtype=np.float32) for k in keys])
+
+
+def hashed_counts(texts: list[str]) -> np.ndarray:
+    """Counts of the character trigrams of each text,
+    hashed into embedding_dim buckets."""
+    from sklearn.feature_extraction.text import HashingVectorizer
+
+    return HashingVectorizer(
+        analyzer="char_wb", ngram_range=(3, 3),
+        n_features=parameter.embedding_dim(),
+        alternate_sign=False, norm=None,
+    ).transform(texts).toarray()
+
+
+def sentence_embeddings(texts: list[str]) -> np.ndarray:
+    model = parameter.embedder()
+    if model not in _models:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError("sentence-transformers is not installed.")
+        _models[model] = SentenceTransformer(model)
+
+    return _models[model].encode(texts, convert_to_numpy=True)
+
+
+def search(index_vectors: np.ndarray, query_vectors: np.ndarray,
+           k: int) -> tuple[np.ndarray, np.ndarray]:
+    """The ids of the k nearest index vectors of each query
+    vector by cosine similarity, and their similarities."""
+    match parameter.ann_index():
+        case "hnsw":
+            try:
+                import hnswlib
+            except ImportError:
+                raise ImportError("hnswlib is not installed.")
+
+            index = hnswlib.Index(space="ip", dim=index_vectors.shape[1])
+            index.init_index(max_elements=len(index_vectors),
+                             ef_construction=200, M=16)
+            index.add_items(index_vectors)
+            index.set_ef(max(2 * k, 50))
+            ids, distances = index.knn_query(query_vectors, k=k)
+            return ids, 1 - distances
+        case "faiss":
+            try:
+                import faiss
+            except ImportError:
+                raise ImportError("faiss is not installed.")
+
+            index = faiss.IndexHNSWFlat(index_vectors.shape[1], 32,
+                                        faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = max(2 * k, 50)
+            index.add(index_vectors)
+            similarities, ids = index.search(query_vectors, k)
+            return ids, similarities
+        case "exact":
+            ids, similarities = [], []
+            # bound the similarity matrix to about batch_size entries
+            step = max(1, parameter.batch_size() // len(index_vectors))
+            for start in range(0, len(query_vectors), step):
+                sims = query_vectors[start:start + step] @ index_vectors.T
+                top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+                ids.append(top)
+                similarities.append(np.take_along_axis(sims, top, axis=1))
+            return np.vstack(ids), np.vstack(similarities)
+        case _:
+            raise ValueError(f"Unknown ANN index: {parameter.ann_index()}")
@@ -1,15 +1,19 @@
-import ray
-from ray.data.aggregate import AggregateFnV2
-from ray.data.block import BlockAccessor
-from fuzzywuzzy import fuzz
+import numpy as np
+from fuzzywuzzy import fuzz, utils
+from rapidfuzz import process as rapidfuzz_process
+from rapidfuzz import fuzz as rapidfuzz_fuzz
 from itertools import combinations, product
-from typing import Any
+from typing import Iterable, Iterator
+from collections.abc import Mapping
 from tqdm import tqdm
 
-from libem.block import parameter
+from libem.block import (
+    parameter, candidate, embedding,
+    backend, partition
+)
 from libem.block.struct import (
     _TextRecord, _ImageRecord, 
-    _Record, parse_input
+    _Record
 )
 from libem.struct import Record
 
@@ -37,7 +41,8 @@ schema = {
 
 def func(*records: Record, 
          key: str | list | None = None,
-         ignore: str | list | None = None) -> list[dict]:
+         ignore: str | list | None = None,
+         ids: bool = False) -> list[dict]:
     
     if not ignore:
         ignore = parameter.default_ignore()
@@ -58,104 +63,166 @@ def func(*records: Record,
     grouped_records = process(records, key)
     
     if len(records) == 1:
-        return block_single_list(grouped_records, ignore)
+        pairs = block_single_list(grouped_records, ignore)
     else:
-        return block_across_lists(grouped_records, ignore)
+        pairs = block_across_lists(grouped_records, ignore)
+
+    if not ids:
+        for pair in pairs:
+            del pair['left_id'], pair['right_id']
+    return pairs
 
 
-def process(records: Record, key: list[str] | None) -> list[dict]:
+def process(records: Record, key: list[str] | None) -> Iterator[dict]:
     ''' 
-    Process and perform groupby operations on the records.
+    Process and perform groupby operations on the records,
+    streaming the groups as they are formed.
     If multiple datasets are passed in, only keep key values
     that are shared by 2 or more datasets.
     '''
-    
-    # Combine all records into a single Ray dataset
-    _records = []
-    for idx, dataset in enumerate(records):
-        processed = parse_input(dataset)
-        
-        for record in processed:
-            new_record = {"idx": idx, "record": record}
-            if key: # expose key values
-                if not isinstance(record.text, dict):
-                    raise ValueError("Records must be dict to use key.")
-                for k in key:
-                    new_record[k] = record.text.get(k, None)
-            
-            _records.append(new_record)
-    
-    ds = ray.data.from_items(_records)
-    
-    grouped = ds.groupby(key).aggregate(_GroupbyAggregator()).take_all()
-    
-    output = []
-    # Format output to be
-    # [{"records": [[ds1_rec1, ds1_rec2, ...], [ds2_rec1, ...] ...]}, ...]
-    for group in grouped:
-        result = group["__result__"]
-        if len(records) == 1 or len(result) > 1:
-            output.append({"records": [result[idx] for idx in result]})
-    return output
+    return partition.group(records, key)
 
 
-def block_single_list(grouped_records: list[dict],
+def block_single_list(grouped_records: Iterable[dict],
                       ignore: list | None = None) -> list[dict]:
     ''' Pairwise compare all records in each group. '''
     
-    batch_size = parameter.batch_size()
-    similarity = parameter.similarity()
-    remote_tasks, batch = [], []
-    
-    for group in grouped_records:
-        for left, right in combinations(group["records"][0], 2):
-            batch.append((left, right))
-            if len(batch) == batch_size:
-                remote_tasks.append(
-                    compare.remote((batch, ignore, similarity))
-                )
-                batch = []
-    if len(batch) > 0:
-        remote_tasks.append(
-            compare.remote((batch, ignore, similarity))
-        )
-    
-    # Use tqdm and ray.wait to show progress as tasks complete
-    results = []
-    pending = remote_tasks.copy()
-    with tqdm(total=len(remote_tasks), 
-              desc="Blocking") as pbar:
-        while pending:
-            done, pending = ray.wait(pending, num_returns=1)
-            results.extend(ray.get(done)[0])
-            pbar.update(len(done))
-    
-    return results
+    similarity = cutoff()
+
+    if parameter.engine() == "vectorized":
+        return [
+            pair
+            for group in tqdm(grouped_records, desc="Blocking")
+            for pair in compare_vectorized(
+                group["records"][0], None, ignore, similarity
+            )
+        ]
 
+    return compare_groups(
+        ((group["records"][0], None) for group in grouped_records),
+        ignore, similarity
+    )
 
-def block_across_lists(grouped_records: list[dict],
+
+def block_across_lists(grouped_records: Iterable[dict],
                        ignore: list | None = None) -> list[dict]:
     ''' Pairwise compare all records across different lists in each group. '''
     
+    similarity = cutoff()
+
+    if parameter.engine() == "vectorized":
+        return [
+            pair
+            for group in tqdm(grouped_records, desc="Blocking")
+            for sublist1, sublist2 in combinations(group["records"], 2)
+            for pair in compare_vectorized(
+                sublist1, sublist2, ignore, similarity
+            )
+        ]
+
+    return compare_groups(
+        ((sublist1, sublist2)
+         for group in grouped_records
+         for sublist1, sublist2 in combinations(group["records"], 2)),
+        ignore, similarity
+    )
+
+
+def compare_groups(groups: Iterable[tuple[list[_Record], list[_Record] | None]],
+                   ignore: list | None = None,
+                   similarity: int | None = None) -> list[dict]:
+    ''' 
+    Compare the candidate pairs of each (left, right) list pair,
+    within left if right is None, on the configured backend.
+    '''
+    if parameter.backend() == "ray":
+        return _ray_compare(
+            (pair for left, right in groups
+             for pair in candidate_records(left, right, ignore)),
+            ignore, similarity
+        )
+
+    batch_size = parameter.batch_size()
+    num_workers = parameter.num_workers()
+
+    def _units():
+        # gather the records of consecutive groups into units
+        # of about a few chunks of pairs per worker each
+        unit, num_pairs = [], 0
+        for left, right in groups:
+            unit.append((left, right))
+            num_pairs += len(left) * len(right if right is not None else left)
+            if num_pairs >= 2 * batch_size * num_workers:
+                yield unit
+                unit, num_pairs = [], 0
+        if unit:
+            yield unit
+
+    result = []
+    executor = backend.pool(num_workers)
+    try:
+        with tqdm(desc="Blocking") as pbar:
+            for unit in _units():
+                # index the records of all lists in the unit once
+                records, offsets = [], {}
+                for left, right in unit:
+                    for records_list in (left, right):
+                        if records_list is not None and id(records_list) not in offsets:
+                            offsets[id(records_list)] = len(records)
+                            records.extend(records_list)
+
+                def _pairs():
+                    for left, right in unit:
+                        l_offset = offsets[id(left)]
+                        r_offset = l_offset if right is None else offsets[id(right)]
+                        for i, j in candidate_indices(left, right, ignore):
+                            yield l_offset + i, r_offset + j
+
+                texts = [None if isinstance(r, _ImageRecord)
+                         else convert_to_str(r.text, ignore) for r in records]
+
+                for pairs in backend.compare(texts, _pairs(), similarity,
+                                             batch_size=batch_size,
+                                             executor=executor):
+                    result.extend(
+                        to_pair(records[i], records[j])
+                        for i, j in pairs
+                    )
+                    pbar.update(1)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return result
+
+
+def _ray_compare(pairs: Iterable[tuple[_Record, _Record]],
+                 ignore: list | None = None,
+                 similarity: int | None = None) -> list[dict]:
+    try:
+        import ray
+    except ImportError:
+        raise ImportError("ray is not installed.")
+
+    global _remote_compare
+    if _remote_compare is None:
+        _remote_compare = ray.remote(compare)
+
     batch_size = parameter.batch_size()
-    similarity = parameter.similarity()
     remote_tasks, batch = [], []
     
-    for group in grouped_records:
-        for sublist1, sublist2 in combinations(group["records"], 2):
-            for left, right in product(sublist1, sublist2):
-                batch.append((left, right))
-                if len(batch) == batch_size:
-                    remote_tasks.append(
-                        compare.remote((batch, ignore, similarity))
-                    )
-                    batch = []
+    for left, right in pairs:
+        batch.append((left, right))
+        if len(batch) == batch_size:
+            remote_tasks.append(
+                _remote_compare.remote((batch, ignore, similarity))
+            )
+            batch = []
     if len(batch) > 0:
         remote_tasks.append(
-            compare.remote((batch, ignore, similarity))
+            _remote_compare.remote((batch, ignore, similarity))
         )
     
-    # Use tqdm and ray.wait to show progress as tasks complete.
+    # Use tqdm and ray.wait to show progress as tasks complete
     results = []
     pending = remote_tasks.copy()
     with tqdm(total=len(remote_tasks), 
@@ -168,35 +235,185 @@ def block_across_lists(grouped_records: list[dict],
     return results
 
 
-@ray.remote
+_remote_compare = None
+
+
 def compare(input: tuple[list, list | None, list | None]) -> list[dict]:
     ''' Block using string similarity. '''
     
     pairs, ignore, similarity = input
     result = []
     if similarity is None:
-        similarity = parameter.similarity()
+        similarity = cutoff()
 
     for l, r in pairs:
         # If purely image, do not compare
         if isinstance(l, _ImageRecord) or isinstance(r, _ImageRecord):
-            result.append({'left': convert_to_original(l), 
-                           'right': convert_to_original(r)})
+            result.append(to_pair(l, r))
         else:
             left_str = convert_to_str(l.text, ignore)
             right_str = convert_to_str(r.text, ignore)
             if fuzz.token_set_ratio(left_str, right_str) >= similarity:
-                result.append({'left': convert_to_original(l), 
-                            'right': convert_to_original(r)})
+                result.append(to_pair(l, r))
     
     return result
 
 
+def compare_vectorized(left: list[_Record], right: list[_Record] | None,
+                       ignore: list | None = None,
+                       similarity: int | None = None) -> list[dict]:
+    '''
+    Block using string similarity, scoring all pairs of left and
+    right records (all pairs within left if right is None) at once.
+    Gives the same pairs, in the same order, as compare over the
+    pairs from combinations(left, 2) or product(left, right).
+    '''
+    if similarity is None:
+        similarity = cutoff()
+
+    single = right is None
+    if single:
+        right = left
+
+    # stringify and normalize each record once
+    left_str, left_proc = normalize(left, ignore)
+    right_str, right_proc = (left_str, left_proc) if single \
+                            else normalize(right, ignore)
+
+    if parameter.candidates() != "all":
+        result = []
+        for i, j in candidates(left_proc, None if single else right_proc):
+            # purely image records are not compared
+            if similarity <= 0 or left_proc[i] is None or right_proc[j] is None or similar(
+                    rapidfuzz_fuzz.token_set_ratio(left_proc[i], right_proc[j]),
+                    left_str[i], right_str[j], similarity):
+                result.append(to_pair(left[i], right[j]))
+        return result
+
+    left_images = np.array([s is None for s in left_proc], dtype=bool)
+    right_images = np.array([s is None for s in right_proc], dtype=bool)
+
+    result = []
+    # score rows in chunks of about batch_size pairs
+    step = max(1, parameter.batch_size() // max(len(right), 1))
+    for start in range(0, len(left), step):
+        end = min(start + step, len(left))
+
+        if similarity <= 0:
+            keep = np.ones((end - start, len(right)), dtype=bool)
+        else:
+            scores = rapidfuzz_process.cdist(
+                [s or "" for s in left_proc[start:end]],
+                [s or "" for s in right_proc],
+                scorer=rapidfuzz_fuzz.token_set_ratio,
+                workers=-1,
+            )
+            keep = scores >= similarity + 0.5 + 1e-3
+            for i, j in zip(*np.nonzero(
+                    ~keep & (scores >= similarity - 0.5 - 1e-3))):
+                keep[i, j] = similar(scores[i, j], left_str[start + i],
+                                     right_str[j], similarity)
+
+        # purely image records are not compared
+        keep |= left_images[start:end, None] | right_images[None, :]
+
+        if single:
+            # only keep pairs (i, j) with i < j
+            keep &= np.arange(start, end)[:, None] < np.arange(len(right))[None, :]
+
+        for i, j in zip(*np.nonzero(keep)):
+            result.append(to_pair(left[start + i], right[j]))
+
+    return result
+
+
+def cutoff() -> int:
+    '''
+    The string similarity cutoff of the candidate pairs, none for
+    embedding candidates, which are kept on their embedding
+    similarity so that pairs with little overlap in tokens
+    but close in the embedding space are not dropped.
+    '''
+    if parameter.candidates() == "embedding":
+        return 0
+    return parameter.similarity()
+
+
+def similar(score: float, left_str: str, right_str: str, similarity: int) -> bool:
+    '''
+    Check a rapidfuzz token_set_ratio score against the cutoff. 
+    fuzzywuzzy rounds scores to integers, so the scores within
+    rounding distance of the cutoff are confirmed with fuzzywuzzy.
+    '''
+    if score >= similarity + 0.5 + 1e-3:
+        return True
+    if score < similarity - 0.5 - 1e-3:
+        return False
+    return fuzz.token_set_ratio(left_str, right_str) >= similarity
+
+
+def normalize(records: list[_Record], ignore: list | None = None) -> tuple[list, list]:
+    ''' The string of each record and its normalized form, None for images. '''
+    strs = [None if isinstance(r, _ImageRecord)
+            else convert_to_str(r.text, ignore) for r in records]
+    return strs, [s if s is None else utils.full_process(s, force_ascii=True)
+                  for s in strs]
+
+
+def candidate_records(left: list[_Record], right: list[_Record] | None,
+                      ignore: list | None = None) -> Iterable[tuple[_Record, _Record]]:
+    ''' The pairs of records to compare, within left if right is None. '''
+    if parameter.candidates() == "all":
+        return combinations(left, 2) if right is None else product(left, right)
+
+    _right = left if right is None else right
+    return ((left[i], _right[j]) for i, j in candidate_indices(left, right, ignore))
+
+
+def candidate_indices(left: list[_Record], right: list[_Record] | None,
+                      ignore: list | None = None) -> Iterable[tuple[int, int]]:
+    ''' The (i, j) index pairs of records to compare, within left if right is None. '''
+    if parameter.candidates() == "all":
+        if right is None:
+            return combinations(range(len(left)), 2)
+        return product(range(len(left)), range(len(right)))
+
+    _, left_proc = normalize(left, ignore)
+    right_proc = None if right is None else normalize(right, ignore)[1]
+    return candidates(left_proc, right_proc)
+
+
+def candidates(left: list[str | None], 
+               right: list[str | None] | None = None) -> list[tuple[int, int]]:
+    '''
+    The (i, j) index pairs of normalized records to compare under
+    the configured candidate generation, within left if right is None.
+    '''
+    match parameter.candidates():
+        case "token":
+            pairs = candidate.token_pairs(
+                left, right,
+                min_shared=parameter.min_shared_tokens(),
+                max_df=parameter.max_token_df(),
+            )
+        case "sorted_neighborhood":
+            pairs = candidate.sorted_neighborhood_pairs(
+                left, right, window=parameter.window(),
+            )
+        case "embedding":
+            pairs = embedding.pairs(left, right)
+        case _:
+            raise ValueError(f"Unknown candidate generation: "
+                             f"{parameter.candidates()}")
+
+    return sorted(set(pairs).union(candidate.image_pairs(left, right)))
+
+
 def convert_to_str(record: str | dict, ignore: list | None = None):
     match record:
         case str():
             return record
-        case dict():
+        case Mapping():
             if ignore:
                 return ' '.join(map(str, (value for key, value in record.items() if key not in ignore)))
             else:
@@ -211,46 +428,22 @@ def convert_to_original(record: _Record) -> Record:
     elif isinstance(record, _ImageRecord):
         return record.image
     else:
-        return record
+        return record.record
 
 
-def init():
-    ''' Initialize Ray. '''
-    ray.init(ignore_reinit_error=True)
+def to_pair(left: _Record, right: _Record) -> dict:
+    ''' The output pair of two records, with their positions in the input. '''
+    return {'left': convert_to_original(left),
+            'right': convert_to_original(right),
+            'left_id': left.id,
+            'right_id': right.id}
 
 
-class _GroupbyAggregator(AggregateFnV2):
-    def __init__(self):
-        # Start with an empty dict mapping idx to a list of records
-        super().__init__(
-            name="__result__",
-            zero_factory=lambda: {},
-            on=None,
-            ignore_nulls=False,
-        )
+def init():
+    ''' Initialize Ray. '''
+    try:
+        import ray
+    except ImportError:
+        raise ImportError("ray is not installed.")
 
-    def aggregate_block(self, block: Any) -> dict[int, list]:
-        block_acc = BlockAccessor.for_block(block)
-        accumulator: dict[int, list] = {}
-        
-        # Read each row, group by idx
-        for row in block_acc.iter_rows(public_row_format=False):
-            idx = row["idx"]
-            rec = row["record"]
-            if idx in accumulator:
-                accumulator[idx].append(rec)
-            else:
-                accumulator[idx] = [rec]
-        
-        return accumulator
-
-    def combine(self, 
-                current_accumulator: dict[int, list[dict]], 
-                new: dict[int, list[dict]]) -> dict[int, list[dict]]:
-        # Merge two accumulators on idx
-        for list_idx, recs in new.items():
-            if list_idx in current_accumulator:
-                current_accumulator[list_idx].extend(recs)
-            else:
-                current_accumulator[list_idx] = recs
-        return current_accumulator
+    ray.init(ignore_reinit_error=True)
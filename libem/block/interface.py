@@ -9,12 +9,17 @@ Output = Iterable[Pair]
 
 def block(*records: Record, 
           key: str | list | None = None, 
-          ignore: str | list | None = None) -> Output:
+          ignore: str | list | None = None,
+          ids: bool = False) -> Output:
     '''
     Perform the blocking stage of entity matching given one or more datasets.
     If multiple datasets are passed in, only block across the datasets.
     
     Output format: [{"left": record, "right": record}, ...]
+
+    With ids, each pair also carries "left_id" and "right_id", the
+    positions of its records in the input, counting across the
+    datasets in order.
     '''
     
-    return func(*records, key=key, ignore=ignore)
+    return func(*records, key=key, ignore=ignore, ids=ids)
@@ -1,3 +1,6 @@
+import os
+from importlib.util import find_spec
+
 from libem.core.struct import Parameter
 
 similarity = Parameter(
@@ -14,3 +17,80 @@ default_ignore = Parameter(
     default=["id", "uuid"],
     options=[]
 )
+
+# "vectorized" scores all pairs of a group at once with
+# rapidfuzz's cdist, "pairwise" compares pair by pair
+engine = Parameter(
+    default="vectorized",
+    options=["vectorized", "pairwise"]
+)
+
+# where the pairwise engine runs: a local "process" pool,
+# or "ray" (opt-in, for clusters, installed with the ray
+# extra: pip install libem[ray]); the vectorized engine
+# runs in-process on rapidfuzz's native threads
+backend = Parameter(
+    default="process",
+    options=["process", "ray"]
+)
+num_workers = Parameter(
+    default=os.cpu_count() or 1,
+)
+
+# grouping on keys hash-partitions the records into this
+# many partitions, spilled to disk once more than max_buffered
+# records are held in memory
+num_partitions = Parameter(
+    default=64,
+)
+max_buffered = Parameter(
+    default=100_000,
+)
+
+# candidate pairs compared within each group: "all" pairs,
+# pairs of records sharing tokens, pairs of records close
+# to each other in sorted order, or nearest neighbors in
+# an embedding space
+candidates = Parameter(
+    default="all",
+    options=["all", "token", "sorted_neighborhood", "embedding"]
+)
+
+# token candidates: the number of tokens records must share,
+# ignoring tokens found in more than this fraction of records
+min_shared_tokens = Parameter(
+    default=1,
+)
+max_token_df = Parameter(
+    default=0.2,
+)
+
+# sorted neighborhood candidates: size of the sliding window
+window = Parameter(
+    default=10,
+)
+
+# embedding candidates: the num_neighbors nearest neighbors of
+# each record with a cosine similarity of at least the threshold
+embedder = Parameter(
+    default="hashing",
+    options=["hashing", "tfidf", "all-MiniLM-L6-v2"]
+)
+embedding_dim = Parameter(
+    default=256,
+)
+num_neighbors = Parameter(
+    default=10,
+)
+embedding_threshold = Parameter(
+    default=0.5,
+)
+ann_index = Parameter(
+    default=lambda: "hnsw" if find_spec("hnswlib") else "exact",
+    options=["hnsw", "faiss", "exact"]
+)
+# cache embeddings on disk, see libem.optimize.cache.parameter
+embedding_cache = Parameter(
+    default=True,
+    options=[True, False]
+)
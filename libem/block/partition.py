@@ -0,0 +1,132 @@
+"""
+Key-based grouping of records by streaming hash partitioning.
+
+Records are read in a single pass and hash-partitioned on their
+key values, spilling the partitions to disk once too many records
+are buffered. Groups are then formed one partition at a time and
+streamed out, so that memory holds one partition's records rather
+than the whole input.
+"""
+import os
+import pickle
+import shutil
+import tempfile
+from collections.abc import Iterable, Iterator, Mapping
+
+from libem.block import parameter
+from libem.block.struct import _Record, iter_input
+from libem.struct import Record
+
+
+class Partitions:
+    """
+    Items hash-partitioned on their key values, buffered in memory
+    until more than max_buffered are held and spilled to disk after.
+    """
+
+    def __init__(self, num_partitions: int = 64, max_buffered: int = 100_000):
+        self.max_buffered = max_buffered
+        self.buffers = [[] for _ in range(num_partitions)]
+        self.num_buffered = 0
+
+        self._dir = None
+        self._files = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, value, item):
+        p = hash(value) % len(self.buffers)
+        self.buffers[p].append((value, item))
+        self.num_buffered += 1
+
+        if self.num_buffered > self.max_buffered:
+            self.spill()
+
+    def spill(self):
+        if self._files is None:
+            self._dir = tempfile.mkdtemp(prefix="libem-block-")
+            self._files = [
+                open(os.path.join(self._dir, f"{p}.pkl"), "w+b")
+                for p in range(len(self.buffers))
+            ]
+
+        for buffer, file in zip(self.buffers, self._files):
+            for entry in buffer:
+                pickle.dump(entry, file, protocol=pickle.HIGHEST_PROTOCOL)
+            buffer.clear()
+        self.num_buffered = 0
+
+    def __iter__(self) -> Iterator[list[tuple]]:
+        """Yield the (value, item) entries partition by partition,
+        in the order they were added."""
+        for p, buffer in enumerate(self.buffers):
+            entries = []
+            if self._files is not None:
+                file = self._files[p]
+                file.flush()
+                file.seek(0)
+                while True:
+                    try:
+                        entries.append(pickle.load(file))
+                    except EOFError:
+                        break
+                file.close()
+            entries.extend(buffer)
+            buffer.clear()
+            yield entries
+
+    def close(self):
+        if self._files is not None:
+            for file in self._files:
+                file.close()
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._files = None
+
+
+def group(records: Iterable[Record],
+          key: list[str] | None = None) -> Iterator[dict]:
+    """
+    Group the records of each dataset on their key values, yielding
+    {"records": [[ds1_rec1, ds1_rec2, ...], [ds2_rec1, ...], ...]}
+    per group. If multiple datasets are passed in, only groups with
+    records from 2 or more datasets are kept.
+
+    Each record is given as id its position in the input,
+    counting across the datasets in order.
+    """
+    with Partitions(parameter.num_partitions(),
+                    parameter.max_buffered()) as partitions:
+        record_id = 0
+        for idx, dataset in enumerate(records):
+            for record in iter_input(dataset):
+                record.id = record_id
+                record_id += 1
+                partitions.add(_key(record, key), (idx, record))
+
+        for entries in partitions:
+            groups: dict[object, dict[int, list[_Record]]] = {}
+            for value, (idx, record) in entries:
+                groups.setdefault(value, {}).setdefault(idx, []).append(record)
+
+            for _group in groups.values():
+                if len(records) == 1 or len(_group) > 1:
+                    yield {"records": [_group[idx] for idx in sorted(_group)]}
+
+
+def _key(record: _Record, key: list[str] | None):
+    if not key:
+        return None
+    if not isinstance(record.text, Mapping):
+        raise ValueError("Records must be dict to use key.")
+
+    value = tuple(record.text.get(k, None) for k in key)
+    try:
+        hash(value)
+    except TypeError:
+        # unhashable key values, e.g., lists
+        value = repr(value)
+    return value
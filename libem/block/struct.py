@@ -1,26 +1,40 @@
+from collections.abc import Iterator
+
 from libem.struct import *
 
 
-# internal types
+# internal types, id is the position of the record in the input
 class _TextRecord(BaseModel):
     text: str | Mapping
+    id: int | None = None
 
 class _ImageRecord(BaseModel):
     image: ImageField
+    id: int | None = None
     class Config:
         arbitrary_types_allowed = True
 
-_Record = _TextRecord | _ImageRecord | MultimodalRecord
+class _MultimodalRecord(BaseModel):
+    record: MultimodalRecord
+    id: int | None = None
+
+    @property
+    def text(self) -> TextFields | None:
+        return self.record.text
+
+_Record = _TextRecord | _ImageRecord | _MultimodalRecord
 
 
 def parse_input(record: Record) -> list[_Record]:
     match record:
         case str() | Mapping():
-            return [_TextRecord(text=record)]
+            # the type is known, skip validation which would copy
+            # the record (or read all of a lazy Row into a dict)
+            return [_TextRecord.model_construct(text=record)]
         case Image.Image() | np.ndarray():
             return [_ImageRecord(image=record)]
         case MultimodalRecord():
-            return [record]
+            return [_MultimodalRecord(record=record)]
         case Iterable():
             output = []
             for r in record:
@@ -31,3 +45,18 @@ def parse_input(record: Record) -> list[_Record]:
                 f"unexpected input type: {type(record)},"
                 f"must be {Record}."
             )
+
+
+def iter_input(record: Record) -> Iterator[_Record]:
+    ''' Parse the input lazily, record by record. '''
+    match record:
+        case str() | Mapping() | Image.Image() | np.ndarray() | MultimodalRecord():
+            yield from parse_input(record)
+        case Iterable():
+            for r in record:
+                yield from iter_input(r)
+        case _:
+            raise ValueError(
+                f"unexpected input type: {type(record)},"
+                f"must be {Record}."
+            )
@@ -4,6 +4,12 @@ class ModelTimedoutException(Exception):
         '''The model timed out.'''
         super().__init__(*args)
 
+class ModelRateLimitedException(Exception):
+
+    def __init__(self, *args: object) -> None:
+        '''The model provider throttled the request.'''
+        super().__init__(*args)
+
 class ToolUseUnsupported(Exception):
     def __init__(self, *args: object) -> None:
         '''The tool is not supported.'''
@@ -1,56 +1,495 @@
+import os
+import time
+import queue
+import atexit
+import random
 import asyncio
-from typing import List, Coroutine
+import threading
+import contextvars
+import concurrent.futures
+from typing import (
+    List, Coroutine, Iterable,
+    Iterator, AsyncIterator, Callable
+)
 from tqdm.asyncio import tqdm
-from aiolimiter import AsyncLimiter
 
 import libem
 
 
+class TokenBucket:
+    '''
+        A bucket holding up to `rate` tokens that refills
+        continuously at `rate` tokens per minute.
+    '''
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.tokens = rate
+        self._updated = time.monotonic()
+
+    async def acquire(self, amount: float = 1):
+        # a request larger than the bucket waits for a full bucket
+        amount = min(amount, self.rate)
+        while True:
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return
+            await asyncio.sleep((amount - self.tokens) * 60 / self.rate)
+
+    def adjust(self, amount: float):
+        ''' Charge (or refund, if negative) tokens after the fact. '''
+        self._refill()
+        self.tokens = min(self.tokens - amount, self.rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.rate, self.tokens + (now - self._updated) * self.rate / 60
+        )
+        self._updated = now
+
+
+class AdaptiveSemaphore:
+    '''
+        A semaphore whose limit, when adaptive, grows additively
+        with each success and is halved when throttled (AIMD),
+        staying within [1, max_limit]. The limit is halved once
+        the throttles reach tolerance of the calls admitted since
+        it was last halved, counting at least the calls in flight,
+        so that sporadic throttles do not shrink it, nor do the
+        throttles of the calls admitted before it was halved.
+    '''
+
+    def __init__(self, max_limit: int, adaptive: bool = False,
+                 tolerance: float = 0.1):
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.tolerance = tolerance
+        self.limit = float(max_limit)
+        self.in_flight = 0
+        # the number of times the limit was halved
+        self.epoch = 0
+        self._num_calls = 0
+        self._num_throttles = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._cond:
+            await self._cond.wait_for(
+                lambda: self.in_flight < max(int(self.limit), 1)
+            )
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *args):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    def increase(self, epoch: int = None):
+        if epoch in {None, self.epoch}:
+            self._num_calls += 1
+        if self.adaptive:
+            self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+    def decrease(self, epoch: int = None):
+        ''' Count a throttle of a call admitted in the epoch. '''
+        if not self.adaptive or epoch not in {None, self.epoch}:
+            return
+        self._num_calls += 1
+        self._num_throttles += 1
+        if self._num_throttles >= self.tolerance * max(self._num_calls, self.in_flight):
+            self.limit = max(self.limit / 2, 1)
+            self.epoch += 1
+            self._num_calls = self._num_throttles = 0
+
+
+class Scheduler:
+    '''
+        Schedule model calls under per-model limits on requests
+        and (estimated) tokens per minute and on the number of
+        concurrent calls, retrying throttled or timed out calls
+        with jittered exponential backoff.
+    '''
+
+    def __init__(self,
+                 rpm: int = -1,
+                 tpm: int = -1,
+                 max_concurrency: int = libem.LIBEM_MAX_ASYNC_TASKS,
+                 adaptive: bool = False,
+                 max_retries: int = 5,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_concurrency = max_concurrency
+        self.adaptive = adaptive
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self._models = {}
+        self._start = time.monotonic()
+
+    def _state(self, model: str) -> dict:
+        if model not in self._models:
+            self._models[model] = {
+                "requests": TokenBucket(self.rpm) if self.rpm > 0 else None,
+                "tokens": TokenBucket(self.tpm) if self.tpm > 0 else None,
+                "semaphore": AdaptiveSemaphore(
+                    self.max_concurrency, self.adaptive
+                ),
+                "num_requests": 0,
+                "num_tokens": 0,
+                "num_throttles": 0,
+                "num_retries": 0,
+            }
+        return self._models[model]
+
+    async def run(self, model: str, tokens: int,
+                  call: Callable[[], Coroutine]) -> dict:
+        '''
+            Run the model call once admitted, where tokens is the
+            estimated number of tokens the call consumes; the
+            estimate is corrected with the reported usage.
+        '''
+        state = self._state(model)
+        semaphore = state["semaphore"]
+
+        start = time.monotonic()
+        num_throttles = 0
+        while True:
+            async with semaphore:
+                epoch = semaphore.epoch
+                if state["requests"]:
+                    await state["requests"].acquire(1)
+                if state["tokens"]:
+                    await state["tokens"].acquire(tokens)
+
+                try:
+                    response = await call()
+                except (libem.ModelRateLimitedException,
+                        libem.ModelTimedoutException):
+                    semaphore.decrease(epoch)
+                    num_throttles += 1
+                    state["num_throttles"] += 1
+                    if num_throttles > self.max_retries:
+                        raise
+                else:
+                    semaphore.increase(epoch)
+                    break
+
+            # full jitter backoff outside the semaphore
+            state["num_retries"] += 1
+            await asyncio.sleep(random.uniform(0, min(
+                self.max_backoff, self.backoff * 2 ** (num_throttles - 1)
+            )))
+
+        usage = response.get("stats", {})
+        used = usage.get("num_input_tokens", 0) + \
+               usage.get("num_output_tokens", 0)
+        if state["tokens"]:
+            state["tokens"].adjust(used - tokens)
+        state["num_requests"] += 1
+        state["num_tokens"] += used
+
+        libem.trace.add({
+            "exec": {
+                "model": model,
+                "num_throttles": num_throttles,
+                "wait_time": time.monotonic() - start,
+                "concurrency": semaphore.limit,
+            }
+        })
+        return response
+
+    def report(self) -> dict:
+        ''' Per-model throughput and throttle counts. '''
+        minutes = max(time.monotonic() - self._start, 1e-6) / 60
+        return {
+            model: {
+                "num_requests": state["num_requests"],
+                "num_tokens": state["num_tokens"],
+                "num_throttles": state["num_throttles"],
+                "num_retries": state["num_retries"],
+                "rpm": state["num_requests"] / minutes,
+                "tpm": state["num_tokens"] / minutes,
+                "concurrency": state["semaphore"].limit,
+            }
+            for model, state in self._models.items()
+        }
+
+
+class Worker:
+    '''
+        Serve requests from a queue on a dedicated thread, so that
+        blocking work such as local model inference runs off the
+        event loop. The requests queued by the time the thread is
+        free are handed to the handler together, up to
+        max_batch_size, so that it can process them as one batch.
+    '''
+
+    def __init__(self, handle: Callable[[list], list],
+                 max_batch_size: int = 1,
+                 name: str = "libem-worker"):
+        # handle maps a list of requests to a list of
+        # results, where a result may be an exception
+        self.handle = handle
+        self.max_batch_size = max_batch_size
+
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name=name, daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, request) -> asyncio.Future:
+        ''' Queue the request, returning a future of its result. '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((request, future, loop))
+        return future
+
+    def stop(self):
+        ''' Stop the thread once the queued requests are served. '''
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            while len(batch) < self.max_batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+
+            # skip the requests whose callers stopped waiting
+            batch = [b for b in batch if not b[1].cancelled()]
+            if not batch:
+                continue
+
+            try:
+                results = self.handle([request for request, _, _ in batch])
+            except Exception as e:
+                results = [e] * len(batch)
+
+            for (_, future, loop), result in zip(batch, results):
+                try:
+                    loop.call_soon_threadsafe(_resolve, future, result)
+                except RuntimeError:
+                    # the loop of the caller has closed
+                    pass
+
+
+def _resolve(future: asyncio.Future, result):
+    if future.done():
+        return
+    if isinstance(result, BaseException):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+
+_scheduler = contextvars.ContextVar("scheduler", default=None)
+
+
+def get_scheduler() -> Scheduler | None:
+    ''' The scheduler of the tasks the current model call belongs to. '''
+    return _scheduler.get()
+
+
 async def proc_async_tasks(
         tasks: List[Coroutine],
         max_async_tasks: int = libem.LIBEM_MAX_ASYNC_TASKS,
         rpm: int = -1,
+        tpm: int = -1,
+        adaptive: bool = False,
         desc: str = "Processing Tasks") -> List:
     ''' 
-        Run async tasks under na imposed max concurrent tasks 
-        with an optional rate limiter.
+        Run async tasks under na imposed max concurrent tasks, with
+        the model calls they make scheduled under optional request
+        and token rate limits and adaptive concurrency.
     '''
 
     sem = asyncio.Semaphore(max_async_tasks)
-    if rpm > 0:
-        limiter = AsyncLimiter(rpm)
-    else:
-        limiter = None
+    scheduler = Scheduler(rpm=rpm, tpm=tpm,
+                          max_concurrency=max_async_tasks,
+                          adaptive=adaptive)
 
     async def _run(sem, task):
+        # each task runs in its own copy of the context
+        _scheduler.set(scheduler)
         async with sem:
-            if limiter:
-                async with limiter:
-                    return await task
-            else:
-                return await task
+            return await task
 
     futures = [
         asyncio.ensure_future(_run(sem, task))
         for task in tasks
     ]
 
-    return await tqdm.gather(*futures, desc=desc)
+    try:
+        return await tqdm.gather(*futures, desc=desc)
+    finally:
+        if scheduler.report():
+            libem.trace.add({"exec": {"models": scheduler.report()}})
+
+
+async def stream_async_tasks(
+        tasks: Iterable[Coroutine],
+        max_async_tasks: int = libem.LIBEM_MAX_ASYNC_TASKS,
+        rpm: int = -1,
+        tpm: int = -1,
+        adaptive: bool = False,
+        desc: str = "Processing Tasks") -> AsyncIterator:
+    '''
+        Run async tasks drawn lazily from an iterable, keeping at most
+        max_async_tasks in flight, with the model calls they make
+        scheduled as in proc_async_tasks. Results are yielded in the
+        order the tasks complete.
+    '''
+
+    scheduler = Scheduler(rpm=rpm, tpm=tpm,
+                          max_concurrency=max_async_tasks,
+                          adaptive=adaptive)
+
+    async def _run(task):
+        _scheduler.set(scheduler)
+        return await task
+
+    tasks = iter(tasks)
+    pending = set()
+    try:
+        with tqdm(desc=desc) as pbar:
+            while True:
+                # top up the in-flight window
+                while len(pending) < max_async_tasks:
+                    task = next(tasks, None)
+                    if task is None:
+                        break
+                    pending.add(asyncio.ensure_future(_run(task)))
+
+                if not pending:
+                    break
+
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for future in done:
+                    pbar.update(1)
+                    yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        if scheduler.report():
+            libem.trace.add({"exec": {"models": scheduler.report()}})
+
+
+class EventLoop:
+    '''
+        An event loop running on a background thread, to which
+        synchronous code submits coroutines. Being long-lived, it
+        keeps what is bound to it, such as the pooled connections
+        of the model clients, across the synchronous calls.
+    '''
+
+    def __init__(self, name: str = "libem-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(
+            target=self.loop.run_forever, name=name, daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def alive(self) -> bool:
+        # a forked child inherits the loop but not its thread
+        return self._pid == os.getpid() and self._thread.is_alive()
+
+    def submit(self, task: Coroutine) -> concurrent.futures.Future:
+        '''
+            Schedule the coroutine on the loop, in a copy of the
+            context of the caller, returning a future of its result.
+        '''
+        return asyncio.run_coroutine_threadsafe(
+            _in_context(task, contextvars.copy_context()), self.loop
+        )
+
+    def run(self, task: Coroutine):
+        ''' Run the coroutine on the loop and wait for its result. '''
+        future = self.submit(task)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g., a KeyboardInterrupt while waiting
+            future.cancel()
+            raise
+
+    def stop(self):
+        if self.alive:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+        if not self.loop.is_running():
+            self.loop.close()
+
+
+async def _in_context(task: Coroutine, context: contextvars.Context):
+    # the task takes a copy of the context it is created in
+    return await context.run(asyncio.get_running_loop().create_task, task)
+
+
+_loop: EventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def get_loop() -> EventLoop:
+    ''' The background event loop, started on first use. '''
+    global _loop
+    with _loop_lock:
+        if _loop is None or not _loop.alive:
+            _loop = EventLoop()
+        return _loop
+
+
+@atexit.register
+def stop_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is not None:
+            _loop.stop()
+            _loop = None
+
+
+def run_async_iter(aiter: AsyncIterator) -> Iterator:
+    ''' Iterate over an async iterator from synchronous code. '''
+    loop = get_loop()
+    try:
+        while True:
+            try:
+                yield loop.run(aiter.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        if hasattr(aiter, "aclose"):
+            loop.run(aiter.aclose())
 
 
 def run_async_task(task: Coroutine):
     try:
-        loop = asyncio.get_running_loop()
-        if loop.is_running():
-            # Ensure the coroutine runs in the current loop
-            return asyncio.ensure_future(task)
-        elif loop.is_closed():
-            # If the loop is closed, create a new event loop
-            new_loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(new_loop)
-            return new_loop.run_until_complete(task)
-        else:
-            return asyncio.run(task)
+        asyncio.get_running_loop()
     except RuntimeError:
-        # No running event loop
-        return asyncio.run(task)
+        # no running event loop, run it on the background loop
+        return get_loop().run(task)
+    # Ensure the coroutine runs in the current loop
+    return asyncio.ensure_future(task)
@@ -1,8 +1,13 @@
+import json
 from typing import Any
 from libem.core.model import (
     openai, llama, claude, gemini
 )
 from libem.core import exec
+from libem.optimize.cache import (
+    parameter as cache_parameter,
+    response as response_cache,
+)
 
 
 def format_text(*args, **kwargs) -> dict:
@@ -24,18 +29,58 @@ def call(*args, **kwargs) -> dict:
 
 
 async def async_call(*args, **kwargs) -> dict:
-    model = kwargs.get("model", "")
-    match model:
-        case "llama3" | "llama3.1" | "llama3.2-3b" | "llama3.2-1b":
-            return llama.call(*args, **kwargs)
-        case "claude-3-5-sonnet-20240620":
+    if not cache_parameter.response():
+        return await _scheduled_call(*args, **kwargs)
+
+    key = response_cache.key(*args, **kwargs)
+    response = response_cache.get(key)
+    if response is None:
+        response = await _scheduled_call(*args, **kwargs)
+        response_cache.put(key, response)
+    return response
+
+
+async def _scheduled_call(*args, **kwargs) -> dict:
+    scheduler = exec.get_scheduler()
+    if scheduler is None:
+        return await _async_call(*args, **kwargs)
+
+    return await scheduler.run(
+        model=kwargs.get("model", ""),
+        tokens=estimate_tokens(kwargs.get("prompt", args[0] if args else "")),
+        call=lambda: _async_call(*args, **kwargs),
+    )
+
+
+def estimate_tokens(prompt: str | list | dict) -> int:
+    # roughly four characters per token
+    return len(json.dumps(prompt, default=str)) // 4 + 1
+
+
+async def _async_call(*args, **kwargs) -> dict:
+    match provider(kwargs.get("model", "")):
+        case "llama":
+            return await llama.async_call(*args, **kwargs)
+        case "claude":
             return await claude.async_call(*args, **kwargs)
-        case _ if model in gemini.MODELS:
+        case "gemini":
             return await gemini.async_call(*args, **kwargs)
         case _:
             return await openai.async_call(*args, **kwargs)
 
 
+def provider(model: str) -> str:
+    match model:
+        case _ if model in llama.MODELS:
+            return "llama"
+        case "claude-3-5-sonnet-20240620":
+            return "claude"
+        case _ if model in gemini.MODELS:
+            return "gemini"
+        case _:
+            return "openai"
+
+
 def reset():
     openai.reset()
     claude.reset()
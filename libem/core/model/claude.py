@@ -1,41 +1,36 @@
 import os
 import json
-import httpx
 import importlib
 import inspect
 
 from anthropic import (
-    AsyncAnthropic, APITimeoutError
+    AsyncAnthropic, APITimeoutError, RateLimitError
 )
 
 import libem
-from libem.core import exec
+from libem.core import exec, transport
+from libem.optimize.cache import (
+    parameter as cache_parameter,
+    provider as cache_provider,
+)
 
 os.environ.setdefault(
     "CLAUDE_API_KEY",
     libem.LIBEM_CONFIG.get("CLAUDE_API_KEY", "")
 )
 
-_client = None
-
 
 def get_client():
-    global _client
-
     if not os.environ.get("CLAUDE_API_KEY"):
         raise EnvironmentError(f"CLAUDE_API_KEY is not set.")
 
-    if not _client:
-        _client = AsyncAnthropic(
+    return transport.get_client(
+        "claude",
+        lambda http_client: AsyncAnthropic(
             api_key=os.environ["CLAUDE_API_KEY"],
-            http_client=httpx.AsyncClient(
-                limits=httpx.Limits(
-                    max_connections=1000,
-                    max_keepalive_connections=100
-                )
-            )
+            http_client=http_client,
         )
-    return _client
+    )
 
 
 def call(*args, **kwargs) -> dict:
@@ -91,10 +86,15 @@ async def async_call(
             user_messages.insert(0, msg)
 
     messages = user_messages
+    if cache_parameter.provider():
+        system_message, messages = cache_provider.mark(
+            system_message, messages
+        )
 
     # trace variables
     num_model_calls = 0
     num_input_tokens, num_output_tokens = 0, 0
+    num_cached_tokens, num_cache_write_tokens = 0, 0
     tool_usages, tool_outputs = [], []
 
     """Start call"""
@@ -110,12 +110,17 @@ async def async_call(
             )
         except APITimeoutError as e:  # catch timeout error
             raise libem.ModelTimedoutException(e)
+        except RateLimitError as e:
+            raise libem.ModelRateLimitedException(e)
         
         response_message = response.content[0].text
         print(response_message)
         num_model_calls += 1
-        num_input_tokens += response.usage.input_tokens
-        num_output_tokens += response.usage.input_tokens
+        cache_read, cache_write = cache_provider.claude_cached_tokens(response.usage)
+        num_input_tokens += response.usage.input_tokens + cache_read + cache_write
+        num_output_tokens += response.usage.output_tokens
+        num_cached_tokens += cache_read
+        num_cache_write_tokens += cache_write
     else:
         # Load the tool modules
         tools = [importlib.import_module(tool) for tool in tools]
@@ -144,13 +149,18 @@ async def async_call(
             
         except APITimeoutError as e:  # catch timeout error
             raise libem.ModelTimedoutException(e)
+        except RateLimitError as e:
+            raise libem.ModelRateLimitedException(e)
 
         response_message = response.content[0].text
         tool_uses = response_message.tool_use
         
         num_model_calls += 1
-        num_input_tokens += response.usage.input_tokens
-        num_output_tokens += response.usage.input_tokens
+        cache_read, cache_write = cache_provider.claude_cached_tokens(response.usage)
+        num_input_tokens += response.usage.input_tokens + cache_read + cache_write
+        num_output_tokens += response.usage.output_tokens
+        num_cached_tokens += cache_read
+        num_cache_write_tokens += cache_write
 
         # Call tools
         while tool_use:
@@ -204,13 +214,18 @@ async def async_call(
                     )
                 except APITimeoutError as e:  # catch timeout error
                     raise libem.ModelTimedoutException(e)
+                except RateLimitError as e:
+                    raise libem.ModelRateLimitedException(e)
 
                 response_message = response.content[0].text
                 tool_uses = response_message.tool_use
                 
                 num_model_calls += 1
-                num_input_tokens += response.usage.input_tokens
-                num_output_tokens += response.usage.input_tokens
+                cache_read, cache_write = cache_provider.claude_cached_tokens(response.usage)
+                num_input_tokens += response.usage.input_tokens + cache_read + cache_write
+                num_output_tokens += response.usage.output_tokens
+                num_cached_tokens += cache_read
+                num_cache_write_tokens += cache_write
 
             if num_model_calls == max_model_call:
                 libem.debug(f"[model] max call reached: "
@@ -227,6 +242,9 @@ async def async_call(
             "num_model_calls": num_model_calls,
             "num_input_tokens": num_input_tokens,
             "num_output_tokens": num_output_tokens,
+            "num_cached_tokens": num_cached_tokens,
+            "num_cache_write_tokens": num_cache_write_tokens,
+            "model": model,
         }
     })
 
@@ -238,10 +256,11 @@ async def async_call(
             "num_model_calls": num_model_calls,
             "num_input_tokens": num_input_tokens,
             "num_output_tokens": num_output_tokens,
+            "num_cached_tokens": num_cached_tokens,
+            "num_cache_write_tokens": num_cache_write_tokens,
         }
     }
 
 
 def reset():
-    global _client
-    _client = None
\ No newline at end of file
+    transport.close("claude")
\ No newline at end of file
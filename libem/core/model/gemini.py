@@ -1,16 +1,15 @@
 import os
 import json
-import httpx
 import importlib
 import inspect
 import numpy as np
 
 from openai import (
-    AsyncOpenAI, APITimeoutError
+    AsyncOpenAI, APITimeoutError, RateLimitError
 )
 
 import libem
-from libem.core import exec
+from libem.core import exec, transport
 from libem.core.util import create_json_schema
 
 os.environ.setdefault(
@@ -18,31 +17,23 @@ os.environ.setdefault(
     libem.LIBEM_CONFIG.get("GOOGLE_API_KEY", "")
 )
 
-_client = None
-
 MODELS = ["gemini-2.0-flash", "gemini-2.0-flash-lite", 
           "gemini-1.5-flash", "gemini-1.5-flash-8b", 
           "gemini-1.5-pro"]
 
 
 def get_client():
-    global _client
-
     if not os.environ.get("GOOGLE_API_KEY"):
         raise EnvironmentError(f"GOOGLE_API_KEY is not set.")
 
-    if not _client:
-        _client = AsyncOpenAI(
+    return transport.get_client(
+        "gemini",
+        lambda http_client: AsyncOpenAI(
             api_key=os.environ.get("GOOGLE_API_KEY"),
             base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-            http_client=httpx.AsyncClient(
-                limits=httpx.Limits(
-                    max_connections=1000,
-                    max_keepalive_connections=100
-                )
-            ),
+            http_client=http_client,
         )
-    return _client
+    )
 
 
 def format_text(text: str) -> dict:
@@ -166,6 +157,8 @@ async def async_call(
         )
     except APITimeoutError as e:  # catch timeout error
         raise libem.ModelTimedoutException(e)
+    except RateLimitError as e:
+        raise libem.ModelRateLimitedException(e)
 
     response_message = response.choices[0].message
     tool_calls = response_message.tool_calls
@@ -223,6 +216,8 @@ async def async_call(
                 )
             except APITimeoutError as e:  # catch timeout error
                 raise libem.ModelTimedoutException(e)
+            except RateLimitError as e:
+                raise libem.ModelRateLimitedException(e)
 
             response_message = response.choices[0].message
             tool_calls = response_message.tool_calls
@@ -264,5 +259,4 @@ async def async_call(
 
 
 def reset():
-    global _client
-    _client = None
+    transport.close("gemini")
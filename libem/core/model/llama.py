@@ -1,22 +1,48 @@
+import json
 import time
+import hashlib
 import platform
+from collections import OrderedDict
 
 import libem
+from libem.core import exec
+from libem.optimize.cache import parameter as cache_parameter
 
-_model, _tokenizer = None, None
+MODELS = {"llama3", "llama3.1", "llama3.2-3b", "llama3.2-1b"}
+
+# the most queued prompts generated together
+MAX_BATCH_SIZE = 8
+
+_worker = None
+_model, _tokenizer, _model_name = None, None, None
+
+# prefix digest -> (model state after the prefix, time to evaluate it)
+_prefixes = OrderedDict()
 
 """ Llama """
 
+BOS = "<|begin_of_text|>"
+SYS = "<|start_header_id|>system<|end_header_id|>"
+USER = "<|start_header_id|>user<|end_header_id|>"
+ASSIS = "<|start_header_id|>assistant<|end_header_id|>"
+EOS = "<|eot_id|>"
+
 
-def call(prompt: str | list | dict,
-         tools: list[str] = None,
-         context: list = None,
-         model: str = "llama3",
-         temperature: float = 0.0,
-         seed: int = None,
-         max_model_call: int = 3,
-         ) -> dict:
-    global _model, _tokenizer
+def call(*args, **kwargs) -> dict:
+    return exec.run_async_task(
+        async_call(*args, **kwargs)
+    )
+
+
+async def async_call(prompt: str | list | dict,
+                     tools: list[str] = None,
+                     context: list = None,
+                     model: str = "llama3",
+                     temperature: float = 0.0,
+                     seed: int = None,
+                     max_model_call: int = 3,
+                     ) -> dict:
+    global _worker
 
     # format the prompt to messages
     match prompt:
@@ -33,122 +59,278 @@ def call(prompt: str | list | dict,
             raise ValueError(f"Invalid prompt type: {type(prompt)}")
     message_openai = (messages or []) + (context or [])
 
-    if model in ["llama3", "llama3.1", "llama3.2-3b", "llama3.2-1b"]:
-        BOS = "<|begin_of_text|>"
-        SYS = "<|start_header_id|>system<|end_header_id|>"
-        USER = "<|start_header_id|>user<|end_header_id|>"
-        ASSIS = "<|start_header_id|>assistant<|end_header_id|>"
-        EOS = "<|eot_id|>"
-
-        input_text = BOS
-        for message in messages:
-            if message['role'] == 'system':
-                input_text = input_text + SYS + message['content'] + EOS
-            elif message['role'] == 'user':
-                input_text = input_text + USER + message['content'] + EOS
-        input_text = input_text + ASSIS
+    if model not in MODELS:
+        raise ValueError(f"{model} is not supported.")
+    if tools:
+        raise libem.ToolUseUnsupported("Tool use is not supported")
+
+    input_text = BOS
+    for message in messages:
+        if message['role'] == 'system':
+            input_text = input_text + SYS + message['content'] + EOS
+        elif message['role'] == 'user':
+            input_text = input_text + USER + message['content'] + EOS
+    input_text = input_text + ASSIS
 
     context = context or []
     messages = context + [input_text]
 
-    # apple silicon
-    if platform.machine() == "arm64" and platform.system() == "Darwin":
-        # first check whether mlx_lm is installed
-        try:
-            from mlx_lm import load, generate
-        except ImportError:
-            raise ImportError("mlx_lm is not installed.")
-    
-        # Load the model using MLX for apple silicon device
-        if model == "llama3":
-            model_path = "mlx-community/Meta-Llama-3-8B-Instruct-8bit"
-        elif model == "llama3.1":
-            model_path = "mlx-community/Meta-Llama-3.1-8B-Instruct-8bit"
-        elif model == "llama3.2-3b":
-            model_path = "mlx-community/Llama-3.2-3B-Instruct-8bit"
-        elif model == "llama3.2-1b":
-            model_path = "mlx-community/Llama-3.2-1B-Instruct-8bit"
-        else:
-            raise ValueError(f"{model} is not supported.")
-
-        if _model is None or _tokenizer is None:
-            start = time.time()
-            _model, _tokenizer = load(model_path)
-            libem.debug(f"model loaded in {time.time() - start:.2f} seconds.")
-        else:
-            libem.debug("model loaded from cache")
-        model, tokenizer = _model, _tokenizer
-
-        if tools:
-            raise libem.ToolUseUnsupported("Tool use is not supported")
-
-        response = generate(model, tokenizer, prompt=messages[0], temp=temperature)
-        response_message = "messages is not supported"
-
-    else:
-        try:
-            from llama_cpp import Llama
-        except ImportError:
-            raise ImportError("llama.cpp is not installed.")
-        if model == "llama3":
-            model_path = "bartowski/Meta-Llama-3-8B-Instruct-GGUF"
-            model_name = "Meta-Llama-3-8B-Instruct-Q5_K_S.gguf"
-        elif model == "llama3.1":
-            model_path = "bartowski/Meta-Llama-3.1-8B-Instruct-GGUF"
-            model_name = "Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
-        elif model == "llama3.2-3b":
-            model_path = "bartowski/Llama-3.2-3B-Instruct-GGUF"
-            model_name = "Llama-3.2-3B-Instruct-Q4_K_M.gguf"
-        elif model == "llama3.2-1b":
-            model_path = "bartowski/Llama-3.2-1B-Instruct-GGUF"
-            model_name = "Llama-3.2-1B-Instruct-Q4_K_M.gguf"
-        else:
-            raise ValueError(f"{model} is not supported.")
-
-        if _model is None or _tokenizer is None:
-            start = time.time()
-            _model = Llama.from_pretrained(
-                repo_id=model_path,
-                filename=model_name,
-                temperature=temperature,
-                seed=seed,
-                verbose=True
-            )
-            libem.debug(f"model loaded in {time.time() - start:.2f} seconds.")
-        else:
-            libem.debug("model loaded from cache")
-        model = _model
+    # inference runs on the worker thread, leaving
+    # the event loop free while the model generates
+    if _worker is None:
+        _worker = exec.Worker(generate,
+                              max_batch_size=MAX_BATCH_SIZE,
+                              name="libem-llama")
+    response = await _worker.submit({
+        "model": model,
+        "messages": message_openai,
+        "input_text": input_text,
+        "temperature": temperature,
+        "seed": seed,
+    })
 
-        if tools:
-            raise libem.ToolUseUnsupported("Tool use is not supported")
+    if "prefix_hit" in response:
+        if response["prefix_hit"]:
+            libem.trace.add({"cache": {"prefix": {
+                "num_hits": 1, "time_saved": response["time_saved"],
+            }}})
         else:
-            response = model.create_chat_completion(messages=message_openai)
-            response_message = response['choices'][0]['message']
-            response = response_message['content']
+            libem.trace.add({"cache": {"prefix": {"num_misses": 1}}})
 
-    # TBD: get input and output tokens count
     libem.trace.add({
         "model": {
             "messages": messages,
             "num_model_calls": 1,
-            "num_input_tokens": -1,
-            "num_output_tokens": -1,
+            "num_input_tokens": response["num_input_tokens"],
+            "num_output_tokens": response["num_output_tokens"],
             "model": model,
         }
     })
 
     return {
-        "output": response,
-        "messages": response_message,
+        "output": response["output"],
+        "messages": response["message"],
         "tool_outputs": "Tool output is not supported",
         "stats": {
             "num_model_calls": 1,
-            "num_input_tokens": -1,
-            "num_output_tokens": -1,
+            "num_input_tokens": response["num_input_tokens"],
+            "num_output_tokens": response["num_output_tokens"],
         }
     }
 
 
+def generate(requests: list[dict]) -> list[dict | Exception]:
+    ''' Generate the responses to the queued requests, on the worker thread. '''
+    # requests with the same settings are generated together
+    groups = {}
+    for i, request in enumerate(requests):
+        key = request["model"], request["temperature"], request["seed"]
+        groups.setdefault(key, []).append(i)
+
+    responses = [None] * len(requests)
+    for (model, temperature, seed), indices in groups.items():
+        batch = [requests[i] for i in indices]
+        try:
+            if _apple_silicon():
+                outputs = _mlx_generate(model, temperature, batch)
+            else:
+                outputs = _llama_cpp_generate(model, temperature, seed, batch)
+        except Exception as e:
+            outputs = [e] * len(batch)
+
+        for i, output in zip(indices, outputs):
+            responses[i] = output
+    return responses
+
+
+def _apple_silicon() -> bool:
+    return platform.machine() == "arm64" and platform.system() == "Darwin"
+
+
+def _mlx_generate(model: str, temperature: float, batch: list[dict]) -> list[dict]:
+    global _model, _tokenizer, _model_name
+
+    # first check whether mlx_lm is installed
+    try:
+        from mlx_lm import load, generate
+    except ImportError:
+        raise ImportError("mlx_lm is not installed.")
+    try:
+        from mlx_lm import batch_generate
+    except ImportError:
+        batch_generate = None
+    try:
+        from mlx_lm.sample_utils import make_sampler
+    except ImportError:
+        make_sampler = None
+
+    # Load the model using MLX for apple silicon device
+    if model == "llama3":
+        model_path = "mlx-community/Meta-Llama-3-8B-Instruct-8bit"
+    elif model == "llama3.1":
+        model_path = "mlx-community/Meta-Llama-3.1-8B-Instruct-8bit"
+    elif model == "llama3.2-3b":
+        model_path = "mlx-community/Llama-3.2-3B-Instruct-8bit"
+    elif model == "llama3.2-1b":
+        model_path = "mlx-community/Llama-3.2-1B-Instruct-8bit"
+    else:
+        raise ValueError(f"{model} is not supported.")
+
+    if _model is None or _tokenizer is None or _model_name != model:
+        start = time.time()
+        _model, _tokenizer = load(model_path)
+        _model_name = model
+        libem.debug(f"model loaded in {time.time() - start:.2f} seconds.")
+    else:
+        libem.debug("model loaded from cache")
+    tokenizer = _tokenizer
+
+    prompts = [tokenizer.encode(request["input_text"]) for request in batch]
+
+    # batched decoding samples greedily
+    if batch_generate is not None and len(batch) > 1 and temperature == 0:
+        outputs = batch_generate(_model, tokenizer,
+                                 prompts=prompts, verbose=False).texts
+    else:
+        # newer mlx_lm versions take a sampler rather than temp
+        if make_sampler is not None:
+            sampling = {"sampler": make_sampler(temp=temperature)}
+        else:
+            sampling = {"temp": temperature}
+        outputs = [
+            generate(_model, tokenizer,
+                     prompt=request["input_text"], **sampling)
+            for request in batch
+        ]
+
+    return [
+        {
+            "output": output,
+            "message": "messages is not supported",
+            "num_input_tokens": len(prompt),
+            "num_output_tokens": len(tokenizer.encode(output)),
+        }
+        for prompt, output in zip(prompts, outputs)
+    ]
+
+
+def _llama_cpp_generate(model: str, temperature: float, seed: int,
+                        batch: list[dict]) -> list[dict]:
+    global _model, _model_name
+
+    try:
+        from llama_cpp import Llama
+    except ImportError:
+        raise ImportError("llama.cpp is not installed.")
+    if model == "llama3":
+        model_path = "bartowski/Meta-Llama-3-8B-Instruct-GGUF"
+        model_name = "Meta-Llama-3-8B-Instruct-Q5_K_S.gguf"
+    elif model == "llama3.1":
+        model_path = "bartowski/Meta-Llama-3.1-8B-Instruct-GGUF"
+        model_name = "Meta-Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+    elif model == "llama3.2-3b":
+        model_path = "bartowski/Llama-3.2-3B-Instruct-GGUF"
+        model_name = "Llama-3.2-3B-Instruct-Q4_K_M.gguf"
+    elif model == "llama3.2-1b":
+        model_path = "bartowski/Llama-3.2-1B-Instruct-GGUF"
+        model_name = "Llama-3.2-1B-Instruct-Q4_K_M.gguf"
+    else:
+        raise ValueError(f"{model} is not supported.")
+
+    if _model is None or _model_name != model:
+        start = time.time()
+        _prefixes.clear()
+        _model = Llama.from_pretrained(
+            repo_id=model_path,
+            filename=model_name,
+            temperature=temperature,
+            seed=seed,
+            verbose=True
+        )
+        _model_name = model
+        libem.debug(f"model loaded in {time.time() - start:.2f} seconds.")
+    else:
+        libem.debug("model loaded from cache")
+
+    # the high-level llama.cpp API decodes a single sequence
+    # at a time, so the requests are generated one by one
+    return [
+        _llama_cpp_complete(request["messages"], temperature, seed)
+        for request in batch
+    ]
+
+
+def _llama_cpp_complete(messages: list[dict], temperature: float, seed: int) -> dict:
+    '''
+    Complete the messages with the loaded llama.cpp model. The model
+    state after the messages before the last one, e.g., the system
+    prompt and the shots shared by all pairs in matching, is saved
+    and restored on later calls, so that llama.cpp only evaluates
+    the tokens after the prefix.
+    '''
+    prefix = messages[:-1]
+    tokens = _tokenize(format_messages(messages, generation=True))
+
+    response = {}
+    if prefix and cache_parameter.prefix():
+        key = hashlib.md5(
+            json.dumps([_model_name, prefix], sort_keys=True).encode()
+        ).hexdigest()
+
+        if key in _prefixes:
+            _prefixes.move_to_end(key)
+            state, eval_time = _prefixes[key]
+            _model.load_state(state)
+            response.update(prefix_hit=True, time_saved=eval_time)
+        else:
+            start = time.time()
+            _model.reset()
+            _model.eval(_tokenize(format_messages(prefix)))
+            _prefixes[key] = _model.save_state(), time.time() - start
+            while len(_prefixes) > max(cache_parameter.max_prefixes(), 0):
+                _prefixes.popitem(last=False)
+            response.update(prefix_hit=False)
+
+    # llama.cpp keeps the evaluated tokens shared
+    # with the prompt and evaluates only the rest
+    completion = _model.create_completion(
+        prompt=tokens,
+        max_tokens=None,
+        temperature=temperature,
+        seed=seed,
+        stop=[EOS],
+    )
+    output = completion['choices'][0]['text']
+    usage = completion.get('usage') or {}
+
+    response.update({
+        "output": output,
+        "message": {"role": "assistant", "content": output},
+        "num_input_tokens": usage.get('prompt_tokens', len(tokens)),
+        "num_output_tokens": usage.get('completion_tokens', 0),
+    })
+    return response
+
+
+def format_messages(messages: list[dict], generation: bool = False) -> str:
+    ''' Format the messages with the Llama 3 chat template. '''
+    text = BOS
+    for message in messages:
+        text += f"<|start_header_id|>{message['role']}<|end_header_id|>\n\n" \
+                f"{message['content'].strip()}{EOS}"
+    if generation:
+        text += f"{ASSIS}\n\n"
+    return text
+
+
+def _tokenize(text: str) -> list[int]:
+    return _model.tokenize(text.encode(), add_bos=False, special=True)
+
+
 def reset():
-    global _model, _tokenizer
-    _model, _tokenizer = None, None
+    global _worker, _model, _tokenizer, _model_name
+    if _worker is not None:
+        _worker.stop()
+    _worker = None
+    _model, _tokenizer, _model_name = None, None, None
+    _prefixes.clear()
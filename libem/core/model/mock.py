@@ -0,0 +1,290 @@
+"""
+A local stand-in for the OpenAI chat completions API.
+
+The server answers match prompts without a model so that the
+throughput of libem (concurrency, batching, caching) can be
+measured offline. Answers are deterministic: pairs labeled with
+the server are answered by their labels, and other pairs by a
+hash of their text. Latency, token counts and rate limit errors
+(429s) are simulated.
+
+Point libem at a running server with:
+
+    libem.calibrate({"libem.parameter.base_url": server.base_url})
+"""
+import re
+import json
+import math
+import time
+import random
+import hashlib
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import libem
+
+QUERY = re.compile(r"Left entity: (.*)\.\nRight entity: (.*)\.", re.S)
+NUMBERED = re.compile(r"(?:^|\n)\d+:\n")
+# the shortest prefix providers cache and the increments it grows by
+MIN_CACHED_TOKENS, CACHED_TOKENS_STEP = 1024, 128
+EXPLANATION = "The entities were compared by the mock server."
+
+
+class Server:
+    """
+    A mock OpenAI-compatible server running on a background thread.
+
+    latency: the mean latency (in seconds) of a response.
+    distribution: the latency distribution, one of "constant",
+                  "exponential" or "lognormal".
+    sigma: the shape of the lognormal distribution.
+    error_rate: the fraction of requests rejected with a 429.
+    match_rate: the fraction of unlabeled pairs answered "yes".
+    chars_per_token: the characters counted as one token.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0,
+                 latency: float = 0.0,
+                 distribution: str = "constant",
+                 sigma: float = 0.5,
+                 error_rate: float = 0.0,
+                 match_rate: float = 0.5,
+                 chars_per_token: float = 4,
+                 seed: int = libem.LIBEM_SEED):
+        if distribution not in {"constant", "exponential", "lognormal"}:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+
+        self.latency = latency
+        self.distribution = distribution
+        self.sigma = sigma
+        self.error_rate = error_rate
+        self.match_rate = match_rate
+        self.chars_per_token = chars_per_token
+
+        self.labels: dict[tuple[str, str], bool] = {}
+        self.num_requests = 0
+        self.num_errors = 0
+
+        self._random = random.Random(seed)
+        self._prefixes = set()
+        self._lock = threading.Lock()
+
+        self._server = _HTTPServer((host, port), _handler(self))
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def start(self) -> "Server":
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def label(self, left: str, right: str, label: bool | int | str):
+        ''' Answer the pair, in either order, by its label. '''
+        if isinstance(label, str):
+            label = label.lower() == "yes"
+        self.labels[left.strip(), right.strip()] = bool(label)
+        self.labels[right.strip(), left.strip()] = bool(label)
+
+    def answer(self, left: str, right: str) -> bool:
+        label = self.labels.get((left.strip(), right.strip()))
+        if label is None:
+            digest = hashlib.md5(f"{left} {right}".encode()).digest()
+            label = int.from_bytes(digest[:4], "big") / 2 ** 32 < self.match_rate
+        return label
+
+    def complete(self, body: dict) -> tuple[int, dict]:
+        ''' Respond to a chat completion request, returning the status. '''
+        with self._lock:
+            self.num_requests += 1
+            throttled = self._random.random() < self.error_rate
+            delay = self._delay()
+        time.sleep(delay)
+
+        if throttled:
+            with self._lock:
+                self.num_errors += 1
+            return 429, {"error": {
+                "message": "Rate limit reached (mock).",
+                "type": "requests",
+                "code": "rate_limit_exceeded",
+            }}
+
+        messages = body.get("messages", [])
+        system = " ".join(_text(m) for m in messages if m.get("role") == "system")
+        query = _text(messages[-1]) if messages else ""
+        likelihood = "between 0.0 and 1.0" in system
+
+        answers = [self.answer(l, r) for l, r in parse_pairs(query)]
+        schema = (body.get("response_format") or {}) \
+            .get("json_schema", {}).get("schema")
+        if schema is not None:
+            content = json.dumps(structured(schema, answers, likelihood))
+        elif len(answers) > 1:
+            content = "\n".join(
+                f"{i + 1}: {_format(a, likelihood)}"
+                for i, a in enumerate(answers)
+            )
+        else:
+            # follow the chain-of-thought and confidence instructions
+            content = _format(answers[0], likelihood)
+            if "step by step" in system:
+                content = f"{EXPLANATION}\n{content}"
+            if "confidence score" in system:
+                content = f"{content}\nConfidence Score: 1.0"
+
+        prompt_tokens = self._tokens(json.dumps(messages))
+        completion_tokens = self._tokens(content)
+        return 200, {
+            "id": f"chatcmpl-mock-{self.num_requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {
+                    "cached_tokens": self._cached_tokens(messages[:-1]),
+                },
+            },
+        }
+
+    def _delay(self) -> float:
+        match self.distribution:
+            case "exponential":
+                return self._random.expovariate(1 / self.latency) \
+                    if self.latency > 0 else 0
+            case "lognormal":
+                # the mean of a lognormal is exp(mu + sigma^2 / 2)
+                return self._random.lognormvariate(
+                    math.log(self.latency) - self.sigma ** 2 / 2, self.sigma
+                ) if self.latency > 0 else 0
+            case _:
+                return self.latency
+
+    def _tokens(self, text: str) -> int:
+        return int(len(text) / self.chars_per_token) + 1
+
+    def _cached_tokens(self, prefix: list[dict]) -> int:
+        ''' Tokens of a repeated prefix, cached as providers do. '''
+        if not prefix:
+            return 0
+        text = json.dumps(prefix, sort_keys=True)
+        with self._lock:
+            seen = text in self._prefixes
+            self._prefixes.add(text)
+        tokens = self._tokens(text)
+        if not seen or tokens < MIN_CACHED_TOKENS:
+            return 0
+        return tokens - tokens % CACHED_TOKENS_STEP
+
+
+def parse_pairs(query: str) -> list[tuple[str, str]]:
+    ''' The pairs in a single, prompt batch or record batch query. '''
+    if "\nRight entities:\n" in query:
+        left, right = query.split("\nRight entities:\n", 1)
+        left = left.removeprefix("Left entity:\n")
+        return [(left, r) for r in NUMBERED.split(right) if r]
+
+    pairs = []
+    for part in NUMBERED.split(query):
+        match = QUERY.fullmatch(part.strip())
+        if match:
+            pairs.append(match.groups())
+    # unrecognized queries are answered as one pair
+    return pairs or [(query, "")]
+
+
+def structured(schema: dict, answers: list[bool], likelihood: bool):
+    ''' An instance of the output schema giving the answers. '''
+    properties = schema.get("properties", {})
+    if "answers" in properties:
+        item = properties["answers"].get("items", {})
+        return {"answers": [structured(item, [a], likelihood) for a in answers]}
+
+    answer = answers[0] if answers else False
+    output = {}
+    for name, field in properties.items():
+        match name:
+            case "answer":
+                numeric = field.get("type") in {"number", "integer"} or likelihood
+                output[name] = float(answer) if numeric else _format(answer, False)
+            case "confidence":
+                output[name] = 1.0
+            case "explanation":
+                output[name] = EXPLANATION
+            case _:
+                output[name] = None
+    return output
+
+
+def _format(answer: bool, likelihood: bool) -> str:
+    if likelihood:
+        return "1.0" if answer else "0.0"
+    return "yes" if answer else "no"
+
+
+def _text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content
+                         if part.get("type") == "text")
+    return content
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # accept as many pending connections as libem opens at once
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+def _handler(server: Server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+
+            if self.path.rstrip("/").endswith("/chat/completions"):
+                status, response = server.complete(body)
+            else:
+                status, response = 404, {"error": {
+                    "message": f"Unknown endpoint {self.path} (mock).",
+                    "type": "invalid_request_error",
+                }}
+
+            payload = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            if status == 429:
+                self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
@@ -1,42 +1,41 @@
 import os
 import json
-import httpx
 import importlib
 import inspect
 import numpy as np
 
 from openai import (
-    AsyncOpenAI, APITimeoutError
+    AsyncOpenAI, APITimeoutError, RateLimitError
 )
 
 import libem
-from libem.core import exec
+from libem.core import exec, transport
 from libem.core.util import create_json_schema
+from libem.optimize.cache import (
+    parameter as cache_parameter,
+    provider as cache_provider,
+)
 
 os.environ.setdefault(
     "OPENAI_API_KEY",
     libem.LIBEM_CONFIG.get("OPENAI_API_KEY", "")
 )
 
-_client = None
-
 
 def get_client():
-    global _client
-
-    if not os.environ.get("OPENAI_API_KEY"):
+    # a custom endpoint, e.g., a local mock server, needs no key
+    base_url = libem.parameter.base_url()
+    if not base_url and not os.environ.get("OPENAI_API_KEY"):
         raise EnvironmentError(f"OPENAI_API_KEY is not set.")
 
-    if not _client:
-        _client = AsyncOpenAI(
-            http_client=httpx.AsyncClient(
-                limits=httpx.Limits(
-                    max_connections=1000,
-                    max_keepalive_connections=100
-                )
-            )
+    return transport.get_client(
+        f"openai@{base_url}" if base_url else "openai",
+        lambda http_client: AsyncOpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY") or "none",
+            base_url=base_url,
+            http_client=http_client,
         )
-    return _client
+    )
 
 
 def format_text(text: str) -> dict:
@@ -117,10 +116,13 @@ async def async_call(
             raise ValueError(f"Invalid prompt type: {type(prompt)}")
 
     messages = context + messages
+    if cache_parameter.provider():
+        messages = cache_provider.layout(messages)
 
     # trace variables
     num_model_calls = 0
     num_input_tokens, num_output_tokens = 0, 0
+    num_cached_tokens = 0
     tool_usages, tool_outputs = [], []
 
     """Start call"""
@@ -161,6 +163,8 @@ async def async_call(
         )
     except APITimeoutError as e:  # catch timeout error
         raise libem.ModelTimedoutException(e)
+    except RateLimitError as e:
+        raise libem.ModelRateLimitedException(e)
 
     response_message = response.choices[0].message
     tool_calls = response_message.tool_calls
@@ -169,6 +173,7 @@ async def async_call(
     num_input_tokens += response.usage.total_tokens - \
                         response.usage.completion_tokens
     num_output_tokens += response.usage.completion_tokens
+    num_cached_tokens += cache_provider.openai_cached_tokens(response.usage)
 
     # Call tools
     while tool_calls:
@@ -218,6 +223,8 @@ async def async_call(
                 )
             except APITimeoutError as e:  # catch timeout error
                 raise libem.ModelTimedoutException(e)
+            except RateLimitError as e:
+                raise libem.ModelRateLimitedException(e)
 
             response_message = response.choices[0].message
             tool_calls = response_message.tool_calls
@@ -226,6 +233,7 @@ async def async_call(
             num_input_tokens += response.usage.total_tokens - \
                                 response.usage.completion_tokens
             num_output_tokens += response.usage.completion_tokens
+            num_cached_tokens += cache_provider.openai_cached_tokens(response.usage)
 
         if num_model_calls == max_model_call:
             libem.debug(f"[model] max call reached: "
@@ -242,6 +250,7 @@ async def async_call(
             "num_model_calls": num_model_calls,
             "num_input_tokens": num_input_tokens,
             "num_output_tokens": num_output_tokens,
+            "num_cached_tokens": num_cached_tokens,
             "model": model,
         }
     })
@@ -254,10 +263,10 @@ async def async_call(
             "num_model_calls": num_model_calls,
             "num_input_tokens": num_input_tokens,
             "num_output_tokens": num_output_tokens,
+            "num_cached_tokens": num_cached_tokens,
         }
     }
 
 
 def reset():
-    global _client
-    _client = None
+    transport.close("openai")
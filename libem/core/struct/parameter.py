@@ -1,6 +1,7 @@
 import abc
 import typing
 import copy
+import functools
 
 
 class Tunable(abc.ABC):
@@ -31,6 +32,10 @@ class Index:
 
 
 class Parameter(Tunable):
+    # bumped whenever any parameter is updated, so that
+    # values derived from parameters can be kept per epoch
+    epoch = 0
+
     def __init__(self,
                  default: Index | typing.Any,
                  options: dict[typing.Any] | list[typing.Any] = None
@@ -91,10 +96,12 @@ class Parameter(Tunable):
                 self.value += param.value
             else:
                 self.value += param
+        Parameter.epoch += 1
         return self
 
     def update(self, value):
         self.value = self.v = value
+        Parameter.epoch += 1
         return self
 
     def search(self, train_data, metric):
@@ -113,3 +120,24 @@ class Parameter(Tunable):
 
     def copy(self):
         return copy.deepcopy(self)
+
+
+def per_epoch(func):
+    """
+    Memoize a function of hashable arguments until the next
+    parameter update, e.g., to build a prompt once per calibration.
+    """
+    cache, epoch = {}, [Parameter.epoch]
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if epoch[0] != Parameter.epoch:
+            cache.clear()
+            epoch[0] = Parameter.epoch
+        key = args, tuple(sorted(kwargs.items()))
+        if key not in cache:
+            cache[key] = func(*args, **kwargs)
+        return cache[key]
+
+    wrapper.cache_clear = cache.clear
+    return wrapper
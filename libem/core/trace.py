@@ -203,5 +203,21 @@ trace = Trace(
         Telemetry("model.num_model_calls"),
         Telemetry("model.num_input_tokens"),
         Telemetry("model.num_output_tokens"),
+        Telemetry("model.num_cached_tokens"),
+        Telemetry("model.num_cache_write_tokens"),
+        Telemetry("exec.num_throttles"),
+        Telemetry("exec.wait_time"),
+        Telemetry("cluster.num_conflicts"),
+        Telemetry("cluster.num_skipped_transitive"),
+        Telemetry("cluster.num_skipped_negative"),
+        Telemetry("cache.response.num_hits"),
+        Telemetry("cache.response.num_misses"),
+        Telemetry("cache.result.num_hits"),
+        Telemetry("cache.result.num_misses"),
+        Telemetry("cache.prefix.num_hits"),
+        Telemetry("cache.prefix.num_misses"),
+        Telemetry("cache.prefix.time_saved"),
+        Telemetry("transport.num_connections"),
+        Telemetry("transport.num_handshakes"),
     ],
 ).start()
@@ -0,0 +1,142 @@
+"""
+Pooled HTTP clients shared by the model backends.
+
+An httpx client keeps its connections open for reuse, but the
+connections belong to the event loop the client was first used
+on. The clients are hence pooled per provider and per event loop:
+each provider gets one client per loop, shared by all of its calls
+on that loop, and dropped with the loop. The pool limits are set
+through libem.parameter.
+"""
+import asyncio
+import importlib.util
+import weakref
+from typing import Any, Callable
+
+import httpx
+
+import libem
+
+# event loop -> provider -> (http client, provider client)
+_clients: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+# provider -> connection stats
+_stats: dict[str, dict] = {}
+
+
+def get_client(provider: str,
+               build: Callable[[httpx.AsyncClient], Any] = None) -> Any:
+    '''
+    The client of the provider on the running event loop, built
+    on first use around a pooled httpx client by build, e.g., an
+    SDK client taking the httpx client, or the httpx client itself.
+    Providers named "<name>@<endpoint>" are pooled per endpoint.
+    '''
+    loop = asyncio.get_running_loop()
+    clients = _clients.setdefault(loop, {})
+
+    if provider not in clients:
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=libem.parameter.max_connections(),
+                max_keepalive_connections=libem.parameter.max_keepalive_connections(),
+                keepalive_expiry=libem.parameter.keepalive_expiry(),
+            ),
+            http2=_http2(),
+            event_hooks={"request": [_hook(provider)]},
+        )
+        clients[provider] = (
+            http_client,
+            build(http_client) if build else http_client,
+        )
+    return clients[provider][1]
+
+
+async def aclose(provider: str = None):
+    ''' Close the clients of the running event loop. '''
+    for http_client in _pop(asyncio.get_running_loop(), provider):
+        await http_client.aclose()
+
+
+def close(provider: str = None):
+    '''
+    Close the clients of all event loops, or only those of the
+    provider. Clients of loops running elsewhere are closed on
+    their loop; clients of loops no longer running are dropped
+    together with their connections.
+    '''
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+
+    for loop in list(_clients.keys()):
+        if loop is not running and loop.is_running():
+            asyncio.run_coroutine_threadsafe(
+                _aclose(loop, provider), loop
+            ).result()
+        else:
+            _pop(loop, provider)
+
+
+async def _aclose(loop: asyncio.AbstractEventLoop, provider: str = None):
+    for http_client in _pop(loop, provider):
+        await http_client.aclose()
+
+
+def _pop(loop: asyncio.AbstractEventLoop, provider: str = None) -> list[httpx.AsyncClient]:
+    clients = _clients.get(loop, {})
+    popped = [
+        clients.pop(key)[0] for key in list(clients)
+        if provider is None or key.split("@")[0] == provider
+    ]
+    if not clients:
+        _clients.pop(loop, None)
+    return popped
+
+
+def stats() -> dict:
+    '''
+    Per-provider requests and the connections and TLS handshakes
+    they opened; the rest of the requests reused a connection.
+    '''
+    return {
+        provider: {
+            **stat,
+            "reuse": 1 - stat["num_connections"] / stat["num_requests"]
+            if stat["num_requests"] else 0.0,
+        }
+        for provider, stat in _stats.items()
+    }
+
+
+def reset_stats():
+    _stats.clear()
+
+
+def _http2() -> bool:
+    http2 = libem.parameter.http2()
+    if http2 and importlib.util.find_spec("h2") is None:
+        raise ImportError("h2 is not installed.")
+    return http2
+
+
+def _hook(provider: str):
+    stat = _stats.setdefault(provider, {
+        "num_requests": 0,
+        "num_connections": 0,
+        "num_handshakes": 0,
+    })
+
+    async def trace(event: str, info: dict):
+        if event == "connection.connect_tcp.complete":
+            stat["num_connections"] += 1
+            libem.trace.add({"transport": {"num_connections": 1}})
+        elif event == "connection.start_tls.complete":
+            stat["num_handshakes"] += 1
+            libem.trace.add({"transport": {"num_handshakes": 1}})
+
+    async def on_request(request: httpx.Request):
+        stat["num_requests"] += 1
+        request.extensions["trace"] = trace
+
+    return on_request
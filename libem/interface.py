@@ -28,14 +28,14 @@ def chat(message, context=None) -> dict:
 
 """ Programmatic access to tools """
 
-from libem.match.interface import match
+from libem.match.interface import match, match_stream
 from libem.block.interface import block
 from libem.extract.interface import extract
 from libem.resolve.cluster.interface import cluster
 from libem.resolve.dedupe.interface import dedupe
 from libem.resolve.link.interface import link
 
-_ = match, block, extract, cluster, dedupe, link
+_ = match, match_stream, block, extract, cluster, dedupe, link
 
 from libem.tune.calibrate.interface import (
     calibrate, reset, export
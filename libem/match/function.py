@@ -6,17 +6,28 @@ from pydantic import BaseModel
 from tqdm import tqdm
 from itertools import chain
 from pprint import pformat
-from typing import Coroutine
+from typing import (
+    Coroutine, Iterable,
+    Iterator, AsyncIterator
+)
 
 import libem
 from libem.match import prompt, parameter
 from libem.match.struct import (
-    _MultimodalRecord, parse_input
+    _MultimodalRecord, parse_input,
+    record_digest
 )
 from libem.core.struct import Prompt
+from libem.core.struct.parameter import per_epoch
+from libem.tune.learn.icl import given_shots
 from libem.core import (
     exec, model
 )
+from libem.optimize.cache import result as result_cache
+from libem.optimize.batch import (
+    provider as batch_provider,
+    parameter as batch_parameter,
+)
 
 schema = {
     "type": "function",
@@ -67,22 +78,41 @@ def sync_func(left: _MultimodalRecord | list[_MultimodalRecord],
         left, right = parse_input(left, right)
     
     if isinstance(left, _MultimodalRecord):
-        return exec.run_async_task(
-            once(left, right)
-        )
+        outputs, misses = lookup_cache([left], [right])
+        if misses:
+            update_cache([left], [right], outputs, [
+                (0, exec.run_async_task(once(left, right)))
+            ])
+        return outputs[0]
+
+    outputs, misses = lookup_cache(left, right)
+    if parameter.provider_batch():
+        return update_cache(left, right, outputs, list(zip(
+            misses, exec.run_async_task(provider_batch(
+                [left[i] for i in misses],
+                [right[i] for i in misses],
+            ))
+        )))
+
+    tasks, indices = create_tasks(
+        [left[i] for i in misses],
+        [right[i] for i in misses],
+    )
 
-    if parameter.batch_size() == 1:
-        tasks = create_once_tasks(left, right)
-    else:
-        tasks = create_batch_tasks(left, right)
+    # run the tasks one by one on a single event loop,
+    # so that they share its pooled connections
+    async def run_tasks():
+        results = []
+        for task in tqdm(tasks):
+            results.extend(await task)
+        return results
 
-    output = []
-    for task in tqdm(tasks):
-        output.extend(
-            exec.run_async_task(task)
-        )
+    results = exec.run_async_task(run_tasks())
 
-    return output
+    return update_cache(left, right, outputs, [
+        (misses[i], result) for i, result in
+        zip(chain.from_iterable(indices), results)
+    ])
 
 
 async def async_func(left: _MultimodalRecord | list[_MultimodalRecord], 
@@ -92,16 +122,170 @@ async def async_func(left: _MultimodalRecord | list[_MultimodalRecord],
         left, right = parse_input(left, right)
     
     if isinstance(left, _MultimodalRecord):
-        return await once(left, right)
+        outputs, misses = lookup_cache([left], [right])
+        if misses:
+            update_cache([left], [right], outputs, [
+                (0, await once(left, right))
+            ])
+        return outputs[0]
+
+    outputs, misses = lookup_cache(left, right)
+    if parameter.provider_batch():
+        return update_cache(left, right, outputs, list(zip(
+            misses, await provider_batch(
+                [left[i] for i in misses],
+                [right[i] for i in misses],
+            )
+        )))
+
+    tasks, indices = create_tasks(
+        [left[i] for i in misses],
+        [right[i] for i in misses],
+    )
+
+    results = []
+    if tasks:
+        results = chain.from_iterable(
+            await exec.proc_async_tasks(
+                tasks, rpm=parameter.rpm(), tpm=parameter.tpm(),
+                adaptive=parameter.adaptive_concurrency(), desc="Matching"
+            )
+        )
+
+    return update_cache(left, right, outputs, [
+        (misses[i], result) for i, result in
+        zip(chain.from_iterable(indices), results)
+    ])
+
+
+def stream(pairs: Iterable, window: int = libem.LIBEM_MAX_ASYNC_TASKS) -> Iterator[tuple[int, dict]]:
+    return exec.run_async_iter(
+        async_stream(pairs, window)
+    )
+
+
+async def async_stream(pairs: Iterable, window: int = libem.LIBEM_MAX_ASYNC_TASKS) -> AsyncIterator[tuple[int, dict]]:
+    '''
+    Match pairs drawn lazily from an iterable, yielding (index, output)
+    as soon as the task that matched the pair completes. Pairs are read
+    in chunks of batch_size and planned into tasks as in async_func;
+    at most `window` tasks are in flight at any time.
+    '''
+
+    async def _cached(outputs):
+        return outputs
+
+    async def _match(task, chunk, left, right, task_indices):
+        results = list(zip(task_indices, await task))
+        update_cache(left, right, [None] * len(left), results)
+        return [(chunk[i][0], output) for i, output in results]
+
+    def _tasks(chunk):
+        left, right = parse_input([pair for _, pair in chunk], None)
+
+        outputs, misses = lookup_cache(left, right)
+        hits = [(chunk[i][0], o) for i, o in enumerate(outputs) if o is not None]
+        if hits:
+            yield _cached(hits)
+
+        tasks, indices = create_tasks(
+            [left[i] for i in misses],
+            [right[i] for i in misses],
+        )
+        for task, task_indices in zip(tasks, indices):
+            yield _match(task, chunk, left, right,
+                         [misses[i] for i in task_indices])
+
+    def _chunks():
+        chunk, size = [], max(parameter.batch_size(), 1)
+        for i, pair in enumerate(pairs):
+            chunk.append((i, pair))
+            if len(chunk) == size:
+                yield from _tasks(chunk)
+                chunk = []
+        if chunk:
+            yield from _tasks(chunk)
+
+    tasks = exec.stream_async_tasks(
+        _chunks(), max_async_tasks=window,
+        rpm=parameter.rpm(), tpm=parameter.tpm(),
+        adaptive=parameter.adaptive_concurrency(), desc="Matching"
+    )
+    try:
+        async for outputs in tasks:
+            for output in outputs:
+                yield output
+    finally:
+        await tasks.aclose()
+
+
+def create_tasks(left: list[_MultimodalRecord], 
+                 right: list[_MultimodalRecord]) -> tuple[list[Coroutine], list[list[int]]]:
+    '''
+    Create the match tasks for the given pairs, along with
+    the indices of the pairs behind the outputs of each task.
+    '''
+    if parameter.batch_size() == 1:
+        return create_once_tasks(left, right), [[i] for i in range(len(left))]
+
+    tasks, indices = [], []
+    for batch_left, batch_right, batch_indices in plan_batches(left, right):
+        tasks.append(batch(batch_left, batch_right))
+        indices.append(batch_indices)
+    return tasks, indices
+
+
+async def provider_batch(left: list[_MultimodalRecord], 
+                         right: list[_MultimodalRecord]) -> list[dict]:
+    '''
+    Match the pairs in a single provider-side batch job, with the
+    prompts built and the responses parsed as in once and batch.
+    Pairs whose requests fail within the job are matched online.
+    '''
+    if model.provider(parameter.model()) != "openai":
+        raise ValueError(f"Provider-side batching is not "
+                         f"supported for {parameter.model()}.")
+
+    start = time.time()
 
     if parameter.batch_size() == 1:
-        tasks = create_once_tasks(left, right)
+        plan = [([l], [r], [i]) for i, (l, r) in enumerate(zip(left, right))]
+        calls = [once_call(l[0], r[0]) for l, r, _ in plan]
     else:
-        tasks = create_batch_tasks(left, right)
+        plan = plan_batches(left, right)
+        calls = [batch_call(l, r) for l, r, _ in plan]
 
-    return list(chain.from_iterable(
-        await exec.proc_async_tasks(tasks, rpm=parameter.rpm(), desc="Matching")
-    ))
+    responses = await batch_provider.run(
+        calls, job_id=batch_parameter.job_id()
+    )
+
+    outputs, failed = [None] * len(left), []
+    for (l, r, indices), call, response in zip(plan, calls, responses):
+        if response is None:
+            failed.append((l, r, indices))
+            continue
+
+        if parameter.batch_size() == 1:
+            results = [once_output(l[0], r[0], call, response, start)]
+        else:
+            results = batch_output(l, r, call, response, start)
+        for i, output in zip(indices, results):
+            outputs[i] = output
+
+    if failed:
+        tasks = [
+            create_once_tasks(l, r)[0] if parameter.batch_size() == 1
+            else batch(l, r) for l, r, _ in failed
+        ]
+        results = await exec.proc_async_tasks(
+            tasks, rpm=parameter.rpm(), tpm=parameter.tpm(),
+            adaptive=parameter.adaptive_concurrency(), desc="Matching"
+        )
+        for (_, _, indices), result in zip(failed, results):
+            for i, output in zip(indices, result):
+                outputs[i] = output
+
+    return outputs
 
 
 def create_once_tasks(left: list[_MultimodalRecord], 
@@ -120,6 +304,20 @@ def create_once_tasks(left: list[_MultimodalRecord],
 
 def create_batch_tasks(left: list[_MultimodalRecord], 
                        right: list[_MultimodalRecord]) -> list[Coroutine]:
+    return [
+        batch(batch_left, batch_right)
+        for batch_left, batch_right, _ in plan_batches(left, right)
+    ]
+
+
+def plan_batches(left: list[_MultimodalRecord], 
+                 right: list[_MultimodalRecord]) -> list[tuple]:
+    '''
+    Group the pairs into batches of at most batch_size pairs.
+    Returns a list of (left, rights, indices) tuples, where left is a
+    single record under record-level batching and a list otherwise,
+    and indices are the positions of the batched pairs in the input.
+    '''
     assert len(left) == len(right)
     
     # count number of repeats in left and right
@@ -129,10 +327,10 @@ def create_batch_tasks(left: list[_MultimodalRecord],
     if any(left_text) and any(right_text):
         left_batches, right_batches, left_mapping, right_mapping = {}, {}, {}, {}
         
-        for l, r in zip(left, right):
-            left_batches[l.text] = left_batches.get(l.text, []) + [r]
+        for i, (l, r) in enumerate(zip(left, right)):
+            left_batches.setdefault(l.text, []).append((i, r))
             left_mapping[l.text] = l
-            right_batches[r.text] = right_batches.get(r.text, []) + [l]
+            right_batches.setdefault(r.text, []).append((i, l))
             right_mapping[r.text] = r
         
         if len(left_batches) <= len(right_batches):
@@ -144,54 +342,140 @@ def create_batch_tasks(left: list[_MultimodalRecord],
     else: # if no text fields, don't use record-level batching
         batches, mapping = {}, {}
         for i, (l, r) in enumerate(zip(left, right)):
-            batches[i] = [r]
+            batches[i] = [(i, r)]
             mapping[i] = l
 
-    # generate tasks for each batch, 
+    # generate batches, 
     # if record batching is enabled, treat each cluster (size > 1) that 
     # share the same left as its own batch
-    batch_tasks, curr_batch_l, curr_batch_r = [], [], []
+    batch_size = parameter.batch_size()
+    plan, curr_batch_l, curr_batch_r, curr_batch_i = [], [], [], []
     for key, rights in batches.items():
         left = mapping[key]
         if not parameter.record_batch() or len(rights) == 1:
             # prompt-level batching: add pairs one by one until the batch size is reached
-            for right in rights:
+            for i, right in rights:
                 curr_batch_l.append(left)
                 curr_batch_r.append(right)
+                curr_batch_i.append(i)
                 
-                if len(curr_batch_l) == parameter.batch_size():
-                    batch_tasks.append(batch(curr_batch_l, curr_batch_r))
-                    curr_batch_l, curr_batch_r = [], []
+                if len(curr_batch_l) == batch_size:
+                    plan.append((curr_batch_l, curr_batch_r, curr_batch_i))
+                    curr_batch_l, curr_batch_r, curr_batch_i = [], [], []
         
         else: # record-level batching
             batch_start = 0
             # ensure batches do not go over the batch size
             while batch_start < len(rights):
-                batch_end = batch_start + parameter.batch_size()
-                batch_tasks.append(batch(left, rights[batch_start:batch_end]))
-                batch_start += parameter.batch_size()
+                batch_end = batch_start + batch_size
+                plan.append((
+                    left,
+                    [r for _, r in rights[batch_start:batch_end]],
+                    [i for i, _ in rights[batch_start:batch_end]],
+                ))
+                batch_start += batch_size
     
     # add any remaining pairs from the last traditional batch
     if len(curr_batch_l) > 0:
-        batch_tasks.append(batch(curr_batch_l, curr_batch_r))
+        plan.append((curr_batch_l, curr_batch_r, curr_batch_i))
     
-    return batch_tasks
+    return plan
 
 
-async def once(left: _MultimodalRecord, right: _MultimodalRecord) -> dict:
-    start = time.time()
-    
-    left_text, right_text = left.text, right.text
-    left_imgs, right_imgs = left.images, right.images
+def config_digest() -> str:
+    ''' Digest the configurations that shape the match prompt and output. '''
+    return _config_digest(libem.LIBEM_SEED)
 
-    system_prompt = Prompt.join(
+
+@per_epoch
+def _config_digest(seed: int) -> str:
+    return hashlib.md5(pformat([
         prompt.role(),
         prompt.rules(),
         prompt.experiences(),
-        prompt.CoT() if parameter.cot() else "",
         prompt.output(),
+        prompt.query.value,
+        prompt.shots(),
+        prompt.CoT() if parameter.cot() else "",
         prompt.Confidence() if parameter.confidence() else "",
-    )
+        getattr(parameter.icl_strategy(), "__name__", ""),
+        parameter.num_shots(),
+        parameter.model(),
+        parameter.temperature(),
+        parameter.system_role(),
+        parameter.structured(),
+        parameter.likelihood(),
+        parameter.tools(),
+        parameter.batch_size(),
+        parameter.record_batch(),
+        seed,
+    ]).encode()).hexdigest()
+
+
+def lookup_cache(left: list[_MultimodalRecord], 
+                 right: list[_MultimodalRecord]) -> tuple[list, list[int]]:
+    '''
+    Look up the pairs in the result cache. Returns the outputs with
+    None in place of the cache misses, and the indices of the misses.
+    '''
+    if not parameter.cache():
+        return [None] * len(left), list(range(len(left)))
+
+    keys = cache_keys(left, right)
+    found = result_cache.get_many(keys)
+
+    outputs = [found.get(k) for k in keys]
+    return outputs, [i for i, o in enumerate(outputs) if o is None]
+
+
+def update_cache(left: list[_MultimodalRecord], 
+                 right: list[_MultimodalRecord],
+                 outputs: list, results: list[tuple[int, dict]]) -> list[dict]:
+    '''
+    Fill in the outputs of the matched pairs and cache them,
+    except for the outputs padded in for answers missing from
+    a batch response.
+    '''
+    for i, result in results:
+        outputs[i] = result
+
+    results = [(i, result) for i, result in results
+               if result is not None and not isinstance(result, _Padded)]
+    if parameter.cache() and results:
+        keys = cache_keys(
+            [left[i] for i, _ in results],
+            [right[i] for i, _ in results],
+        )
+        result_cache.put_many({
+            k: result for k, (_, result) in zip(keys, results)
+        })
+
+    return outputs
+
+
+def cache_keys(left: list[_MultimodalRecord], 
+               right: list[_MultimodalRecord]) -> list[str]:
+    config = config_digest()
+    return [
+        result_cache.key(record_digest(l), record_digest(r), config)
+        for l, r in zip(left, right)
+    ]
+
+
+async def once(left: _MultimodalRecord, right: _MultimodalRecord) -> dict:
+    start = time.time()
+
+    call = once_call(left, right)
+    response = await model.async_call(**call)
+
+    return once_output(left, right, call, response, start)
+
+
+def once_call(left: _MultimodalRecord, right: _MultimodalRecord) -> dict:
+    ''' Build the model call that matches a single pair. '''
+    left_text, right_text = left.text, right.text
+    left_imgs, right_imgs = left.images, right.images
+    compiled = compile_call()
 
     if left_imgs:
         match_prompt = prompt.multimodal_query(
@@ -204,18 +488,60 @@ async def once(left: _MultimodalRecord, right: _MultimodalRecord) -> dict:
             right=right_text
         )
 
-    shots = parameter.icl_strategy().run(
-        shots=prompt.shots,
-        question=prompt.query(left=left_text, right=right_text),
-        num_shots=parameter.num_shots(),
-    )
+    shots = compiled["shots"]
+    if shots is None:
+        shots = parameter.icl_strategy().run(
+            shots=prompt.shots,
+            question=prompt.query(left=left_text, right=right_text),
+            num_shots=parameter.num_shots(),
+        )()
 
     _prompt = [
-        {"role": parameter.system_role(), "content": system_prompt},
-        *shots(),
+        compiled["system_prompt"],
+        *shots,
         {"role": "user", "content": match_prompt},
     ]
 
+    return dict(
+        prompt=_prompt,
+        seed=libem.LIBEM_SEED,
+        **compiled["settings"],
+    )
+
+
+@per_epoch
+def compile_call(batch: bool = False) -> dict:
+    '''
+    Build the parts of the model call that are the same for
+    every pair, once until the next calibration: the system
+    prompt, the shots unless they are chosen per pair, the
+    output schema and the model settings.
+    '''
+    if batch:
+        system_prompt = Prompt.join(
+            prompt.role(),
+            prompt.rules(),
+            prompt.experiences(),
+            prompt.output(),
+        )
+        shots = prompt.shots()
+    else:
+        system_prompt = Prompt.join(
+            prompt.role(),
+            prompt.rules(),
+            prompt.experiences(),
+            prompt.CoT() if parameter.cot() else "",
+            prompt.output(),
+            prompt.Confidence() if parameter.confidence() else "",
+        )
+        # other strategies select the shots by the pair or at random
+        shots = None
+        if parameter.icl_strategy() is given_shots:
+            shots = given_shots.run(
+                shots=prompt.shots,
+                num_shots=parameter.num_shots(),
+            )()
+
     output_schema = None
     if parameter.structured():
         output_structure = {}
@@ -224,29 +550,46 @@ async def once(left: _MultimodalRecord, right: _MultimodalRecord) -> dict:
         output_structure['answer'] = float if parameter.likelihood() else str
         if parameter.confidence():
             output_structure['confidence'] = float
-            
-        output_schema = model.output_schema("Output", **output_structure)
 
-    response = await model.async_call(
-        prompt=_prompt,
-        tools=parameter.tools(),
-        model=parameter.model(),
-        output_schema=output_schema,
-        temperature=parameter.temperature(),
-        seed=libem.LIBEM_SEED,
-    )
+        if batch:
+            # a list of the regular output schema
+            output_schema = model.output_schema("Output", **{"answers": [output_structure]})
+        else:
+            output_schema = model.output_schema("Output", **output_structure)
+
+    return {
+        "system_prompt": {"role": parameter.system_role(), "content": system_prompt},
+        "shots": shots,
+        "structured": parameter.structured(),
+        "likelihood": parameter.likelihood(),
+        "settings": dict(
+            tools=parameter.tools(),
+            model=parameter.model(),
+            output_schema=output_schema,
+            temperature=parameter.temperature(),
+        ),
+    }
+
+
+def once_output(left: _MultimodalRecord, right: _MultimodalRecord,
+                call: dict, response: dict, start: float) -> dict:
+    ''' Parse and trace the model response to a once_call. '''
+    left_text, right_text = left.text, right.text
+    left_imgs, right_imgs = left.images, right.images
+    _prompt = call["prompt"]
+    compiled = compile_call()
 
     libem.debug(f"[match] prompt:\n"
                 f"{pformat(_prompt, sort_dicts=False)}\n"
                 f"[match] model output:\n"
                 f"{response['output']}")
 
-    if parameter.structured():
+    if compiled["structured"]:
         output = Output.model_validate_json(response['output']).model_dump()
     else:
         output = parse_output(response['output'])
     
-    if parameter.likelihood():
+    if compiled["likelihood"]:
         output['likelihood'] = output['answer']
         output['answer'] = 'no' if output['likelihood'] < 0.5 else 'yes'
 
@@ -269,17 +612,15 @@ async def once(left: _MultimodalRecord, right: _MultimodalRecord) -> dict:
 async def batch(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_MultimodalRecord]) -> list[dict]:
     start = time.time()
 
-    output, size = [], len(right)
+    call = batch_call(left, right)
+    response = await model.async_call(**call)
+
+    return batch_output(left, right, call, response, start)
 
-    # generate prompt
-    system_prompt = Prompt.join(
-        prompt.role(),
-        prompt.rules(),
-        prompt.experiences(),
-        prompt.output(),
-    )
 
-    shots: list[dict] = prompt.shots()
+def batch_call(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_MultimodalRecord]) -> dict:
+    ''' Build the model call that matches a batch of pairs. '''
+    compiled = compile_call(batch=True)
 
     if isinstance(left, _MultimodalRecord):
         left_text, left_imgs = left.text, left.images
@@ -305,42 +646,38 @@ async def batch(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_
             match_prompt = prompt.prompt_batch_query(left_text, right_text)
 
     _prompt = [
-        {"role": parameter.system_role(), "content": system_prompt},
-        *shots,
+        compiled["system_prompt"],
+        *compiled["shots"],
         {"role": "user", "content": match_prompt},
     ]
-    
-    # generate output schema
-    output_schema = None
-    if parameter.structured():
-        output_structure = {}
-        if parameter.cot():
-            output_structure['explanation'] = str
-        output_structure['answer'] = float if parameter.likelihood() else str
-        if parameter.confidence():
-            output_structure['confidence'] = float
-        
-        # a list of the regular output schema
-        output_schema = model.output_schema("Output", **{"answers": [output_structure]})
 
-    # call the model
-    response = await model.async_call(
+    return dict(
         prompt=_prompt,
-        tools=parameter.tools(),
-        model=parameter.model(),
-        output_schema=output_schema,
-        temperature=parameter.temperature(),
         seed=libem.LIBEM_SEED,
+        **compiled["settings"],
     )
-    
-    if parameter.structured():
+
+
+def batch_output(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_MultimodalRecord],
+                 call: dict, response: dict, start: float) -> list[dict]:
+    ''' Parse and trace the model response to a batch_call. '''
+    output, size = [], len(right)
+    _prompt = call["prompt"]
+
+    if isinstance(left, _MultimodalRecord):
+        left_text, left_imgs = left.text, left.images
+    else:
+        left_text, left_imgs = [l.text for l in left], [l.images for l in left]
+    right_text, right_imgs = [r.text for r in right], [r.images for r in right]
+
+    if compile_call(batch=True)["structured"]:
         output = BatchOutput.model_validate_json(response['output']).model_dump()['answers']
         if len(output) != size: # pad output if necessary
             libem.warn(f"[match] output size differ from batch size: "
                     f"output: {len(output)}, batch size: {size}")
             
             while len(output) < size:
-                output.append(Output(answer='no').model_dump())
+                output.append(_Padded(Output(answer='no').model_dump()))
     else:
         output_lines = response["output"].split('\n')
 
@@ -377,7 +714,7 @@ async def batch(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_
                         f"output: {len(output)}, batch size: {size}")
                 
                 while len(output) < size:
-                    output.append(Output(answer='no').model_dump())
+                    output.append(_Padded(Output(answer='no').model_dump()))
         else:
             # if the model output does not follow the expected
             # format, assume all answers are the same and only
@@ -386,7 +723,8 @@ async def batch(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_
                         f"output: 1, batch size: {size}")
             
             answer = parse_output(response["output"])
-            output = [answer for _ in range(size)]
+            output = [answer] if size == 1 else \
+                [_Padded(answer) for _ in range(size)]
 
     libem.debug(f"[match] batch output:\n"
                 f"{response['output']}")
@@ -414,6 +752,10 @@ async def batch(left: _MultimodalRecord | list[_MultimodalRecord], right: list[_
     return output
 
 
+class _Padded(dict):
+    ''' An output assumed for a pair the model did not answer. '''
+
+
 def digest(left: str, right: str) -> str:
     return hashlib.md5(
         f"{left} {right}".encode()
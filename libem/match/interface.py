@@ -1,10 +1,17 @@
 import random
+from collections.abc import (
+    Iterable, Iterator, AsyncIterator
+)
 
+import libem
 from libem.match import (
     parameter,
     func, async_func
 )
-from libem.struct import Left, Right, Output
+from libem.match.function import (
+    stream, async_stream
+)
+from libem.struct import Left, Right, Output, Pair, Answer
 from libem.match.struct import parse_input
 
 
@@ -12,33 +19,11 @@ def match(left: Left, right: Right = None) -> Output:
     left, right = parse_input(left, right)
 
     # random guessing
-    if parameter.always():
-        if isinstance(left, list):
-            return [{
-                "answer": parameter.always(),
-                "confidence": None,
-                "explanation": "I'm guessing.",
-            } for _ in range(len(left))]
-        else:
-            return {
-                "answer": parameter.always(),
-                "confidence": None,
-                "explanation": "I'm guessing.",
-            }
-
-    if parameter.guess():
+    if parameter.always() or parameter.guess():
         if isinstance(left, list):
-            return [{
-                "answer": random.choice(["yes", "no"]),
-                "confidence": None,
-                "explanation": "I'm guessing.",
-            } for _ in range(len(left))]
+            return [guess() for _ in range(len(left))]
         else:
-            return {
-                "answer": random.choice(["yes", "no"]),
-                "confidence": None,
-                "explanation": "I'm guessing.",
-            }
+            return guess()
 
     return func(left, right)
 
@@ -47,6 +32,33 @@ async def async_match(left: Left, right: Right) -> Output:
     return await async_func(left, right)
 
 
+def match_stream(pairs: Iterable[Pair],
+                 window: int = libem.LIBEM_MAX_ASYNC_TASKS) -> Iterator[tuple[int, Answer]]:
+    '''
+    Match pairs from a (possibly unbounded) iterable lazily, with at most
+    `window` match tasks in flight. Yields (pair_index, answer) tuples
+    in the order in which the answers become available.
+    '''
+    if parameter.always() or parameter.guess():
+        return ((i, guess()) for i, _ in enumerate(pairs))
+
+    return stream(pairs, window)
+
+
+async def async_match_stream(pairs: Iterable[Pair],
+                             window: int = libem.LIBEM_MAX_ASYNC_TASKS) -> AsyncIterator[tuple[int, Answer]]:
+    async for output in async_stream(pairs, window):
+        yield output
+
+
+def guess() -> Answer:
+    return {
+        "answer": parameter.always() or random.choice(["yes", "no"]),
+        "confidence": None,
+        "explanation": "I'm guessing.",
+    }
+
+
 from libem.match.function import digest
 
 _ = digest
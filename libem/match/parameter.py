@@ -45,10 +45,20 @@ structured = Parameter(
     else False
 )
 
-# optional requests per minute limit
+# optional requests and tokens per minute limits
 rpm = Parameter(
     default=-1
 )
+tpm = Parameter(
+    default=-1
+)
+
+# halve the concurrent model calls when throttled
+# and grow them back additively on success
+adaptive_concurrency = Parameter(
+    default=False,
+    options=[True, False]
+)
 
 # chain-of-thought and confidence score
 cot = Parameter(
@@ -82,6 +92,19 @@ sync = Parameter(
     default=False,
 )
 
+# submit all prompts as one provider-side batch job,
+# see libem.optimize.batch.parameter for job settings
+provider_batch = Parameter(
+    default=False,
+    options=[True, False]
+)
+
+# pair-level result cache
+cache = Parameter(
+    default=False,
+    options=[True, False]
+)
+
 # input parsing
 import json
 
@@ -1,17 +1,17 @@
 from collections.abc import (
     Iterable, Generator, Iterator
 )
+from dataclasses import dataclass
 from libem.struct import *
 from libem.match import parameter
 
 
-# internal types
-class _MultimodalRecord(BaseModel):
+# internal types, built once per record on the hot path and
+# from inputs dispatched on their type, so they skip validation
+@dataclass(slots=True)
+class _MultimodalRecord:
     text: str | None = None
     images: list[str | np.ndarray] | None = None
-    
-    class Config:
-        arbitrary_types_allowed = True
 
 _Left = _MultimodalRecord | list[_MultimodalRecord]
 _Right = _MultimodalRecord | list[_MultimodalRecord]
@@ -79,8 +79,20 @@ def encode_entity_fields(entity_fields: Record) -> _MultimodalRecord | list[_Mul
             )
 
 
+def record_digest(record: _MultimodalRecord) -> str:
+    ''' Generate an MD5 hash for an encoded record. '''
+    import hashlib
+
+    h = hashlib.md5((record.text or "").encode())
+    for image in record.images or []:
+        h.update(digest(image).encode())
+    return h.hexdigest()
+
+
 def encode_text_fields(text_fields: TextFields) -> str:
     if isinstance(text_fields, Mapping):
+        if not isinstance(text_fields, dict):
+            text_fields = dict(text_fields)
         return parameter.dict_desc_encoding(text_fields)
     return text_fields
 
@@ -0,0 +1,16 @@
+from libem.core.struct import Parameter
+
+# seconds between polls of a submitted batch job
+poll_interval = Parameter(
+    default=60,
+)
+
+# time frame within which the provider completes the job
+completion_window = Parameter(
+    default="24h",
+)
+
+# resume the given batch job instead of submitting a new one
+job_id = Parameter(
+    default=None,
+)
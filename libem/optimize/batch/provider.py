@@ -1,4 +1,211 @@
 """
 Batching with provider-side APIs.
+
+Model calls are serialized into a JSONL batch job, submitted to
+the provider's batch endpoint and polled until the job ends. The
+id of a submitted job is recorded against a digest of its input,
+so that a run interrupted while waiting resumes the job instead
+of submitting (and paying for) it again. A job is only resumed
+if it was submitted with the same input.
 """
+import json
+import hashlib
+import asyncio
+from openai import NotFoundError
+
+import libem
+from libem.core.model import openai
+from libem.optimize.batch import parameter
+from libem.optimize.cache.store import get_store
+from libem.optimize.cache import (
+    parameter as cache_parameter,
+    provider as cache_provider,
+)
+
+name = "batch"
+endpoint = "/v1/chat/completions"
+final_states = {"completed", "failed", "expired", "cancelled"}
+
+
+def request(custom_id: str, call: dict) -> dict:
+    """Serialize a model call into a batch request."""
+    if call.get("tools"):
+        raise libem.ToolUseUnsupported(
+            "Tool use is not supported in provider-side batches."
+        )
+
+    _messages = messages(call["prompt"])
+    if cache_parameter.provider():
+        _messages = cache_provider.layout(_messages)
+
+    body = {
+        "model": call["model"],
+        "messages": _messages,
+        "temperature": call.get("temperature", 0.0),
+        "seed": call.get("seed"),
+    }
+    if call.get("output_schema"):
+        body["response_format"] = call["output_schema"]
+
+    return {
+        "custom_id": custom_id,
+        "method": "POST",
+        "url": endpoint,
+        "body": body,
+    }
+
+
+def messages(prompt: str | list | dict) -> list:
+    match prompt:
+        case list():
+            return prompt
+        case dict():
+            return [{"role": role, "content": content}
+                    for role, content in prompt.items()]
+        case str():
+            return [{"role": "user", "content": prompt}]
+        case _:
+            raise ValueError(f"Invalid prompt type: {type(prompt)}")
+
+
+async def run(calls: list[dict], job_id: str = None) -> list[dict | None]:
+    """
+    Run the model calls in a batch job and return their responses
+    in order, in the format of model.async_call; calls that failed
+    within the job are returned as None.
+    """
+    if not calls:
+        return []
+
+    data = "\n".join(
+        json.dumps(request(str(i), call))
+        for i, call in enumerate(calls)
+    ).encode()
+    key = hashlib.sha256(data).hexdigest()
+    store = get_store(name)
+
+    client, job = openai.get_client(), None
+    if job_id is not None:
+        job = await client.batches.retrieve(job_id)
+        if not await submitted_for(job, key):
+            raise ValueError(f"Job {job_id} was not submitted for these calls.")
+    elif store.get(key) is not None:
+        try:
+            job = await client.batches.retrieve(store.get(key).decode())
+        except NotFoundError:
+            pass
+        if job is not None and not await submitted_for(job, key):
+            job = None
+    if job is not None:
+        libem.info(f"[batch] resuming job {job.id} ({job.status})")
+
+    if job is None or job.status in final_states - {"completed"}:
+        job = await submit(data, key)
+        store.put(key, job.id.encode())
+
+    job = await wait(job.id)
+    responses = await results(job, calls)
+    store.delete(key)
+
+    num_failed = sum(r is None for r in responses)
+    if num_failed:
+        libem.warn(f"[batch] {num_failed} of {len(calls)} requests "
+                   f"failed in job {job.id} ({job.status})")
+    return responses
+
+
+async def submit(data: bytes, key: str):
+    client = openai.get_client()
+
+    file = await client.files.create(
+        file=("libem-batch.jsonl", data),
+        purpose="batch",
+    )
+    job = await client.batches.create(
+        input_file_id=file.id,
+        endpoint=endpoint,
+        completion_window=parameter.completion_window(),
+        metadata={"input_digest": key},
+    )
+    libem.info(f"[batch] submitted job {job.id}")
+    return job
+
+
+async def submitted_for(job, key: str) -> bool:
+    """ Whether the job was submitted with the input of the given digest. """
+    metadata = job.metadata or {}
+    if "input_digest" in metadata:
+        return metadata["input_digest"] == key
+
+    # jobs submitted otherwise are checked against their input file
+    content = await openai.get_client().files.content(job.input_file_id)
+    return hashlib.sha256(content.content).hexdigest() == key
+
+
+async def wait(job_id: str):
+    client = openai.get_client()
+
+    while True:
+        job = await client.batches.retrieve(job_id)
+        if job.status in final_states:
+            return job
+
+        counts = job.request_counts
+        if counts is not None:
+            libem.debug(f"[batch] job {job_id} {job.status}: "
+                        f"{counts.completed}/{counts.total} completed")
+        await asyncio.sleep(parameter.poll_interval())
+
+
+async def results(job, calls: list[dict]) -> list[dict | None]:
+    responses = [None] * len(calls)
+    if not job.output_file_id:
+        return responses
+
+    content = await openai.get_client().files.content(job.output_file_id)
+    for line in content.text.splitlines():
+        if not line.strip():
+            continue
+
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if response.get("status_code") != 200:
+            continue
+
+        i = int(result["custom_id"])
+        responses[i] = response_of(calls[i], response["body"])
+    return responses
+
+
+def response_of(call: dict, body: dict) -> dict:
+    message = body["choices"][0]["message"]
+    usage = body.get("usage") or {}
+
+    num_input_tokens = usage.get("prompt_tokens", 0)
+    num_output_tokens = usage.get("completion_tokens", 0)
+    num_cached_tokens = cache_provider.openai_cached_tokens(usage)
+    _messages = messages(call["prompt"]) + [message]
+
+    libem.trace.add({
+        "model": {
+            "messages": _messages,
+            "tool_usages": [],
+            "num_model_calls": 1,
+            "num_input_tokens": num_input_tokens,
+            "num_output_tokens": num_output_tokens,
+            "num_cached_tokens": num_cached_tokens,
+            "model": call["model"],
+        }
+    })
 
+    return {
+        "output": message.get("content"),
+        "tool_outputs": [],
+        "messages": _messages,
+        "stats": {
+            "num_model_calls": 1,
+            "num_input_tokens": num_input_tokens,
+            "num_output_tokens": num_output_tokens,
+            "num_cached_tokens": num_cached_tokens,
+        }
+    }
@@ -0,0 +1,46 @@
+import os
+
+import libem
+from libem.core.struct import Parameter
+
+# local cache of model responses
+response = Parameter(
+    default=False,
+    options=[True, False]
+)
+
+# directory holding the cache stores
+path = Parameter(
+    default=os.path.join(libem.LIBEM_DIR, "cache"),
+)
+
+# evict least recently used entries once
+# a store grows beyond this size (in bytes)
+max_size = Parameter(
+    default=1 << 30,
+)
+
+# evict entries older than this age
+# (in seconds), -1 to never expire
+max_age = Parameter(
+    default=-1,
+)
+
+# lay out prompts for, and mark them for,
+# provider-side caching of prompt prefixes
+provider = Parameter(
+    default=False,
+    options=[True, False]
+)
+
+# reuse the model state after the prompt prefix
+# shared across calls to local models
+prefix = Parameter(
+    default=True,
+    options=[True, False]
+)
+
+# the most prefix states kept, least recently used first out
+max_prefixes = Parameter(
+    default=8,
+)
@@ -1,3 +1,58 @@
 """
 Caching with provider-side APIs.
-"""
\ No newline at end of file
+
+OpenAI caches repeated prompt prefixes on its own and Anthropic
+caches the prefixes up to the blocks marked as cacheable, and both
+bill the cached input tokens at a discount. A prefix is only reused
+when it is identical across calls, so the prompts are laid out with
+the parts that stay the same, i.e., the system prompt with its rules
+and experiences and then the shots, ahead of the per-call query.
+"""
+from typing import Any
+
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def layout(messages: list[dict]) -> list[dict]:
+    ''' Move the system messages ahead of the rest, keeping their order. '''
+    return [m for m in messages if m.get("role") == "system"] + \
+           [m for m in messages if m.get("role") != "system"]
+
+
+def mark(system: str | None, messages: list[dict]) -> tuple[list | None, list[dict]]:
+    '''
+    Mark the system prompt and the message before the last one,
+    i.e., the end of the shots, as cacheable blocks for Claude.
+    The given messages are left untouched.
+    '''
+    if system:
+        system = [{"type": "text", "text": system,
+                   "cache_control": EPHEMERAL}]
+
+    if len(messages) > 1:
+        messages = messages.copy()
+        message = messages[-2]
+        content = message["content"]
+        if isinstance(content, str):
+            content = [{"type": "text", "text": content}]
+        else:
+            content = list(content)
+        content[-1] = {**content[-1], "cache_control": EPHEMERAL}
+        messages[-2] = {**message, "content": content}
+
+    return system, messages
+
+
+def openai_cached_tokens(usage: Any) -> int:
+    ''' The cached prompt tokens in an OpenAI usage object or dict. '''
+    if isinstance(usage, dict):
+        details = usage.get("prompt_tokens_details") or {}
+        return details.get("cached_tokens") or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def claude_cached_tokens(usage: Any) -> tuple[int, int]:
+    ''' The input tokens read from and written to Claude's cache. '''
+    return (getattr(usage, "cache_read_input_tokens", None) or 0,
+            getattr(usage, "cache_creation_input_tokens", None) or 0)
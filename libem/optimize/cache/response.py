@@ -0,0 +1,61 @@
+"""
+Local, content-addressed cache of model responses.
+
+Entries are keyed on everything that determines the model
+output (model, messages, output schema, temperature, seed
+and tools) so that repeated calls skip the model entirely.
+"""
+import json
+import hashlib
+
+import libem
+from libem.optimize.cache.store import get_store
+
+name = "response"
+
+
+def key(*args, **kwargs) -> str:
+    """Digest the model call arguments into a cache key."""
+    return hashlib.sha256(
+        json.dumps([args, kwargs], sort_keys=True,
+                   default=_serialize).encode()
+    ).hexdigest()
+
+
+def get(key: str) -> dict | None:
+    value = get_store(name).get(key)
+
+    if value is None:
+        libem.trace.add({"cache": {"response": {"num_misses": 1}}})
+        return None
+
+    libem.trace.add({"cache": {"response": {"num_hits": 1}}})
+
+    response = json.loads(value)
+    # no model call was made to produce a cached response
+    response["stats"] = {
+        stat: 0 for stat in response.get("stats", {})
+    }
+    return response
+
+
+def put(key: str, response: dict):
+    get_store(name).put(
+        key, json.dumps({
+            "output": response["output"],
+            "tool_outputs": response["tool_outputs"],
+            "messages": response["messages"],
+            "stats": response["stats"],
+        }, default=_serialize).encode()
+    )
+
+
+def clear():
+    get_store(name).clear()
+
+
+def _serialize(obj):
+    # model SDK messages are pydantic models
+    if hasattr(obj, "model_dump"):
+        return obj.model_dump(exclude_none=True)
+    return str(obj)
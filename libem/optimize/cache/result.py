@@ -0,0 +1,51 @@
+"""
+Local cache of pair-level match results.
+
+Entries are keyed on the digests of both records, so a pair
+is found regardless of which side each record is given on,
+together with a digest of the configuration that shapes the
+match prompt, so that calibrating the matcher invalidates
+previously cached answers.
+"""
+import json
+import hashlib
+
+import libem
+from libem.optimize.cache.store import get_store
+
+name = "result"
+
+
+def key(left_digest: str, right_digest: str, config: str) -> str:
+    left_digest, right_digest = sorted((left_digest, right_digest))
+    return hashlib.sha256(
+        f"{left_digest} {right_digest} {config}".encode()
+    ).hexdigest()
+
+
+def get_many(keys: list[str]) -> dict[str, dict]:
+    found = {
+        k: json.loads(v)
+        for k, v in get_store(name).get_many(keys).items()
+    }
+
+    libem.trace.add({
+        "cache": {
+            "result": {
+                "num_hits": len(found),
+                "num_misses": len(set(keys)) - len(found),
+            }
+        }
+    })
+    return found
+
+
+def put_many(results: dict[str, dict]):
+    get_store(name).put_many({
+        k: json.dumps(v).encode()
+        for k, v in results.items()
+    })
+
+
+def clear():
+    get_store(name).clear()
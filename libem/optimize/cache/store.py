@@ -0,0 +1,219 @@
+"""
+Persistent key-value stores backing the local caches.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+
+class Store:
+    """
+    A key-value store kept in a SQLite file with size- and
+    age-based eviction. Values are raw bytes; callers are
+    responsible for (de)serialization.
+
+    max_size: total size of the values (in bytes) beyond which
+              the least recently used entries are evicted, -1 to disable.
+    max_age: age (in seconds) after which entries expire, -1 to disable.
+    """
+
+    def __init__(self, path: str,
+                 max_size: int = -1,
+                 max_age: float = -1):
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS store ("
+            "key TEXT PRIMARY KEY, "
+            "value BLOB NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created REAL NOT NULL, "
+            "accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS store_accessed "
+            "ON store (accessed)"
+        )
+        self._conn.commit()
+
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM store"
+        ).fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM store"
+            ).fetchone()[0]
+
+    def __contains__(self, key: str):
+        return self.get(key) is not None
+
+    def get(self, key: str) -> bytes | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM store WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, created = row
+            if self._expired(created, now):
+                self._delete([key])
+                return None
+
+            self._conn.execute(
+                "UPDATE store SET accessed = ? WHERE key = ?",
+                (now, key)
+            )
+            self._conn.commit()
+        return value
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        """Look up multiple keys in one round trip,
+        returning only the keys that are present."""
+        found, now = {}, time.time()
+        with self._lock:
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, value, created FROM store "
+                    f"WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                expired = []
+                for key, value, created in rows:
+                    if self._expired(created, now):
+                        expired.append(key)
+                    else:
+                        found[key] = value
+                if expired:
+                    self._delete(expired)
+            self._conn.executemany(
+                "UPDATE store SET accessed = ? WHERE key = ?",
+                [(now, key) for key in found]
+            )
+            self._conn.commit()
+        return found
+
+    def put(self, key: str, value: bytes):
+        self.put_many({key: value})
+
+    def put_many(self, items: dict[str, bytes]):
+        now = time.time()
+        with self._lock:
+            for key, value in items.items():
+                prev = self._conn.execute(
+                    "SELECT size FROM store WHERE key = ?",
+                    (key,)
+                ).fetchone()
+                if prev is not None:
+                    self._size -= prev[0]
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO store "
+                    "(key, value, size, created, accessed) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now, now)
+                )
+                self._size += len(value)
+            self._conn.commit()
+
+            if 0 <= self.max_size < self._size:
+                self._evict()
+
+    def delete(self, key: str):
+        with self._lock:
+            self._delete([key])
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM store")
+            self._conn.commit()
+            self._size = 0
+
+    def size(self) -> int:
+        return self._size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _expired(self, created: float, now: float) -> bool:
+        return self.max_age >= 0 and now - created > self.max_age
+
+    def _delete(self, keys: list[str]):
+        for key in keys:
+            row = self._conn.execute(
+                "SELECT size FROM store WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "DELETE FROM store WHERE key = ?", (key,)
+                )
+                self._size -= row[0]
+        self._conn.commit()
+
+    def _evict(self):
+        if self.max_age >= 0:
+            self._conn.execute(
+                "DELETE FROM store WHERE created < ?",
+                (time.time() - self.max_age,)
+            )
+
+        if self.max_size >= 0:
+            # drop the least recently used entries until
+            # the store shrinks to 90% of the size limit
+            size = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM store"
+            ).fetchone()[0]
+            target = int(self.max_size * 0.9)
+            if size > target:
+                evicted = []
+                for key, entry_size in self._conn.execute(
+                        "SELECT key, size FROM store ORDER BY accessed"):
+                    if size <= target:
+                        break
+                    evicted.append((key,))
+                    size -= entry_size
+                self._conn.executemany(
+                    "DELETE FROM store WHERE key = ?", evicted
+                )
+
+        self._conn.commit()
+        self._size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM store"
+        ).fetchone()[0]
+
+
+_stores: dict[str, Store] = {}
+
+
+def get_store(name: str) -> Store:
+    """Open, or reuse, the named store under the cache directory."""
+    from libem.optimize.cache import parameter
+
+    path = os.path.join(parameter.path(), f"{name}.sqlite")
+    store = _stores.get(path)
+    if store is None:
+        store = _stores[path] = Store(path)
+
+    # limits may have been calibrated since the store was opened
+    store.max_size = parameter.max_size()
+    store.max_age = parameter.max_age()
+    return store
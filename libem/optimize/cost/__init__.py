@@ -1,9 +1,11 @@
-from libem.optimize.cost import openai
+from libem.optimize.cost import openai, claude
 
 
 def get_cost(model, *args, **kwargs):
     if model == "llama3" or model == "llama3.1":
         return 0
+    elif model.startswith("claude"):
+        return claude.get_cost(model, *args, **kwargs)
     else:
+        kwargs.pop("num_cache_write_tokens", None)
         return openai.get_cost(model, *args, **kwargs)
-
@@ -11,6 +11,7 @@ PRICE_FILE_PATH = os.path.join(DIR_PATH, 'price.json')
 def refresh_price_cache():
     fetch_price_info()
     cache_openai()
+    cache_claude()
 
 
 def fetch_price_info():
@@ -56,3 +57,26 @@ def load_openai():
         print(f"{OPENAI_FILE_PATH} not found. Please check the filepath.")
     except json.JSONDecodeError:
         print(f"Error decoding {OPENAI_FILE_PATH}. Please check the file content.")
+
+
+"""Anthropic specific info"""
+CLAUDE_FILE_PATH = os.path.join(DIR_PATH, 'claude.json')
+
+
+def cache_claude():
+    price_info = load_price_info()
+    claude_price_info = {name: details for name, details in price_info.items()
+                         if name.startswith('claude')}
+
+    with open(CLAUDE_FILE_PATH, 'w') as f:
+        json.dump(claude_price_info, f, indent=4)
+
+def load_claude():
+    try:
+        with open(CLAUDE_FILE_PATH, 'r') as f:
+            data = json.load(f)
+        return data
+    except FileNotFoundError:
+        print(f"{CLAUDE_FILE_PATH} not found. Please check the filepath.")
+    except json.JSONDecodeError:
+        print(f"Error decoding {CLAUDE_FILE_PATH}. Please check the file content.")
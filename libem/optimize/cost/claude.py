@@ -0,0 +1,33 @@
+from libem.optimize.cost import cache
+
+null_model_info = {
+    'input_cost_per_token': 0,
+    'output_cost_per_token': 0
+}
+
+
+def get_model_info(model=None):
+    if model is None:
+        return cache.load_claude()
+    else:
+        return cache.load_claude().get(model, null_model_info)
+
+
+def get_cost(model, num_input_tokens, num_output_tokens,
+             num_cached_tokens=0, num_cache_write_tokens=0):
+    '''
+    The input tokens include the ones read from and written to
+    the prompt cache, which are billed below and above the base
+    input price respectively.
+    '''
+    info = get_model_info(model)
+    input_cost = info['input_cost_per_token']
+    num_cached_tokens = num_cached_tokens or 0
+    num_cache_write_tokens = num_cache_write_tokens or 0
+    num_input_tokens = (num_input_tokens or 0) - \
+                       num_cached_tokens - num_cache_write_tokens
+
+    return input_cost * num_input_tokens + \
+        info.get('cache_read_input_token_cost', input_cost) * num_cached_tokens + \
+        info.get('cache_creation_input_token_cost', input_cost) * num_cache_write_tokens + \
+        info['output_cost_per_token'] * (num_output_tokens or 0)
@@ -37,8 +37,25 @@ def get_output_cost(model, num_tokens):
     return model_info['output_cost_per_token'] * num_tokens
 
 
-def get_cost(model, num_input_tokens, num_output_tokens):
-    return get_input_cost(model, num_input_tokens) + get_output_cost(model, num_output_tokens)
+def get_cached_input_cost(model, num_tokens):
+    ''' Cost of the input tokens read from the provider's prompt cache. '''
+    if num_tokens is None or num_tokens <= 0:
+        return 0
+
+    global model_info, model_choice
+    if model_info is None or model_choice != model:
+        model_choice = model
+        model_info = get_model_info(model)
+    return model_info.get('cache_read_input_token_cost',
+                          model_info['input_cost_per_token']) * num_tokens
+
+
+def get_cost(model, num_input_tokens, num_output_tokens, num_cached_tokens=0):
+    # the input tokens include the cached ones
+    num_cached_tokens = num_cached_tokens or 0
+    return get_input_cost(model, (num_input_tokens or 0) - num_cached_tokens) + \
+        get_cached_input_cost(model, num_cached_tokens) + \
+        get_output_cost(model, num_output_tokens)
 
 
 if __name__ == "__main__":
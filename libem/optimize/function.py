@@ -42,6 +42,8 @@ def profile(dataset: Iterable, num_samples=-1, detailed=False):
         libem.parameter.model(),
         num_input_tokens=stats["model"]["num_input_tokens"]["sum"],
         num_output_tokens=stats["model"]["num_output_tokens"]["sum"],
+        num_cached_tokens=stats["model"]["num_cached_tokens"]["sum"],
+        num_cache_write_tokens=stats["model"]["num_cache_write_tokens"]["sum"],
     )
 
     if detailed:
@@ -71,5 +73,6 @@ def profile(dataset: Iterable, num_samples=-1, detailed=False):
             "num_model_calls": stats["model"]["num_model_calls"]["sum"],
             "num_input_tokens": stats["model"]["num_input_tokens"]["sum"],
             "num_output_tokens": stats["model"]["num_output_tokens"]["sum"],
+            "num_cached_tokens": stats["model"]["num_cached_tokens"]["sum"] or 0,
             "cost": stats["model"]["cost"],
         }
@@ -1,10 +1,22 @@
 from libem.optimize.cost import cache, openai
+from libem.optimize.cache import (
+    response as response_cache,
+    result as result_cache,
+)
 
 
 def refresh_price_cache():
     cache.refresh_price_cache()
 
 
+def clear_response_cache():
+    response_cache.clear()
+
+
+def clear_result_cache():
+    result_cache.clear()
+
+
 def get_openai_cost(model, num_input_tokens, num_output_tokens):
     return openai.get_cost(model, num_input_tokens, num_output_tokens)
 
@@ -1,3 +1,5 @@
+import importlib.util
+
 from libem.core.struct import Parameter
 
 model = Parameter(
@@ -20,3 +22,28 @@ system_role = Parameter(
         if model() in {"o1-preview", "o1-mini"}
         else "system"
 )
+
+# the OpenAI-compatible endpoint to call instead of OpenAI,
+# e.g., a local libem.core.model.mock server
+base_url = Parameter(
+    default=None
+)
+
+# the HTTP connection pool of each model provider,
+# see libem.core.transport
+max_connections = Parameter(
+    default=1000
+)
+max_keepalive_connections = Parameter(
+    default=100
+)
+# seconds an idle connection is kept open
+keepalive_expiry = Parameter(
+    default=30.0
+)
+# HTTP/2 multiplexes the calls over fewer connections,
+# on by default if the h2 package is installed
+http2 = Parameter(
+    default=lambda: importlib.util.find_spec("h2") is not None,
+    options=[True, False]
+)
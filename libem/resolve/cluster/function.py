@@ -1,88 +1,208 @@
 from tqdm import tqdm
 from typing import Iterable
+from rapidfuzz import fuzz as rapidfuzz_fuzz
 
 import libem
 from libem.struct import (
     Record, SingleRecord,
     digest
 )
+from libem.block import parameter as block_parameter
+from libem.block.function import normalize
+from libem.block.struct import parse_input
 from libem.resolve.cluster import parameter
+from libem.resolve.cluster.union_find import UnionFind
 
 ClusterID = int
 
 schema = {}
 
 
-def func(*records: Iterable[Record]) -> list[(ClusterID, SingleRecord)]:
+def func(*records: Iterable[Record],
+         key: str | list[str] | None = None) -> list[(ClusterID, SingleRecord)]:
     """
     Block, match, and cluster records.
     If multiple iterables are passed in, only cluster across the iterables.
+    If a key is given, only records with the same key values are compared.
 
     Returns a list of tuples, each containing a cluster id and a record.
     """
-    
-    pairs, answers = block_and_match(*records)
+    if key:
+        pairs = parameter.block_func(*records, key=key)
+    else:
+        pairs = parameter.block_func(*records)
     flattened_records = [record for iter in records for record in iter]
-    digests = [digest(record) for record in flattened_records]
 
-    record_cluster_ids = {
-        d: i for i, d in enumerate(digests)
-    }
-    cluster_id_records = {
-        v: [k] for k, v in record_cluster_ids.items()
-    }
+    # assign each distinct record an integer id once,
+    # identical records share the same id
+    digest_ids, record_ids = {}, []
+    for record in flattened_records:
+        record_ids.append(
+            digest_ids.setdefault(digest(record), len(digest_ids))
+        )
+    object_ids = None
+
+    def record_id(pair, side):
+        # the pairs from libem.block carry the input positions
+        position = pair.get(f"{side}_id")
+        if position is not None:
+            return record_ids[position]
+
+        # otherwise look the record up by identity, hashing
+        # only records that are not among the inputs
+        nonlocal object_ids
+        if object_ids is None:
+            object_ids = {
+                id(record): i
+                for record, i in zip(flattened_records, record_ids)
+            }
+        record = pair[side]
+        i = object_ids.get(id(record))
+        if i is None:
+            i = digest_ids[digest(record)]
+        return i
+
+    clusters = UnionFind(len(digest_ids))
+    match_and_merge(clusters, [
+        (record_id(pair, 'left'), record_id(pair, 'right'))
+        for pair in pairs
+    ], pairs)
+
+    # cluster ids increment from 0 without gaps, the
+    # cluster_id order follows the input records order
+    labels = clusters.labels()
+    num_clusters = max(labels, default=-1) + 1
+    libem.debug(f"[cluster] {num_clusters} clusters found, average cluster size: "
+                f"{len(flattened_records) / max(num_clusters, 1):.2f}")
+
+    return [
+        (labels[i], r)
+        for i, r in zip(record_ids, flattened_records)
+    ]
+
 
-    for answer, pair in tqdm(zip(answers, pairs), total=len(answers), desc="Clustering"):
-        left, right = digest(pair['left']), digest(pair['right'])
-        left_cluster_id = record_cluster_ids[left]
-        right_cluster_id = record_cluster_ids[right]
+def merge(clusters: UnionFind,
+          edges: list[tuple[int, int]],
+          pairs: list[dict],
+          answers: list[dict]) -> int:
+    """
+    Merge the clusters of the record ids in each edge answered as a
+    match, resolving negative answers inside a cluster under the
+    conflict policy. Returns the number of conflicts found.
+    """
+    conflict = parameter.conflict()
 
+    matched, unmatched = [], []
+    for edge, pair, answer in zip(edges, pairs, answers):
         if answer['answer'] == 'yes':
-            if left_cluster_id == right_cluster_id:
-                continue
-            
-            # merge the cluster with the higher id
-            # into the lower id cluster when matched
-            low_cluster_id = min(left_cluster_id, right_cluster_id)
-            high_cluster_id = max(left_cluster_id, right_cluster_id)
-            cluster_id_records[low_cluster_id].extend(
-                cluster_id_records.pop(high_cluster_id)
-            )
-            
-            for record_digest in cluster_id_records[low_cluster_id]:
-                record_cluster_ids[record_digest] = low_cluster_id
+            matched.append(edge)
         else:
-            if left_cluster_id == right_cluster_id:
-                # TBD: report inconsistent match results
+            unmatched.append((edge, pair, answer))
+
+    if conflict == "veto":
+        for (left, right), _, _ in unmatched:
+            clusters.separate(left, right)
+
+    num_conflicts = 0
+    for left, right in tqdm(matched, desc="Clustering"):
+        if conflict == "veto" and clusters.separated(left, right):
+            num_conflicts += 1
+            libem.debug(f"[cluster] refused to merge records {left} and "
+                        f"{right} whose clusters are reported unmatched.")
+            continue
+        clusters.union(left, right)
+
+    if conflict == "ignore":
+        for (left, right), pair, answer in unmatched:
+            if clusters.connected(left, right):
+                num_conflicts += 1
                 libem.debug(f"[cluster] inconsistent match results for pair:\n"
                             f"{libem.pformat(pair)};\nanswer: {answer}.\n"
-                            f"Expected to be in the same cluster: {left_cluster_id} "
-                            f"but reported unmatched, violating the transitivity "
-                            f"of the same-as relation.")
-
-    libem.debug(f"[cluster] {len(cluster_id_records)} clusters found,"
-                f"average cluster size: {len(flattened_records) / len(cluster_id_records):.2f}")
-
-    # reassign cluster ids so that they increment from 0 without gaps, 
-    # the final cluster_id order will follow the input records order
-    for i, cluster_id in enumerate(cluster_id_records.keys()):
-        for record_digest in cluster_id_records[cluster_id]:
-            record_cluster_ids[record_digest] = i
-    
-    return [
-        (record_cluster_ids[d], r)
-        for d, r in zip(digests, flattened_records)
-    ]
+                            f"Expected to be in the same cluster: "
+                            f"{clusters.find(left)} but reported unmatched, "
+                            f"violating the transitivity of the same-as relation.")
 
+    libem.trace.add({"cluster": {"num_conflicts": num_conflicts}})
+    return num_conflicts
 
-def block_and_match(*records: Iterable[Record]) -> tuple[list[dict], list[dict]]:
-    block = parameter.block_func
-    match = parameter.match_func
 
-    pairs = block(*records)
-    if len(pairs) > 0:
-        answers = match(pairs)
-    else:
-        answers = []
+def match_and_merge(clusters: UnionFind,
+                    edges: list[tuple[int, int]],
+                    pairs: list[dict]):
+    """
+    Match the pairs and merge the clusters of the record ids in
+    each matched edge. When pruning, the pairs are matched in waves
+    in the order of their blocking similarity, skipping the pairs
+    whose answers are implied by the clusters so far.
+    """
+    prune = parameter.prune()
+    if prune == "none":
+        answers = parameter.match_func(pairs) if pairs else []
+        merge(clusters, edges, pairs, answers)
+        return
+
+    scores = similarities(pairs)
+    order = sorted(range(len(pairs)), key=lambda k: -scores[k])
+    wave_size = parameter.wave_size()
+
+    num_transitive, num_negative = 0, 0
+    start = 0
+    while start < len(order):
+        wave = []
+        while start < len(order) and len(wave) < wave_size:
+            k = order[start]
+            start += 1
+            left, right = edges[k]
+            if clusters.connected(left, right):
+                # implied by transitivity
+                num_transitive += 1
+            elif prune == "negative" and clusters.separated(left, right):
+                # the clusters are known not to match
+                num_negative += 1
+            else:
+                wave.append(k)
+        if not wave:
+            break
+
+        wave_edges = [edges[k] for k in wave]
+        wave_pairs = [pairs[k] for k in wave]
+        answers = parameter.match_func(wave_pairs)
+        merge(clusters, wave_edges, wave_pairs, answers)
+
+        if prune == "negative":
+            for (left, right), answer in zip(wave_edges, answers):
+                if answer['answer'] != 'yes':
+                    clusters.separate(left, right)
+
+    libem.debug(f"[cluster] skipped {num_transitive + num_negative} "
+                f"of {len(pairs)} pairs.")
+    libem.trace.add({
+        "cluster": {
+            "num_skipped_transitive": num_transitive,
+            "num_skipped_negative": num_negative,
+        }
+    })
 
-    return pairs, answers
+
+def similarities(pairs: list[dict]) -> list[float]:
+    """
+    The blocking similarity of each pair, 0 for pairs
+    involving records without text.
+    """
+    ignore = block_parameter.default_ignore()
+
+    procs = {}
+
+    def proc(record):
+        if id(record) not in procs:
+            procs[id(record)] = normalize(parse_input(record), ignore)[1][0]
+        return procs[id(record)]
+
+    scores = []
+    for pair in pairs:
+        left, right = proc(pair['left']), proc(pair['right'])
+        if left is None or right is None:
+            scores.append(0)
+        else:
+            scores.append(rapidfuzz_fuzz.token_set_ratio(left, right))
+    return scores
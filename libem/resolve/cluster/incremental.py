@@ -0,0 +1,215 @@
+"""
+Incremental clustering.
+
+The records resolved so far are kept in a State together with
+their clusters and a token index over their text, the blocking
+index. New records are blocked only against the index, only
+the new candidate pairs are matched, and the clusters are
+updated in place. A cluster is identified by the id of its
+first record, so existing cluster ids only change when two
+existing clusters merge, taking the id of the older one.
+Records without text are only resolved against identical
+records, as they cannot be looked up in the index.
+
+The index stands in for the default block function, comparing
+the records sharing tokens (as candidates="token" does) rather
+than all pairs. Under a custom block function, or candidates
+other than "all" and "token", the new records are instead
+blocked with the block function against the records resolved so
+far and among themselves, as libem.cluster blocks a list.
+"""
+import pickle
+from typing import Iterable
+from rapidfuzz import fuzz as rapidfuzz_fuzz
+
+import libem
+from libem.struct import Record, SingleRecord, digest
+from libem.block import parameter as block_parameter
+from libem.block.candidate import TokenIndex, tokenize
+from libem.block.function import normalize, similar
+from libem.block.struct import parse_input
+from libem.resolve.cluster import parameter
+from libem.resolve.cluster.function import match_and_merge
+from libem.resolve.cluster.union_find import UnionFind
+
+ClusterID = int
+
+
+class State:
+    """
+    The resolved records, their clusters and the blocking index.
+
+    records: the distinct records by record id, in the order added.
+    merged: the cluster ids merged away by the last update,
+            mapped to the cluster ids they were merged into.
+    """
+
+    def __init__(self):
+        self.records: list[SingleRecord] = []
+        self.digests: dict[str, int] = {}
+        # the string and normalized string of each record,
+        # None for records without text which are not indexed
+        self.texts: list[tuple[str, str] | None] = []
+        self.index = TokenIndex()
+        self.clusters = UnionFind()
+        self.merged: dict[ClusterID, ClusterID] = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def cluster_id(self, record_id: int) -> ClusterID:
+        return self.clusters.smallest(record_id)
+
+    def cluster_ids(self) -> list[ClusterID]:
+        ''' The cluster id of each record, by record id. '''
+        return [self.cluster_id(i) for i in range(len(self.records))]
+
+    def add(self, records: Iterable[SingleRecord]) -> list[ClusterID]:
+        '''
+            Resolve the records against the existing clusters,
+            returning the cluster id of each record.
+        '''
+        return [self.cluster_id(i) for i in self.insert(records)]
+
+    def insert(self, records: Iterable[SingleRecord]) -> list[int]:
+        '''
+            Resolve the records against the existing clusters,
+            returning the record id of each record.
+        '''
+        records = list(records)
+        num_existing = len(self.records)
+
+        # records identical to a known record take its id
+        record_ids, new_records = [], []
+        for record in records:
+            d = digest(record)
+            if d not in self.digests:
+                self.digests[d] = num_existing + len(new_records)
+                new_records.append(record)
+            record_ids.append(self.digests[d])
+
+        if indexed():
+            pairs, edges = self._block(new_records)
+        else:
+            pairs, edges = self._block_func(new_records)
+        libem.debug(f"[cluster] {len(new_records)} new records, "
+                    f"{len(pairs)} new candidate pairs.")
+
+        # the ids of the existing clusters the new records
+        # may merge, before and after merging
+        touched = {
+            self.cluster_id(i)
+            for edge in edges for i in edge if i < num_existing
+        }
+        match_and_merge(self.clusters, edges, pairs)
+        self.merged = {
+            old: self.cluster_id(old)
+            for old in touched if self.cluster_id(old) != old
+        }
+
+        return record_ids
+
+    def _block(self, records: list[SingleRecord],
+               query: bool = True) -> tuple[list[dict], list[tuple[int, int]]]:
+        ''' Add the records, returning their candidate pairs in the index. '''
+        ignore = block_parameter.default_ignore()
+        similarity = block_parameter.similarity()
+        min_shared = block_parameter.min_shared_tokens()
+        self.index.max_df = block_parameter.max_token_df()
+
+        strs, procs = normalize(
+            [parse_input(record)[0] for record in records], ignore
+        )
+
+        pairs, edges = [], []
+        for record, string, proc in zip(records, strs, procs):
+            i = len(self.records)
+            self.records.append(record)
+            self.clusters.add()
+
+            if proc is None:
+                self.texts.append(None)
+                self.index.add(())
+                continue
+
+            # compare with the existing and earlier new records
+            tokens = tokenize(proc)
+            for j in self.index.query(tokens, min_shared) if query else ():
+                j = int(j)
+                other_string, other_proc = self.texts[j]
+                if similar(rapidfuzz_fuzz.token_set_ratio(proc, other_proc),
+                           string, other_string, similarity):
+                    pairs.append({"left": self.records[j], "right": record})
+                    edges.append((j, i))
+
+            self.texts.append((string, proc))
+            self.index.add(tokens)
+        return pairs, edges
+
+    def _block_func(self, records: list[SingleRecord]) -> tuple[list[dict], list[tuple[int, int]]]:
+        '''
+            Add the records, blocking them with the block function
+            against the existing records and among themselves.
+        '''
+        existing = self.records[:]
+        # keep the index up to date for later inserts
+        self._block(records, query=False)
+
+        blocks = []
+        if existing and records:
+            blocks.append(((existing, records), 0))
+        if len(records) > 1:
+            blocks.append(((records,), len(existing)))
+
+        pairs, edges, seen = [], [], set()
+        for lists, offset in blocks:
+            # the record id of each input position and object
+            inputs = [r for rs in lists for r in rs]
+            objects = {id(r): offset + p for p, r in enumerate(inputs)}
+            for pair in parameter.block_func(*lists):
+                edge = tuple(
+                    self._record_id(pair, side, offset, objects)
+                    for side in ("left", "right")
+                )
+                # only the pairs with a new record, once each
+                if max(edge) >= len(existing) and edge not in seen:
+                    seen.add(edge)
+                    pairs.append(pair)
+                    edges.append(edge)
+        return pairs, edges
+
+    def _record_id(self, pair: dict, side: str,
+                   offset: int, objects: dict[int, int]) -> int:
+        # the pairs from libem.block carry the input positions,
+        # otherwise the records are looked up by identity or digest
+        position = pair.get(f"{side}_id")
+        if position is not None:
+            return offset + position
+        i = objects.get(id(pair[side]))
+        return self.digests[digest(pair[side])] if i is None else i
+
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path: str) -> "State":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+def indexed() -> bool:
+    ''' Whether the blocking configured is done with the index. '''
+    return parameter.block_func.value is parameter.block_func.default \
+        and block_parameter.candidates() in {"all", "token"}
+
+
+def func(*records: Iterable[Record], state: State) -> list[(ClusterID, SingleRecord)]:
+    """
+    Add records to the clusters in the state.
+
+    Returns a list of tuples, each containing a cluster id and
+    one of the given records.
+    """
+    flattened_records = [record for iter in records for record in iter]
+    return list(zip(state.add(flattened_records), flattened_records))
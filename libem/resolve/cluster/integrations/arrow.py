@@ -0,0 +1,39 @@
+import pyarrow as pa
+
+from libem.struct import ArrowRecords
+from libem.resolve.cluster.function import func as cluster_func
+from libem.resolve.cluster import incremental
+
+
+def cluster(*args, **kwargs):
+    return func(*args, **kwargs)
+
+
+def func(*records: ArrowRecords, sort: bool = False,
+         state: incremental.State = None,
+         key: str | list[str] | None = None) -> pa.Table:
+    if state is None:
+        clusters = cluster_func(*records, key=key)
+    elif key:
+        raise ValueError("Keys are not supported with a state, "
+                         "incremental clustering compares all records.")
+    else:
+        # only the given rows are returned, see state.merged
+        # for the existing clusters merged by them
+        clusters = incremental.func(*records, state=state)
+
+    if len(records) == 1:
+        new_records = records[0]
+    else:
+        new_records = ArrowRecords(pa.concat_tables(
+            [r.table for r in records], promote_options="default"
+        ))
+    table = new_records.with_column(
+        "__cluster__",
+        pa.array([cluster_id for cluster_id, _ in clusters], pa.int64()),
+    )
+
+    if sort:
+        return table.sort_by("__cluster__")
+
+    return table
@@ -1,7 +1,33 @@
+"""
+Clustering of DuckDB tables, pushed down into DuckDB.
+
+Candidate pairs are the rows sharing tokens (with the same key
+values, given a key), found by a self-join of a side table of the
+tokens of each row inside DuckDB. Only their row ids and texts are
+streamed out in Arrow record batches, filtered on the blocking
+similarity, and the records of the pairs passing it are fetched and
+matched batch by batch. Only the __cluster__ column is written back,
+with an UPDATE from a side table, so the driver holds one batch of
+records and an integer per row rather than the whole table.
+
+The token join stands in for the default block function, as the
+index of incremental clustering does. Under a custom block function,
+or candidates other than "all" and "token", the records are read
+and clustered as a list with the block function instead.
+"""
 import duckdb
 import pandas as pd
+import pyarrow as pa
+from fuzzywuzzy import utils
+from rapidfuzz import process as rapidfuzz_process
+from rapidfuzz import fuzz as rapidfuzz_fuzz
 
-from libem.resolve.cluster.function import func as cluster_func
+from libem.block import parameter as block_parameter
+from libem.block.candidate import MIN_INDEX_SIZE
+from libem.block.function import convert_to_str, similar
+from libem.resolve.cluster import incremental
+from libem.resolve.cluster.function import func as cluster_func, match_and_merge
+from libem.resolve.cluster.union_find import UnionFind
 
 
 class Table:
@@ -21,6 +47,12 @@ class Table:
         else:
             return self.replace(df)
 
+    def columns(self) -> list[str]:
+        return self.conn.execute(
+            "SELECT column_name FROM INFORMATION_SCHEMA.COLUMNS "
+            "WHERE table_name = ? ORDER BY ordinal_position", [self.name]
+        ).fetchdf()["column_name"].tolist()
+
     def exist(self):
         tables = self.conn.execute(
             "SELECT table_name "
@@ -51,13 +83,321 @@ def cluster(*args, **kwargs):
     return func(*args, **kwargs)
 
 
-def func(table: Table, sort: bool = False) -> Table:
-    df = table()
+def func(table: Table, sort: bool = False,
+         state: incremental.State = None,
+         key: str | list[str] | None = None) -> Table:
+    if isinstance(key, str):
+        key = [key]
 
-    clusters = cluster_func(df.to_dict(orient="records"))
-    df["__cluster__"] = [cluster_id for cluster_id, _ in clusters]
+    if state is not None:
+        if key:
+            raise ValueError("Keys are not supported with a state, "
+                             "incremental clustering compares all records.")
+        update(table, state)
+    else:
+        resolve(table, key)
 
     if sort:
-        df = df.sort_values(by="__cluster__")
+        table.conn.execute(
+            f"CREATE OR REPLACE TABLE {table.name} AS "
+            f"SELECT * FROM {table.name} ORDER BY __cluster__"
+        )
+    return table
+
+
+def resolve(table: Table, key: list[str] | None = None) -> Table:
+    """
+    Cluster the rows of the table, setting their __cluster__ column.
+    Cluster ids increment from 0 without gaps in the order of the rows.
+    """
+    conn, name = table.conn, table.name
+    add_cluster_column(table)
+
+    columns = [c for c in table.columns() if c != "__cluster__"]
+    for k in key or []:
+        if k not in columns:
+            raise ValueError(f"Key {k} not found in table {name}.")
+
+    if incremental.indexed():
+        find = match_tokens(table, columns, key).find
+    else:
+        find = match_records(table, columns, key).__getitem__
+
+    # number the clusters in the order of the rows and
+    # write them back a batch of rows at a time
+    labels = {}
+    try:
+        conn.begin()
+        for batch in _batches(
+                conn, f"SELECT rowid AS row_id FROM {name} ORDER BY rowid",
+                block_parameter.batch_size()):
+            row_ids = batch.column("row_id").to_pylist()
+            cluster_ids = [
+                labels.setdefault(find(i), len(labels))
+                for i in row_ids
+            ]
+            _update(conn, name, row_ids, cluster_ids)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    return table
+
+
+def match_tokens(table: Table, columns: list[str],
+                 key: list[str] | None = None) -> UnionFind:
+    """
+    Match the rows sharing tokens (as candidates="token" does), with
+    the same key values, returning their clusters by rowid.
+
+    The text and tokens of each row are written to side tables and
+    the pairs sharing tokens are found by a join on the tokens, so
+    only the row ids and texts of the candidate pairs leave DuckDB.
+    The pairs passing the blocking similarity are matched in batches,
+    fetching the records of their rows only.
+    """
+    conn, name = table.conn, table.name
+    ignore = block_parameter.default_ignore()
+    similarity = block_parameter.similarity()
+    batch_size = block_parameter.batch_size()
+
+    num_rows = conn.execute(
+        f"SELECT COALESCE(MAX(rowid) + 1, 0) FROM {name}"
+    ).fetchone()[0]
+    clusters = UnionFind(num_rows)
+
+    texts, tokens = f"__{name}_texts__", f"__{name}_tokens__"
+    try:
+        conn.execute(f"CREATE OR REPLACE TABLE {texts} "
+                     f"(row_id BIGINT, string VARCHAR, proc VARCHAR)")
+        conn.execute(f"CREATE OR REPLACE TABLE {tokens} "
+                     f"(row_id BIGINT, token VARCHAR)")
+        for batch in _batches(
+                conn, f"SELECT rowid AS row_id, {_record(columns)} AS record "
+                      f"FROM {name}", batch_size):
+            row_ids = batch.column("row_id").to_pylist()
+            strs = [convert_to_str(r, ignore)
+                    for r in batch.column("record").to_pylist()]
+            procs = [utils.full_process(s, force_ascii=True) for s in strs]
+            rows = pa.table({
+                "row_id": pa.array(row_ids, pa.int64()),
+                "string": pa.array(strs, pa.string()),
+                "proc": pa.array(procs, pa.string()),
+            })
+            conn.register("__rows__", rows)
+            try:
+                conn.execute(f"INSERT INTO {texts} SELECT * FROM __rows__")
+                conn.execute(
+                    f"INSERT INTO {tokens} SELECT DISTINCT row_id, "
+                    f"UNNEST(string_split(proc, ' ')) AS token "
+                    f"FROM __rows__ WHERE proc <> ''"
+                )
+            finally:
+                conn.unregister("__rows__")
+
+        # tokens found in more than max_token_df of the rows (and
+        # in more than two rows) are ignored, as by the TokenIndex
+        max_df = block_parameter.max_token_df() \
+            if num_rows >= MIN_INDEX_SIZE else None
+        stop = (
+            f"WHERE token NOT IN (SELECT token FROM {tokens} GROUP BY token "
+            f"HAVING COUNT(*) > GREATEST({float(max_df)} * {num_rows}, 2))"
+            if max_df is not None else ""
+        )
+        keys = "".join(
+            f" AND l.{_identifier(k)} IS NOT DISTINCT FROM r.{_identifier(k)}"
+            for k in key or []
+        )
+        query = (
+            f"WITH tokens AS (SELECT * FROM {tokens} {stop}), "
+            f"shared AS (SELECT a.row_id AS left_id, b.row_id AS right_id "
+            f"FROM tokens a JOIN tokens b "
+            f"ON a.token = b.token AND a.row_id < b.row_id GROUP BY ALL "
+            f"HAVING COUNT(*) >= {int(block_parameter.min_shared_tokens())}) "
+            f"SELECT s.left_id, s.right_id, "
+            f"lt.string AS left_string, lt.proc AS left_proc, "
+            f"rt.string AS right_string, rt.proc AS right_proc "
+            f"FROM shared s "
+            f"JOIN {texts} lt ON lt.row_id = s.left_id "
+            f"JOIN {texts} rt ON rt.row_id = s.right_id"
+            + (f" JOIN {name} l ON l.rowid = s.left_id "
+               f"JOIN {name} r ON r.rowid = s.right_id WHERE TRUE{keys}"
+               if keys else "")
+        )
+
+        edges = []
+        for batch in _batches(conn, query, batch_size):
+            edges.extend(filter_pairs(batch, similarity))
+            if len(edges) >= batch_size:
+                _match(table, columns, clusters, edges)
+                edges = []
+        if edges:
+            _match(table, columns, clusters, edges)
+    finally:
+        conn.execute(f"DROP TABLE IF EXISTS {texts}")
+        conn.execute(f"DROP TABLE IF EXISTS {tokens}")
+    return clusters
+
+
+def match_records(table: Table, columns: list[str],
+                  key: list[str] | None = None) -> dict[int, int]:
+    """
+    Cluster the records of the rows with the configured block function,
+    for when it or the candidates are customized, returning the cluster
+    id of each rowid. The records are read into memory.
+    """
+    df = table.conn.execute(
+        f"SELECT rowid AS __rowid__, "
+        f"{', '.join(_identifier(c) for c in columns)} "
+        f"FROM {table.name} ORDER BY rowid"
+    ).df()
+    records = df.drop(columns="__rowid__").to_dict(orient="records")
+    clusters = cluster_func(records, key=key) if records else []
+    return {
+        row_id: cluster_id
+        for row_id, (cluster_id, _) in zip(df["__rowid__"].tolist(), clusters)
+    }
+
+
+def filter_pairs(batch: pa.RecordBatch,
+                 similarity: int) -> list[tuple[int, int]]:
+    """ The row ids of the pairs in the batch passing the blocking similarity. """
+    left_ids = batch.column("left_id").to_pylist()
+    right_ids = batch.column("right_id").to_pylist()
+    left_strs = batch.column("left_string").to_pylist()
+    right_strs = batch.column("right_string").to_pylist()
+
+    scores = rapidfuzz_process.cpdist(
+        batch.column("left_proc").to_pylist(),
+        batch.column("right_proc").to_pylist(),
+        scorer=rapidfuzz_fuzz.token_set_ratio,
+        workers=-1,
+    )
+    return [
+        (left_ids[k], right_ids[k])
+        for k in range(len(left_ids))
+        if similar(scores[k], left_strs[k], right_strs[k], similarity)
+    ]
+
+
+def _match(table: Table, columns: list[str],
+           clusters: UnionFind, edges: list[tuple[int, int]]):
+    """ Match the pairs of rows, reading the records of their rows. """
+    conn = table.conn
+    ids = pa.table({
+        "row_id": pa.array(sorted({i for edge in edges for i in edge}),
+                           pa.int64()),
+    })
+    conn.register("__ids__", ids)
+    try:
+        result = _arrow(conn.execute(
+            f"SELECT rowid AS row_id, {_record(columns)} AS record "
+            f"FROM {table.name} WHERE rowid IN (SELECT row_id FROM __ids__)"
+        ))
+    finally:
+        conn.unregister("__ids__")
+    records = dict(zip(result.column("row_id").to_pylist(),
+                       result.column("record").to_pylist()))
+    match_and_merge(clusters, edges, [
+        {"left": records[left], "right": records[right]}
+        for left, right in edges
+    ])
+
+
+def add_cluster_column(table: Table):
+    if "__cluster__" not in table.columns():
+        table.conn.execute(
+            f"ALTER TABLE {table.name} ADD COLUMN __cluster__ BIGINT"
+        )
+
+
+def update(table: Table, state: incremental.State) -> Table:
+    """
+    Add the rows without a cluster (all rows, the first time) to
+    the clusters in the state, setting their __cluster__ column
+    and relabeling the rows of merged clusters in place.
+    """
+    conn = table.conn
+    add_cluster_column(table)
+
+    df = conn.execute(
+        f"SELECT rowid AS __rowid__, * EXCLUDE (__cluster__) "
+        f"FROM {table.name} WHERE __cluster__ IS NULL"
+    ).df()
+    if len(df) == 0:
+        return table
+
+    clusters = incremental.func(
+        df.drop(columns="__rowid__").to_dict(orient="records"),
+        state=state,
+    )
+    merged = pd.DataFrame({
+        "old_id": list(state.merged.keys()),
+        "new_id": list(state.merged.values()),
+    }, dtype="int64")
+
+    try:
+        conn.begin()
+        conn.register("__merged__", merged)
+        conn.execute(
+            f"UPDATE {table.name} SET __cluster__ = m.new_id "
+            f"FROM __merged__ m WHERE {table.name}.__cluster__ = m.old_id"
+        )
+        _update(conn, table.name, df["__rowid__"].tolist(),
+                [cluster_id for cluster_id, _ in clusters])
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        raise e
+    finally:
+        conn.unregister("__merged__")
+    return table
+
+
+def _update(conn: duckdb.DuckDBPyConnection, name: str,
+            row_ids: list[int], cluster_ids: list[int]):
+    """ Set the __cluster__ column of the rows from a side table. """
+    rows = pa.table({
+        "row_id": pa.array(row_ids, pa.int64()),
+        "cluster_id": pa.array(cluster_ids, pa.int64()),
+    })
+    conn.register("__rows__", rows)
+    try:
+        conn.execute(
+            f"UPDATE {name} SET __cluster__ = r.cluster_id "
+            f"FROM __rows__ r WHERE {name}.rowid = r.row_id"
+        )
+    finally:
+        conn.unregister("__rows__")
+
+
+def _batches(conn: duckdb.DuckDBPyConnection, query: str, batch_size: int):
+    # stream on a cursor of its own so that the
+    # connection remains free for other statements
+    result = conn.cursor().execute(query)
+    # fetch_record_batch is deprecated in favor of to_arrow_reader
+    if hasattr(result, "to_arrow_reader"):
+        return result.to_arrow_reader(batch_size)
+    return result.fetch_record_batch(batch_size)
+
+
+def _arrow(result) -> pa.Table:
+    # fetch_arrow_table is deprecated in favor of to_arrow_table
+    if hasattr(result, "to_arrow_table"):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+def _record(columns: list[str]) -> str:
+    """ The columns of a row as a struct, read as a dict. """
+    return "{" + ", ".join(
+        f"{_literal(c)}: {_identifier(c)}" for c in columns
+    ) + "}"
+
+
+def _identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
 
-    return table(df)
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
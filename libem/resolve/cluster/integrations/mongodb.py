@@ -1,7 +1,18 @@
-import bson
+"""
+Clustering of MongoDB collections.
+
+Documents are streamed from a cursor in batches, without their _id,
+and added batch by batch to incremental clusters (see
+libem.resolve.cluster.incremental), so that each batch is blocked
+and matched only against the documents seen before it. The cluster
+ids of each batch are written back before the next batch is read,
+with unordered bulk writes that set only the __cluster__ field.
+"""
 import pymongo.database
+from pymongo import UpdateOne, UpdateMany
 
-from libem.resolve.cluster.function import func as cluster_func
+from libem.block import parameter as block_parameter
+from libem.resolve.cluster import incremental
 
 
 class Collection:
@@ -47,6 +58,28 @@ class Collection:
     def load(self) -> list:
         return list(self.db[self.name].find({}))
 
+    def iter(self, filter: dict = None, batch_size: int = 1000):
+        """ Stream the documents (without their __cluster__
+        field) in lists of up to batch_size documents. """
+        cursor = self.db[self.name].find(
+            filter or {}, {"__cluster__": 0}, batch_size=batch_size,
+        )
+        batch = []
+        for doc in cursor:
+            batch.append(doc)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def write(self, operations: list, batch_size: int = 1000):
+        """ Apply the write operations in unordered bulk writes. """
+        for start in range(0, len(operations), batch_size):
+            self.db[self.name].bulk_write(
+                operations[start:start + batch_size], ordered=False
+            )
+
     def replace(self, collection: list):
         session = self.client.start_session()
         with session.start_transaction():
@@ -64,30 +97,44 @@ def cluster(*args, **kwargs):
     return func(*args, **kwargs)
 
 
-def func(coll: Collection, sort: bool = False) -> Collection:
-    docs = decode_id(coll())
-    clusters = cluster_func(docs)
+def func(coll: Collection, sort: bool = False,
+         state: incremental.State = None) -> Collection:
+    """
+    Cluster the documents, setting their __cluster__ field. Given a
+    state, only the documents without a cluster are added to the
+    clusters in the state, relabeling the documents of merged clusters.
+    Without one, all the documents are added to a new state, so cluster
+    ids are those of incremental clustering rather than of a list.
+
+    Documents are not reordered: with sort, an index is created on
+    __cluster__ so they can be read in cluster order, with
+    find().sort("__cluster__").
+    """
+    batch_size = block_parameter.batch_size()
+
+    if state is None:
+        state = incremental.State()
+        filter = {}
+    else:
+        filter = {"__cluster__": {"$exists": False}}
+
+    # each batch is blocked and matched against the documents
+    # before it and written before the next batch is read
+    for docs in coll.iter(filter, batch_size):
+        record_ids = state.insert(
+            {k: v for k, v in doc.items() if k != "_id"} for doc in docs
+        )
+        operations = [
+            UpdateMany({"__cluster__": old}, {"$set": {"__cluster__": new}})
+            for old, new in state.merged.items()
+        ]
+        operations.extend(
+            UpdateOne({"_id": doc["_id"]},
+                      {"$set": {"__cluster__": state.cluster_id(i)}})
+            for doc, i in zip(docs, record_ids)
+        )
+        coll.write(operations, batch_size)
 
     if sort:
-        clusters = sorted(clusters, key=lambda x: x[0])
-
-    return coll(encode_id([
-        {
-            "__cluster__": id,
-            **doc
-        } for id, doc in clusters
-    ]))
-
-
-def decode_id(docs: list) -> list:
-    for doc in docs:
-        if "_id" in doc:
-            doc["_id"] = str(doc["_id"])
-    return docs
-
-
-def encode_id(docs: list) -> list:
-    for doc in docs:
-        if "_id" in doc:
-            doc["_id"] = bson.ObjectId(doc["_id"])
-    return docs
+        coll.db[coll.name].create_index("__cluster__")
+    return coll
@@ -1,6 +1,9 @@
 import pandas as pd
+import pyarrow as pa
 
+from libem.struct import ArrowRecords
 from libem.resolve.cluster.function import func as cluster_func
+from libem.resolve.cluster import incremental
 
 schema = {
     "type": "function",
@@ -27,19 +30,37 @@ def cluster(*args, **kwargs):
     return func(*args, **kwargs)
 
 
-def func(*dfs: pd.DataFrame, sort: bool = False) -> pd.DataFrame:
-    clusters = cluster_func(
-        *[df.to_dict(orient="records") for df in dfs]
-    )
+def func(*dfs: pd.DataFrame, sort: bool = False,
+         state: incremental.State = None,
+         key: str | list[str] | None = None) -> pd.DataFrame:
+    records = [to_records(df) for df in dfs]
+    if state is None:
+        clusters = cluster_func(*records, key=key)
+    elif key:
+        raise ValueError("Keys are not supported with a state, "
+                         "incremental clustering compares all records.")
+    else:
+        # only the given rows are returned, see state.merged
+        # for the existing clusters merged by them
+        clusters = incremental.func(*records, state=state)
     
-    rows = []
-    for cluster_id, record in clusters:
-        row = record.copy()
-        row["__cluster__"] = cluster_id
-        rows.append(row)
-    new_df = pd.DataFrame(rows)
+    new_df = pd.concat(dfs, ignore_index=True)
+    new_df["__cluster__"] = [cluster_id for cluster_id, _ in clusters]
 
     if sort:
         return new_df.sort_values(by="__cluster__")
 
     return new_df
+
+
+def to_records(df: pd.DataFrame) -> ArrowRecords | list[dict]:
+    '''
+    The rows of the DataFrame, read lazily from arrow columns
+    rather than copied into per-row dicts, unless its columns
+    cannot be converted to arrow, e.g., object columns with
+    mixed types or array (image) cells.
+    '''
+    try:
+        return ArrowRecords(df)
+    except pa.ArrowException:
+        return df.to_dict(orient="records")
@@ -3,16 +3,20 @@ from typing import (
     TYPE_CHECKING
 )
 
-from libem.struct import SingleRecord
+from libem.struct import SingleRecord, ArrowRecords
 from libem.resolve.cluster.function import func
+from libem.resolve.cluster.incremental import State
+from libem.resolve.cluster import incremental
 
 if TYPE_CHECKING:
     import pandas as pd
+    import pyarrow as pa
     from libem.resolve.cluster.integrations import duckdb
     from libem.resolve.cluster.integrations import mongodb
 
 InputType = Union[
     Iterator[SingleRecord],
+    ArrowRecords,
     "pd.DataFrame",
     "duckdb.Table",
     "mongodb.Collection",
@@ -22,16 +26,24 @@ ID = int
 
 OutputType = Union[
     list[(ID, SingleRecord)],
+    "pa.Table",
     "pd.DataFrame",
     "duckdb.Table",
     "mongodb.Collection",
 ]
 
 
-def cluster(*records: InputType, sort=False) -> OutputType:
+def cluster(*records: InputType, sort=False, state: State | None = None,
+            key: str | list[str] | None = None) -> OutputType:
+    '''
+    Cluster the records, only comparing records with the same
+    values on the key (if given). Given a state, the records are
+    instead added to the clusters resolved so far, updating the state.
+    '''
     import pandas as pd
 
     from libem.resolve.cluster.integrations import pandas
+    from libem.resolve.cluster.integrations import arrow
     from libem.resolve.cluster.integrations import duckdb
     from libem.resolve.cluster.integrations import mongodb
     
@@ -40,21 +52,30 @@ def cluster(*records: InputType, sort=False) -> OutputType:
         assert type(record) == first_type
     
     match first_type:
+        case arrow.ArrowRecords:
+            return arrow.cluster(*records, sort=sort, state=state, key=key)
         case pd.DataFrame:
-            return pandas.cluster(*records, sort=sort)
+            return pandas.cluster(*records, sort=sort, state=state, key=key)
         case duckdb.Table:
             if len(records) > 1:
                 raise NotImplementedError
-            return duckdb.cluster(records[0], sort=sort)
+            return duckdb.cluster(records[0], sort=sort, state=state, key=key)
         case mongodb.Collection:
-            if len(records) > 1:
+            if len(records) > 1 or key:
                 raise NotImplementedError
-            return mongodb.cluster(records[0], sort=sort)
+            return mongodb.cluster(records[0], sort=sort, state=state)
         case _:
+            if state is not None:
+                if key:
+                    raise ValueError("Keys are not supported with a state, "
+                                     "incremental clustering compares all records.")
+                clusters = incremental.func(*records, state=state)
+            else:
+                clusters = func(*records, key=key)
             if sort:
-                return sorted(func(*records), key=lambda x: x[0])
+                return sorted(clusters, key=lambda x: x[0])
             else:
-                return func(*records)
+                return clusters
 
 
 def eval(truths: list[int], preds: list[int]) -> dict:
@@ -1,10 +1,35 @@
+import libem
 from libem.core.struct import Parameter
 from libem.interface import block, match
 
 block_func = Parameter(
-    default=block,
+    # pairs carrying the input positions of their
+    # records are joined back without hashing
+    default=lambda *records, **kwargs: block(*records, ids=True, **kwargs),
 )
 
 match_func = Parameter(
     default=match,
 )
+
+# how to resolve a negative answer for two records that end
+# up in the same cluster: "ignore" keeps the cluster and reports
+# the inconsistency, "veto" refuses the merges that would join
+# records reported unmatched
+conflict = Parameter(
+    default="ignore",
+    options=["ignore", "veto"],
+)
+
+# skip matching pairs whose answer is implied by earlier answers:
+# "none" matches all pairs, "transitive" matches the pairs in waves
+# of wave_size in the order of their blocking similarity, skipping
+# pairs already in the same cluster, "negative" also skips pairs
+# between clusters known not to match
+prune = Parameter(
+    default="none",
+    options=["none", "transitive", "negative"],
+)
+wave_size = Parameter(
+    default=libem.LIBEM_MAX_ASYNC_TASKS,
+)
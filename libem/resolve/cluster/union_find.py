@@ -0,0 +1,95 @@
+from array import array
+
+
+class UnionFind:
+    '''
+        Disjoint sets over the integer ids 0..size-1 with path
+        compression and union by rank, kept in flat arrays.
+
+        Negative edges (pairs known not to match) can be recorded
+        so that merging two sets joined by one can be refused.
+    '''
+
+    def __init__(self, size: int = 0):
+        self.parent = array("q", range(size))
+        self.rank = array("b", bytes(size))
+        # the smallest id in each set, kept at its root
+        self.first = array("q", range(size))
+        # root -> ids of records known not to match a member
+        self.negatives: dict[int, set[int]] = {}
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, num: int = 1) -> range:
+        ''' Add singleton sets, returning their ids. '''
+        start = len(self.parent)
+        self.parent.extend(range(start, start + num))
+        self.rank.extend(bytes(num))
+        self.first.extend(range(start, start + num))
+        return range(start, start + num)
+
+    def find(self, i: int) -> int:
+        parent = self.parent
+
+        root = i
+        while parent[root] != root:
+            root = parent[root]
+
+        # point every id on the path directly at the root
+        while parent[i] != root:
+            parent[i], i = root, parent[i]
+        return root
+
+    def union(self, i: int, j: int) -> int:
+        ''' Merge the sets of i and j, returning the new root. '''
+        i, j = self.find(i), self.find(j)
+        if i == j:
+            return i
+
+        rank = self.rank
+        if rank[i] < rank[j]:
+            i, j = j, i
+        self.parent[j] = i
+        if rank[i] == rank[j]:
+            rank[i] += 1
+        self.first[i] = min(self.first[i], self.first[j])
+
+        # the surviving root inherits the negative edges
+        if j in self.negatives:
+            self.negatives.setdefault(i, set()).update(
+                self.negatives.pop(j)
+            )
+        return i
+
+    def smallest(self, i: int) -> int:
+        ''' The smallest id in the set of i. '''
+        return self.first[self.find(i)]
+
+    def connected(self, i: int, j: int) -> bool:
+        return self.find(i) == self.find(j)
+
+    def separate(self, i: int, j: int):
+        ''' Record that i and j should not be in the same set. '''
+        self.negatives.setdefault(self.find(i), set()).add(j)
+        self.negatives.setdefault(self.find(j), set()).add(i)
+
+    def separated(self, i: int, j: int) -> bool:
+        ''' Whether a negative edge joins the sets of i and j. '''
+        i, j = self.find(i), self.find(j)
+        i_negatives = self.negatives.get(i, set())
+        j_negatives = self.negatives.get(j, set())
+        # edges are kept on both ends, so scan the smaller side
+        if len(i_negatives) > len(j_negatives):
+            i, j, i_negatives = j, i, j_negatives
+        return any(self.find(k) == j for k in i_negatives)
+
+    def labels(self) -> list[int]:
+        '''
+            Label each id with its set, numbering the sets from 0
+            without gaps in the order of their smallest id.
+        '''
+        labels, roots = [], {}
+        for i in range(len(self.parent)):
+            labels.append(roots.setdefault(self.find(i), len(roots)))
+        return labels
@@ -1,5 +1,6 @@
 from collections.abc import Iterable, Mapping, Sequence
 from typing import TypedDict
+from typing_extensions import NotRequired
 from pydantic import BaseModel
 from PIL import Image
 import numpy as np
@@ -19,6 +20,132 @@ class MultimodalRecord(BaseModel):
     class Config:
         arbitrary_types_allowed = True
 
+class Row(Mapping):
+    '''
+    A read-only view of a row of ArrowRecords, reading
+    its values from the columns only when accessed.
+    '''
+    __slots__ = ("records", "index")
+
+    def __init__(self, records: "ArrowRecords", index: int):
+        self.records = records
+        self.index = index
+
+    def __getitem__(self, key: str):
+        try:
+            return self.records.values(key)[self.index]
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __iter__(self):
+        return iter(self.records.columns)
+
+    def __len__(self):
+        return len(self.records.columns)
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+    def __reduce__(self):
+        # pickle the values rather than the whole table
+        return dict, (self.to_dict(),)
+
+    def to_dict(self) -> dict:
+        return {
+            name: self.records.values(name)[self.index]
+            for name in self.records.columns
+        }
+
+
+class ArrowRecords(Sequence):
+    '''
+    Records kept column by column in a PyArrow table, given
+    as a table, a pandas DataFrame or a dict of columns. Each
+    record is a Row, so no per-record dict is materialized.
+
+    A column is converted to Python values once, when first
+    read. Arrow keeps missing values as nulls, which are read
+    as None, except for the columns of a DataFrame with missing
+    values of a single kind (e.g., NaN in float columns), read
+    as that value as in the DataFrame's records.
+    '''
+
+    def __init__(self, table):
+        import pyarrow as pa
+        import pandas as pd
+
+        # the value read for the nulls of each column
+        self.nulls = {}
+        match table:
+            case pa.Table():
+                pass
+            case pd.DataFrame():
+                self.nulls = _missing_values(table)
+                table = pa.Table.from_pandas(table, preserve_index=False)
+            case Mapping():
+                table = pa.table(table)
+            case _:
+                raise ValueError(
+                    f"unexpected input type: {type(table)}, "
+                    f"must be a pyarrow Table, DataFrame or dict."
+                )
+        self.table = table
+        # contiguous columns for constant time access by index
+        self.columns = {
+            name: column.combine_chunks()
+            for name, column in zip(table.column_names, table.columns)
+        }
+        self._values: dict[str, list] = {}
+
+    def __len__(self):
+        return self.table.num_rows
+
+    def __getitem__(self, index: int) -> Row:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Row(self, index)
+
+    def __iter__(self):
+        return (Row(self, i) for i in range(len(self)))
+
+    def values(self, name: str) -> list:
+        ''' The Python values of a column. '''
+        values = self._values.get(name)
+        if values is None:
+            values = self.columns[name].to_pylist()
+            if name in self.nulls:
+                null = self.nulls[name]
+                values = [null if v is None else v for v in values]
+            self._values[name] = values
+        return values
+
+    def with_column(self, name: str, values):
+        ''' The table with a column added or replaced. '''
+        if name in self.table.column_names:
+            return self.table.set_column(
+                self.table.column_names.index(name), name, [values]
+            )
+        return self.table.append_column(name, [values])
+
+
+def _missing_values(df) -> dict:
+    ''' The missing value of each column of the DataFrame with missing values of one kind. '''
+    nulls = {}
+    for name in df.columns:
+        mask = df[name].isna()
+        if not mask.any():
+            continue
+        # as found in the records of the DataFrame
+        missing = df.loc[mask, [name]].to_dict(orient="list")[name]
+        if len({type(v) for v in missing}) == 1 and missing[0] is not None:
+            nulls[name] = missing[0]
+    return nulls
+
+
 # If multiple images belong to the same record 
 # (in an Iterable or Mapping), use MultimodalRecord
 SingleRecord = TextFields | ImageField | MultimodalRecord
@@ -28,6 +155,9 @@ Record = SingleRecord | Iterable[SingleRecord]
 class Pair(TypedDict):
     left: Record
     right: Record
+    # positions of the records in the blocking input
+    left_id: NotRequired[int]
+    right_id: NotRequired[int]
 
 
 Left = Record | Pair | Iterable[Pair]
@@ -47,20 +177,22 @@ Output = Answer | list[Answer]
 def digest(record: SingleRecord) -> str:
     ''' Generate an MD5 hash for a single record. '''
     import hashlib
-    import io
     import json
 
     match record:
         case str():
             data = record.encode()
         case Mapping():
-            data = json.dumps(record, sort_keys=True).encode()
+            if isinstance(record, Row):
+                record = record.to_dict()
+            elif not isinstance(record, dict):
+                record = dict(record)
+            # array (image) values are encoded by their digests
+            data = json.dumps(record, sort_keys=True, default=_digest_value).encode()
         case np.ndarray():
             data = record.tobytes() + str(record.shape).encode()
         case Image.Image():
-            buf = io.BytesIO()
-            record.save(buf, format='PNG')
-            data = buf.getvalue()
+            return _digest_image(record)
         case MultimodalRecord():
             if record.text is None:
                 text = b''
@@ -79,3 +211,29 @@ def digest(record: SingleRecord) -> str:
         case _:
             data = str(record).encode()
     return hashlib.md5(data).hexdigest()
+
+
+def _digest_value(value) -> str:
+    if isinstance(value, (np.ndarray, Image.Image)):
+        return digest(value)
+    return str(value)
+
+
+# image digests memoized by object, dropped once the image is collected
+_image_digests: dict[int, str] = {}
+
+
+def _digest_image(image: Image.Image) -> str:
+    ''' Hash the raw pixels of an image, which is assumed unchanged once hashed. '''
+    import hashlib
+    import weakref
+
+    key = id(image)
+    value = _image_digests.get(key)
+    if value is None:
+        value = hashlib.md5(
+            f"{image.mode} {image.size}".encode() + image.tobytes()
+        ).hexdigest()
+        _image_digests[key] = value
+        weakref.finalize(image, _image_digests.pop, key, None)
+    return value
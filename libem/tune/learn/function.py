@@ -12,13 +12,18 @@ def predict(dataset) -> tuple[list, list, list, list]:
     preds, truths = [], []
     mistakes, successes = [], []
 
-    # TBD avoid forcing pair-wise prediction
-    for i, record in enumerate(dataset):
-        left, right, truth = str(record["left"]), \
-                             str(record["right"]), \
-                             record["label"]
-
-        pred = libem.match(left, right)["answer"]
+    dataset = list(dataset)
+    lefts = [str(record["left"]) for record in dataset]
+    rights = [str(record["right"]) for record in dataset]
+
+    # match all pairs in one call, so that their
+    # model calls are issued concurrently
+    outputs = libem.match(lefts, rights) if dataset else []
+
+    for i, (left, right, record, output) in enumerate(
+            zip(lefts, rights, dataset, outputs)):
+        truth = record["label"]
+        pred = output["answer"]
         libem.info("[predict] record:", i, "pred:", pred, "true:", truth)
 
         preds.append(1 if pred.lower() == "yes" else 0)
@@ -11,6 +11,10 @@ setup(
     python_requires='>=3.10',
     include_package_data=True,
     install_requires = open('requirements.txt').readlines(),
+    extras_require={
+        "test": ["mongomock"],
+        "ray": ["ray>=2.43.0"],
+    },
     scripts=['cli/libem'],
 )
 
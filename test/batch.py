@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import email
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import libem
+from libem.core import model
+from libem.optimize.batch import provider
+
+# a local stand-in for the provider's file and batch endpoints
+files, batches, metadata = {}, {}, {}
+state = {"ready": True}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, raw=False):
+        data = body if raw else json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        data = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            message = email.message_from_bytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + data
+            )
+            content = next(part.get_payload(decode=True)
+                           for part in message.get_payload()
+                           if part.get_filename())
+            file_id = f"file-{len(files)}"
+            files[file_id] = content
+            self.reply({"id": file_id, "object": "file", "bytes": len(content),
+                        "created_at": 0, "filename": "input.jsonl",
+                        "purpose": "batch", "status": "processed"})
+        elif self.path == "/v1/batches":
+            body = json.loads(data)
+            job_id = f"batch-{len(batches)}"
+            batches[job_id] = body["input_file_id"]
+            metadata[job_id] = body.get("metadata")
+            self.reply(self.job(job_id))
+
+    def do_GET(self):
+        if self.path.startswith("/v1/batches/"):
+            job_id = self.path.split("/")[-1]
+            if job_id not in batches:
+                data = json.dumps({"error": {"message": "not found"}}).encode()
+                self.send_response(404)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                return
+            self.reply(self.job(job_id))
+        elif self.path.endswith("/content"):
+            self.reply(files[self.path.split("/")[-2]], raw=True)
+
+    def job(self, job_id):
+        status = "completed" if state["ready"] else "in_progress"
+        output_file_id = None
+        if state["ready"]:
+            output_file_id = f"{job_id}-output"
+            if output_file_id not in files:
+                files[output_file_id] = self.output(files[batches[job_id]])
+        return {"id": job_id, "object": "batch", "endpoint": "/v1/chat/completions",
+                "input_file_id": batches[job_id], "completion_window": "24h",
+                "created_at": 0, "status": status, "output_file_id": output_file_id,
+                "metadata": metadata[job_id]}
+
+    @staticmethod
+    def output(data):
+        lines = []
+        for line in data.decode().splitlines():
+            request = json.loads(line)
+            prompt = request["body"]["messages"][-1]["content"]
+            # fail the requests mentioning a pear
+            if "pear" in prompt:
+                response = {"status_code": 500, "body": {}}
+            else:
+                # batch prompts are answered pair by pair
+                queries = re.split(r"^\d+:$", prompt, flags=re.MULTILINE)[1:]
+                if queries:
+                    answer = "\n".join(
+                        f"{i + 1}: {'yes' if 'apple' in q else 'no'}"
+                        for i, q in enumerate(queries)
+                    )
+                else:
+                    answer = "yes" if "apple" in prompt else "no"
+                response = {"status_code": 200, "body": {
+                    "choices": [{"message": {"role": "assistant", "content": answer}}],
+                    "usage": {"prompt_tokens": 10, "completion_tokens": 1},
+                }}
+            lines.append(json.dumps({"custom_id": request["custom_id"],
+                                     "response": response}))
+        return "\n".join(lines).encode()
+
+
+server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+
+environ = dict(os.environ)
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{server.server_port}/v1"
+model.reset()
+
+# requests that fail within the job are matched online
+num_calls = 0
+
+
+async def fake_call(*args, **kwargs):
+    global num_calls
+    num_calls += 1
+    return {
+        "output": "yes",
+        "tool_outputs": [],
+        "messages": kwargs["prompt"],
+        "stats": {"num_model_calls": 1, "num_input_tokens": 10, "num_output_tokens": 1},
+    }
+
+async_call = model.openai.async_call
+model.openai.async_call = fake_call
+try:
+    libem.calibrate({
+        "libem.match.parameter.provider_batch": True,
+        "libem.match.parameter.model": "gpt-4o",
+        "libem.optimize.batch.parameter.poll_interval": 0.01,
+    })
+
+    left = ["apple", "kiwi", "pear", "apple pie"]
+    right = ["fuji apple", "lemon", "pear", "cherry"]
+    output = libem.match(left, right)
+    assert [o["answer"] for o in output] == ["yes", "no", "yes", "yes"], output
+    assert len(batches) == 1 and num_calls == 1, (batches, num_calls)
+
+    # prompt-level batches are mapped back to pair order
+    libem.calibrate({"libem.match.parameter.batch_size": 2})
+    output = libem.match(["kiwi", "apple"], ["lemon", "fuji apple"])
+    assert [o["answer"] for o in output] == ["no", "yes"], output
+    assert len(batches) == 2, batches
+    libem.calibrate({"libem.match.parameter.batch_size": 1})
+
+    # an interrupted run resumes its job instead of resubmitting
+    state["ready"] = False
+    calls = [{"prompt": "apple", "model": "gpt-4o"}]
+    try:
+        asyncio.run(asyncio.wait_for(provider.run(calls), timeout=0.2))
+        assert False, "the job should still be in progress"
+    except asyncio.TimeoutError:
+        pass
+    assert len(batches) == 3, batches
+
+    model.reset()
+    state["ready"] = True
+    responses = asyncio.run(provider.run(calls))
+    assert responses[0]["output"] == "yes", responses
+    assert len(batches) == 3, batches
+
+    # or resumes a given job by id
+    responses = asyncio.run(provider.run(calls, job_id="batch-2"))
+    assert responses[0]["output"] == "yes" and len(batches) == 3, batches
+
+    # but not a job submitted for other calls
+    try:
+        asyncio.run(provider.run(calls, job_id="batch-0"))
+        assert False, "batch-0 was submitted for other calls"
+    except ValueError:
+        pass
+
+    # jobs without the digest are checked against their input
+    metadata["batch-2"] = None
+    responses = asyncio.run(provider.run(calls, job_id="batch-2"))
+    assert responses[0]["output"] == "yes" and len(batches) == 3, batches
+finally:
+    model.openai.async_call = async_call
+    os.environ.clear()
+    os.environ.update(environ)
+    model.reset()
+    libem.reset()
+    server.shutdown()
+
+print("All tests passed.")
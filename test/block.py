@@ -76,6 +76,22 @@ expected  = [{'left': {'i': 0, 'j': 'orange'}, 'right': {'i': 0, 'j': 'orange'}}
              {'left': {'i': 5, 'j': 'orange'}, 'right': {'i': 5, 'j': 'orange'}},]
 assert_equal(out, expected)
 
+# partitions spilled to disk give the pairs found in memory
+from libem.block.partition import Partitions
+
+with Partitions(num_partitions=4, max_buffered=3) as partitions:
+    for i in range(10):
+        partitions.add(i % 5, i)
+    assert partitions._files is not None
+    entries = [entry for entries in partitions for entry in entries]
+assert sorted(entries, key=lambda e: e[1]) == [(i % 5, i) for i in range(10)], entries
+
+in_memory = libem.block(dataset_a, dataset_b, key='i', ids=True)
+libem.calibrate({"libem.block.parameter.max_buffered": 3})
+spilled = libem.block(dataset_a, dataset_b, key='i', ids=True)
+assert spilled == in_memory, spilled
+libem.calibrate({"libem.block.parameter.max_buffered": 100_000})
+
 libem.calibrate({
     "libem.block.parameter.similarity": 100
 })
@@ -163,4 +179,107 @@ multimodal.append(get_image("orange1"))
 out = libem.block(multimodal)
 assert len(out) == 4
 
+# candidates from an inverted index or sorted neighborhood
+libem.calibrate({
+    "libem.block.parameter.similarity": 60,
+    "libem.block.parameter.candidates": "token",
+    "libem.block.parameter.max_token_df": 0.5,
+})
+
+products_a = ['apple ipod nano', 'apple ipod', 'sony tv', 'sony camera', 'apple tv']
+products_b = ['ipod nano 8gb', 'samsung tv', 'sony camera lens']
+
+out = libem.block(products_a, products_b)
+expected = [{'left': 'apple ipod nano', 'right': 'ipod nano 8gb'},
+            {'left': 'sony tv', 'right': 'sony camera lens'},
+            {'left': 'sony camera', 'right': 'sony camera lens'}]
+assert_equal(out, expected)
+
+# within a single list, tokens shared by a few records are
+# not stop tokens, so their records remain candidates
+libem.calibrate({
+    "libem.block.parameter.similarity": 0,
+    "libem.block.parameter.max_token_df": 0.2,
+})
+out = libem.block(['apple ipod', 'apple ipod nano', 'sony tv', 'sony camera', 'dell laptop'])
+expected = [{'left': 'apple ipod', 'right': 'apple ipod nano'},
+            {'left': 'sony tv', 'right': 'sony camera'}]
+assert_equal(out, expected)
+libem.calibrate({
+    "libem.block.parameter.similarity": 60,
+    "libem.block.parameter.max_token_df": 0.5,
+})
+
+# stop tokens are ignored once the index is large enough
+from libem.block.candidate import TokenIndex
+
+index = TokenIndex(max_df=0.2).extend([{"apple", f"ipod{i}"} for i in range(100)])
+assert index.is_stop("apple") and not index.is_stop("ipod1")
+assert list(index.query({"apple", "ipod1"})) == [1]
+
+libem.calibrate({
+    "libem.block.parameter.candidates": "sorted_neighborhood",
+    "libem.block.parameter.window": 2,
+})
+
+out = libem.block(products_a)
+expected = [{'left': 'apple ipod nano', 'right': 'apple ipod'},
+            {'left': 'apple ipod nano', 'right': 'apple tv'},
+            {'left': 'sony tv', 'right': 'sony camera'}]
+assert_equal(out, expected)
+
+import tempfile
+
+libem.calibrate({
+    "libem.block.parameter.candidates": "embedding",
+    "libem.block.parameter.num_neighbors": 1,
+    "libem.block.parameter.embedding_threshold": 0.3,
+    "libem.block.parameter.ann_index": "exact",
+    "libem.optimize.cache.parameter.path": tempfile.mkdtemp(),
+})
+
+# embedding candidates are not cut off on string similarity
+out = libem.block(products_a, products_b)
+expected = [{'left': 'apple ipod nano', 'right': 'ipod nano 8gb'},
+            {'left': 'apple ipod', 'right': 'ipod nano 8gb'},
+            {'left': 'sony tv', 'right': 'sony camera lens'},
+            {'left': 'sony camera', 'right': 'sony camera lens'}]
+assert_equal(out, expected)
+
+# including pairs with little overlap in tokens
+from fuzzywuzzy import fuzz
+
+assert fuzz.token_set_ratio('apple iphone 13 pro max', 'iphone13promax') < 60
+for engine in ["vectorized", "pairwise"]:
+    libem.calibrate({"libem.block.parameter.engine": engine})
+    out = libem.block(['apple iphone 13 pro max', 'dell laptop'], ['iphone13promax'])
+    expected = [{'left': 'apple iphone 13 pro max', 'right': 'iphone13promax'}]
+    assert_equal(out, expected)
+libem.calibrate({"libem.block.parameter.engine": "vectorized"})
+
+# pairs carry the positions of their records in the input
+out = libem.block(products_a, products_b, ids=True)
+for pair in out:
+    assert (products_a + products_b)[pair['left_id']] == pair['left']
+    assert (products_a + products_b)[pair['right_id']] == pair['right']
+
+libem.reset()
+
+# pairwise comparisons on a process pool give the serial pairs
+names = [f"{brand} {item} {i % 3}" for i, (brand, item) in enumerate(
+    (b, t) for b in ["apple", "sony", "samsung"]
+    for t in ["phone", "tv", "camera", "tablet"]
+)]
+libem.calibrate({
+    "libem.block.parameter.engine": "pairwise",
+    "libem.block.parameter.batch_size": 5,
+    "libem.block.parameter.num_workers": 1,
+})
+serial = libem.block(names, ids=True)
+libem.calibrate({"libem.block.parameter.num_workers": 2})
+parallel = libem.block(names, ids=True)
+assert parallel == serial and len(serial) > 5, (parallel, serial)
+
+libem.reset()
+
 print("All tests passed.")
@@ -0,0 +1,133 @@
+import os
+import tempfile
+
+import libem
+from libem.core import model
+from libem.core.struct import Rules
+from libem.optimize.cache.store import Store
+
+cache_dir = tempfile.mkdtemp()
+
+# store eviction
+store = Store(os.path.join(cache_dir, "test.sqlite"), max_size=100)
+for i in range(10):
+    store.put(f"key{i}", b"x" * 20)
+assert store.size() <= 100, store.size()
+assert store.get("key9") == b"x" * 20
+assert store.get("key0") is None
+
+store.max_age = 0
+assert store.get("key9") is None
+
+# response cache in front of the model backends
+num_calls = 0
+reply = '{"answer": "yes"}'
+
+
+async def fake_call(*args, **kwargs):
+    global num_calls, last_prompt
+    num_calls += 1
+    last_prompt = kwargs["prompt"]
+    return {
+        "output": reply,
+        "tool_outputs": [],
+        "messages": kwargs["prompt"],
+        "stats": {
+            "num_model_calls": 1,
+            "num_input_tokens": 10,
+            "num_output_tokens": 1,
+        },
+    }
+
+async_call = model.openai.async_call
+model.openai.async_call = fake_call
+try:
+    libem.calibrate({
+        "libem.optimize.cache.parameter.response": True,
+        "libem.optimize.cache.parameter.path": cache_dir,
+    })
+
+    with libem.trace as t:
+        for _ in range(3):
+            output = model.call(prompt=[{"role": "user", "content": "apple"}],
+                                model="gpt-4o", temperature=0, seed=42)
+            assert output["output"] == '{"answer": "yes"}', output
+        model.call(prompt=[{"role": "user", "content": "orange"}],
+                   model="gpt-4o", temperature=0, seed=42)
+
+    assert num_calls == 2, num_calls
+    stats = t.stats()["cache"]["response"]
+    assert stats["num_hits"]["sum"] == 2, stats
+    assert stats["num_misses"]["sum"] == 2, stats
+
+    # pair-level result cache, symmetric in left and right
+    libem.calibrate({
+        "libem.optimize.cache.parameter.response": False,
+        "libem.match.parameter.cache": True,
+    })
+
+    num_calls = 0
+    left, right = ["apple", "pear", "apple"], ["fuji apple", "apple", "pear"]
+    output = libem.match(left, right)
+    assert [o["answer"] for o in output] == ["yes"] * 3, output
+    assert num_calls == 3, num_calls
+
+    libem.match(right, left)
+    assert num_calls == 3, num_calls
+
+    # calibrating the prompt invalidates cached results
+    libem.calibrate({
+        "libem.match.parameter.cot": True,
+    })
+    libem.match(left, right)
+    assert num_calls == 6, num_calls
+
+    # answers padded in for a batch response are not cached
+    libem.calibrate({
+        "libem.match.parameter.batch_size": 2,
+    })
+    num_calls, reply = 0, '{"answers": [{"answer": "yes"}]}'
+    output = libem.match(["kiwi", "plum"], ["lemon", "grape"])
+    assert [o["answer"] for o in output] == ["yes", "no"], output
+
+    # only the padded pair is matched again
+    libem.match(["kiwi", "plum"], ["lemon", "grape"])
+    assert num_calls == 2, num_calls
+    libem.match(["kiwi", "plum"], ["lemon", "grape"])
+    assert num_calls == 2, num_calls
+    reply = '{"answer": "yes"}'
+
+    # the compiled system prompt follows calibration
+    libem.calibrate({
+        "libem.match.parameter.cache": False,
+        "libem.match.prompt.rules": Rules(["Ignore colors."]),
+    })
+    libem.match("apple", "red apple")
+    assert "Ignore colors." in last_prompt[0]["content"], last_prompt
+finally:
+    model.openai.async_call = async_call
+    libem.reset()
+
+# provider-side prompt caching: a stable prefix marked for Claude
+from libem.optimize.cache import provider
+from libem.optimize import cost
+
+messages = provider.layout([
+    {"role": "user", "content": "shot"},
+    {"role": "system", "content": "rules"},
+    {"role": "assistant", "content": "yes"},
+    {"role": "user", "content": "query"},
+])
+assert [m["role"] for m in messages] == ["system", "user", "assistant", "user"]
+
+system, marked = provider.mark("rules", messages[1:])
+assert system[0]["cache_control"] == {"type": "ephemeral"}, system
+assert marked[1]["content"][-1]["cache_control"] == {"type": "ephemeral"}, marked
+assert marked[2] == messages[3] and messages[2]["content"] == "yes"
+
+assert cost.get_cost("gpt-4o", 1000, 0, num_cached_tokens=1000) < \
+       cost.get_cost("gpt-4o", 1000, 0)
+
+libem.reset()
+
+print("All tests passed.")
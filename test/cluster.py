@@ -0,0 +1,292 @@
+import libem
+from libem.resolve.cluster import parameter
+from libem.resolve.cluster.union_find import UnionFind
+
+# union-find with negative edges
+clusters = UnionFind(5)
+clusters.separate(0, 3)
+clusters.union(0, 1)
+clusters.union(2, 3)
+assert clusters.connected(0, 1) and not clusters.connected(1, 2)
+assert clusters.separated(1, 2)
+assert not clusters.separated(1, 4)
+assert clusters.labels() == [0, 0, 1, 1, 2], clusters.labels()
+
+# clustering with oracle blocking and matching
+records = [{"name": f"person {i % 4}", "id": i} for i in range(12)]
+
+
+def block(*records):
+    records = [r for rs in records for r in rs]
+    return [
+        {"left": left, "right": right}
+        for i, left in enumerate(records)
+        for right in records[i + 1:]
+    ]
+
+
+def match(pairs):
+    return [
+        {"answer": "yes" if pair["left"]["name"] == pair["right"]["name"]
+                            or {pair["left"]["id"], pair["right"]["id"]} == {0, 1}
+         else "no"}
+        for pair in pairs
+    ]
+
+
+parameter.block_func.update(block)
+parameter.match_func.update(match)
+
+# the spurious match of records 0 and 1 merges their clusters
+output = libem.cluster(records)
+assert [c for c, _ in output] == [0, 0, 1, 2] * 3, output
+
+# unless the negative answers veto the merges,
+# leaving no unmatched pair in the same cluster
+libem.calibrate({"libem.resolve.cluster.parameter.conflict": "veto"})
+with libem.trace as t:
+    output = libem.cluster(records)
+cluster_ids = {r["id"]: c for c, r in output}
+for pair, answer in zip(block(records), match(block(records))):
+    if answer["answer"] == "no":
+        assert cluster_ids[pair["left"]["id"]] != \
+               cluster_ids[pair["right"]["id"]], output
+assert t.stats()["cluster"]["num_conflicts"]["sum"] > 0, t.stats()
+
+libem.reset()
+
+# skip the pairs implied by earlier answers
+num_matched = 0
+
+
+def match(pairs):
+    global num_matched
+    num_matched += len(pairs)
+    return [
+        {"answer": "yes" if pair["left"]["name"] == pair["right"]["name"]
+         else "no"}
+        for pair in pairs
+    ]
+
+
+parameter.match_func.update(match)
+libem.calibrate({
+    "libem.resolve.cluster.parameter.prune": "transitive",
+    "libem.resolve.cluster.parameter.wave_size": 4,
+})
+with libem.trace as t:
+    output = libem.cluster(records)
+assert [c for c, _ in output] == [0, 1, 2, 3] * 3, output
+# of the 66 pairs, 12 are in the same cluster but 8 of
+# them suffice to form the 4 clusters of 3 records
+assert num_matched <= 66 - 4, num_matched
+assert t.stats()["cluster"]["num_skipped_transitive"]["sum"] == 66 - num_matched
+
+num_matched = 0
+libem.calibrate({"libem.resolve.cluster.parameter.prune": "negative"})
+with libem.trace as t:
+    output = libem.cluster(records)
+assert [c for c, _ in output] == [0, 1, 2, 3] * 3, output
+assert t.stats()["cluster"]["num_skipped_negative"]["sum"] > 0, t.stats()
+
+libem.reset()
+
+# incremental clustering against the resolved records
+import os
+import duckdb
+import tempfile
+import pandas as pd
+
+from libem.resolve.cluster import State
+from libem.resolve.cluster.integrations.duckdb import Table
+
+matched = []
+
+
+def match(pairs):
+    matched.extend(pairs)
+    return [
+        {"answer": "yes" if pair["left"]["name"].split()[0] ==
+                            pair["right"]["name"].split()[0] else "no"}
+        for pair in pairs
+    ]
+
+
+parameter.block_func.update(parameter.block_func.default)
+parameter.match_func.update(match)
+
+# records sharing tokens are all compared, however many
+state = State()
+output = libem.cluster([{"name": f"apple iphone {i}"} for i in range(13, 17)],
+                       state=state)
+assert [c for c, _ in output] == [0, 0, 0, 0], output
+assert len(matched) == 6, matched
+
+# a custom block function is honored, only its pairs
+# with new records are matched
+parameter.block_func.update(lambda *records: [])
+state = State()
+output = libem.cluster([{"name": "apple iphone"}, {"name": "apple iphone 15"}],
+                       state=state)
+assert [c for c, _ in output] == [0, 1], output
+
+parameter.block_func.update(block)
+matched.clear()
+output = libem.cluster([{"name": "apple iphone 16"}, {"name": "apple ipad"}],
+                       state=state)
+assert [c for c, _ in output] == [0, 0], output
+assert len(matched) == 2 * 2 + 1, matched
+assert [c for c in state.cluster_ids()] == [0, 0, 0, 0], state.cluster_ids()
+parameter.block_func.update(parameter.block_func.default)
+
+matched.clear()
+state = State()
+output = libem.cluster([{"name": "apple iphone"}, {"name": "samsung galaxy"},
+                        {"name": "apple iphone 15"}], state=state)
+assert [c for c, _ in output] == [0, 1, 0], output
+
+# only pairs with new records are matched
+matched.clear()
+output = libem.cluster([{"name": "samsung galaxy s24"}, {"name": "apple iphone"},
+                        {"name": "google pixel"}], state=state)
+assert [c for c, _ in output] == [1, 0, 4], output
+assert all("s24" in p["right"]["name"] for p in matched), matched
+
+# the state persists
+path = os.path.join(tempfile.mkdtemp(), "state.pkl")
+state.save(path)
+state = State.load(path)
+df = libem.cluster(pd.DataFrame([{"name": "google pixel 9"}]), state=state)
+assert df["__cluster__"].tolist() == [4], df
+
+# in place updates of a duckdb table
+conn = duckdb.connect(":memory:")
+conn.execute("CREATE TABLE products (name VARCHAR)")
+conn.execute("INSERT INTO products VALUES ('apple iphone'), ('apple iphone 15'), "
+             "('samsung galaxy')")
+state, table = State(), Table("products", conn)
+libem.cluster(table, state=state)
+conn.execute("INSERT INTO products (name) VALUES ('samsung galaxy s24'), ('google pixel')")
+matched.clear()
+df = libem.cluster(table, state=state)().sort_values("name")
+assert df["__cluster__"].tolist() == [0, 0, 4, 2, 2], df
+assert len(matched) == 1, matched
+
+# clustering pushed down into duckdb, in batches of 2 pairs
+conn.execute("CREATE TABLE people AS SELECT * FROM (VALUES "
+             "('alice smith', 'nyc'), ('bob jones', 'sf'), ('alice smith', 'sf'), "
+             "('alice smyth', 'nyc'), ('bob jones', 'sf')) v(name, city)")
+libem.calibrate({"libem.block.parameter.batch_size": 2})
+matched.clear()
+df = libem.cluster(Table("people", conn))()
+assert df["__cluster__"].tolist() == [0, 1, 0, 0, 1], df
+assert df["city"].tolist() == ["nyc", "sf", "sf", "nyc", "sf"], df
+# only the pairs sharing tokens and passing the similarity are read
+assert len(matched) == 4, matched
+
+# a custom block function is used instead of the token join
+parameter.block_func.update(block)
+conn.execute("UPDATE people SET __cluster__ = NULL")
+matched.clear()
+df = libem.cluster(Table("people", conn))()
+assert df["__cluster__"].tolist() == [0, 1, 0, 0, 1], df
+assert len(matched) == 10, matched
+parameter.block_func.update(parameter.block_func.default)
+
+for records in [Table("people", conn), pd.DataFrame({"name": ["alice"]})]:
+    try:
+        libem.cluster(records, state=State(), key="name")
+        assert False, "keys are not supported with a state"
+    except ValueError:
+        pass
+
+conn.execute("UPDATE people SET __cluster__ = NULL")
+matched.clear()
+df = libem.cluster(Table("people", conn), key="city")()
+assert df["__cluster__"].tolist() == [0, 1, 2, 0, 1], df
+assert len(matched) == 2, matched
+
+# streamed clustering of a mongodb collection, in batches of 2
+import mongomock
+
+from libem.resolve.cluster.integrations.mongodb import Collection
+
+# mongomock predates the sort option pymongo>=4.11 passes to bulk updates
+_add_update = mongomock.collection.BulkOperationBuilder.add_update
+mongomock.collection.BulkOperationBuilder.add_update = \
+    lambda self, *args, sort=None, **kwargs: _add_update(self, *args, **kwargs)
+
+client = mongomock.MongoClient()
+people = client["db"]["people"]
+people.insert_many([{"name": name} for name in [
+    "alice smith", "bob jones", "alice smith", "alice smyth", "bob jones"
+]])
+libem.cluster(Collection("db", "people", client))
+docs = list(people.find({}))
+assert [d["__cluster__"] for d in docs] == [0, 1, 0, 0, 1], docs
+
+# new documents join the clusters in the state
+state = State()
+people.update_many({}, {"$unset": {"__cluster__": ""}})
+libem.cluster(Collection("db", "people", client), state=state)
+people.insert_many([{"name": "bob jones jr"}, {"name": "carol white"}])
+matched.clear()
+libem.cluster(Collection("db", "people", client), state=state)
+docs = list(people.find({}))
+assert [d["__cluster__"] for d in docs] == [0, 1, 0, 0, 1, 1, 4], docs
+assert all(p["right"]["name"] == "bob jones jr" for p in matched), matched
+
+# without a state, documents are clustered batch by batch into a new
+# one, in the same clusters as a list of records
+parameter.block_func.update(parameter.block_func.default)
+companies = [{"name": f"acme corp {suffix}"} for suffix in
+             ["ltd", "llc", "group", "holdings", "inc"]] + \
+            [{"name": f"beta inc {suffix}"} for suffix in ["ltd", "llc"]]
+expected = [c for c, _ in libem.cluster(companies)]
+assert expected == [0, 0, 0, 0, 0, 1, 1], expected
+client["db"]["companies"].insert_many([dict(c) for c in companies])
+libem.cluster(Collection("db", "companies", client), sort=True)
+docs = list(client["db"]["companies"].find({}))
+assert [d["__cluster__"] for d in docs] == [0, 0, 0, 0, 0, 5, 5], docs
+assert "__cluster___1" in client["db"]["companies"].index_information()
+
+# records kept in arrow columns
+from libem.struct import ArrowRecords, digest
+
+records = ArrowRecords({"name": ["alice smith", "bob jones", "alice smyth"],
+                        "age": [30, 40, None]})
+table = libem.cluster(records)
+assert table.column("__cluster__").to_pylist() == [0, 1, 0], table
+assert table.column("age").to_pylist() == [30, 40, None], table
+
+df = libem.cluster(pd.DataFrame({"name": ["alice smith", "bob jones", "alice smyth"]}))
+assert df["__cluster__"].tolist() == [0, 1, 0], df
+
+# missing values read as in the records of the dataframe
+from libem.block.function import convert_to_str
+from libem.resolve.cluster.integrations.pandas import to_records
+
+df = pd.DataFrame({"name": ["alice", None, "bob"], "age": [30, float("nan"), 40],
+                   "city": ["nyc", float("nan"), "sf"]})
+records = to_records(df)
+assert isinstance(records, ArrowRecords), records
+assert [convert_to_str(r) for r in records] == \
+       [convert_to_str(r) for r in df.to_dict(orient="records")], list(records)
+assert [digest(r) for r in records] == \
+       [digest(r) for r in df.to_dict(orient="records")], list(records)
+
+# dataframes arrow cannot convert fall back to per-row dicts
+import numpy as np
+
+df = pd.DataFrame({"name": ["alice smith", "bob jones", "alice smyth"],
+                   "code": [1, "x", 2]})
+assert libem.cluster(df)["__cluster__"].tolist() == [0, 1, 0], df
+assert libem.dedupe(df)["code"].tolist() == [1, "x"], df
+df["image"] = [np.zeros((2, 2, 3), dtype=np.uint8)] * 3
+assert libem.cluster(df)["__cluster__"].tolist() == [0, 1, 0], df
+
+libem.reset()
+parameter.block_func.update(parameter.block_func.default)
+parameter.match_func.update(parameter.match_func.default)
+
+print("All tests passed.")
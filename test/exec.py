@@ -0,0 +1,136 @@
+import time
+import random
+import asyncio
+import contextvars
+
+import libem
+from libem.core import exec, model
+
+# token bucket refills at the given rate per minute
+async def drain():
+    bucket = exec.TokenBucket(rate=6000)
+    start = time.monotonic()
+    await bucket.acquire(6000)
+    await bucket.acquire(10)
+    return time.monotonic() - start
+
+assert 0.05 < asyncio.run(drain()) < 1
+
+# throttled model calls are retried and shrink the concurrency
+num_calls = 0
+
+
+async def fake_call(*args, **kwargs):
+    global num_calls
+    num_calls += 1
+    call_id = num_calls
+    await asyncio.sleep(0.01)
+    if call_id % 3 == 0:
+        raise libem.ModelRateLimitedException("429")
+    return {
+        "output": '{"answer": "yes"}',
+        "tool_outputs": [],
+        "messages": kwargs["prompt"],
+        "stats": {
+            "num_model_calls": 1,
+            "num_input_tokens": 10,
+            "num_output_tokens": 1,
+        },
+    }
+
+async_call = model.openai.async_call
+model.openai.async_call = fake_call
+try:
+    libem.calibrate({
+        "libem.match.parameter.adaptive_concurrency": True,
+        "libem.match.parameter.tpm": 100_000,
+    })
+
+    with libem.trace as t:
+        output = libem.match(["apple"] * 20, ["orange"] * 20)
+
+    assert [o["answer"] for o in output] == ["yes"] * 20, output
+    stats = t.stats()["exec"]
+    assert stats["num_throttles"]["sum"] == num_calls - 20, stats
+    models = [span["exec"]["models"] for span in t.get()
+              if "models" in span.get("exec", {})][-1]
+    assert models[libem.parameter.model()]["num_requests"] == 20, models
+    assert models[libem.parameter.model()]["num_throttles"] == num_calls - 20, models
+    assert models[libem.parameter.model()]["concurrency"] < libem.LIBEM_MAX_ASYNC_TASKS, models
+finally:
+    model.openai.async_call = async_call
+    libem.reset()
+
+# adaptive concurrency does not shrink when only
+# a few calls are throttled, at random
+async def load():
+    scheduler = exec.Scheduler(max_concurrency=64, adaptive=True,
+                               backoff=0.01)
+    rng = random.Random(0)
+
+    async def call():
+        await asyncio.sleep(0.05)
+        if rng.random() < 0.02:
+            raise libem.ModelRateLimitedException("429")
+        return {"stats": {}}
+
+    await asyncio.gather(*[scheduler.run("model", 1, call)
+                           for _ in range(1000)])
+
+with libem.trace as t:
+    asyncio.run(load())
+concurrency = [span["exec"]["concurrency"] for span in t.get()
+               if "concurrency" in span.get("exec", {})]
+assert min(concurrency) == 64, min(concurrency)
+
+# a worker serves blocking work off the event loop,
+# taking the requests queued meanwhile as one batch
+batch_sizes = []
+
+
+def handle(requests):
+    batch_sizes.append(len(requests))
+    time.sleep(0.05)
+    return [ValueError(r) if r < 0 else r * 2 for r in requests]
+
+
+async def serve():
+    worker = exec.Worker(handle, max_batch_size=4)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.ensure_future(tick())
+    results = await asyncio.gather(
+        *[worker.submit(i) for i in [-1] + list(range(9))],
+        return_exceptions=True,
+    )
+    ticker.cancel()
+    worker.stop()
+    return results, ticks
+
+results, ticks = asyncio.run(serve())
+assert isinstance(results[0], ValueError), results
+assert results[1:] == [i * 2 for i in range(9)], results
+assert max(batch_sizes) == 4 and sum(batch_sizes) == 10, batch_sizes
+assert ticks > 5, ticks
+
+# sync callers share one background loop, and their
+# coroutines run in a copy of the caller's context
+var = contextvars.ContextVar("var", default=None)
+
+
+async def current():
+    return asyncio.get_running_loop(), var.get()
+
+var.set("caller")
+loop, value = exec.run_async_task(current())
+assert value == "caller", value
+assert exec.run_async_task(current())[0] is loop
+assert loop is exec.get_loop().loop and loop.is_running()
+
+print("All tests passed.")
@@ -0,0 +1,51 @@
+import libem
+from libem.core import model, transport
+from libem.core.model import mock
+
+left = ["apple iphone 13", "samsung galaxy s21", "google pixel 6"]
+right = ["iPhone 13 by Apple", "galaxy s22", "Pixel 6 (Google)"]
+labels = [True, False, True]
+
+with mock.Server(latency=0.01, distribution="exponential",
+                 error_rate=0.2) as server:
+    for l, r, label in zip(left, right, labels):
+        server.label(l, r, label)
+
+    # answers follow the labels in plain, structured and batched outputs
+    for calibration in [
+        {"libem.match.parameter.model": "gpt-4o"},
+        {"libem.match.parameter.model": "gpt-4o-2024-08-06"},
+        {"libem.match.parameter.batch_size": 3},
+        {"libem.match.parameter.batch_size": 3,
+         "libem.match.parameter.record_batch": True},
+    ]:
+        libem.calibrate({
+            "libem.parameter.base_url": server.base_url,
+            **calibration,
+        })
+        output = libem.match(left * 4, right * 4)
+        model.reset()
+        libem.reset()
+
+        assert [o["answer"] == "yes" for o in output] == labels * 4, \
+            (calibration, output)
+
+    assert server.num_errors > 0, server.num_errors
+
+    # sync matching reuses the connections of one pooled client,
+    # across calls as well, which all run on the background loop
+    libem.calibrate({
+        "libem.parameter.base_url": server.base_url,
+        "libem.match.parameter.sync": True,
+    })
+    transport.reset_stats()
+    for _ in range(2):
+        output = libem.match(left * 4, right * 4)
+        assert [o["answer"] == "yes" for o in output] == labels * 4, output
+    libem.reset()
+
+    stats, = transport.stats().values()
+    assert stats["num_requests"] >= 24, stats
+    assert stats["num_connections"] == 1, stats
+
+print("All tests passed.")
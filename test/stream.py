@@ -0,0 +1,60 @@
+import tempfile
+
+import libem
+from libem.core.model import mock
+
+left = [f"apple iphone {i}" for i in range(40)]
+right = [f"iPhone {i} by Apple" if i % 2 == 0 else f"samsung galaxy {i}"
+         for i in range(40)]
+labels = [i % 2 == 0 for i in range(40)]
+
+num_read = 0
+
+
+def pairs():
+    global num_read
+    for l, r in zip(left, right):
+        num_read += 1
+        yield {"left": l, "right": r}
+
+
+with mock.Server(latency=0.01) as server:
+    for l, r, label in zip(left, right, labels):
+        server.label(l, r, label)
+
+    libem.calibrate({
+        "libem.parameter.base_url": server.base_url,
+        "libem.match.parameter.batch_size": 4,
+        "libem.match.parameter.cache": True,
+        "libem.optimize.cache.parameter.path": tempfile.mkdtemp(),
+    })
+
+    # pairs are read lazily, a window of tasks (of a
+    # batch of pairs each) and a chunk ahead at a time
+    outputs = {}
+    with libem.trace as t:
+        for i, output in libem.match_stream(pairs(), window=2):
+            if not outputs:
+                assert num_read <= 3 * 4, num_read
+            outputs[i] = output
+    assert sorted(outputs) == list(range(len(left))), outputs
+    assert [outputs[i]["answer"] == "yes" for i in range(len(left))] == labels
+    stats = t.stats()["cache"]["result"]
+    assert stats["num_misses"]["sum"] == len(left), stats
+
+    # cached pairs are answered without a model call,
+    # the others are matched
+    num_requests = server.num_requests
+    right[0] = "iPhone 0 (Apple)"
+    server.label(left[0], right[0], True)
+    with libem.trace as t:
+        outputs = dict(libem.match_stream(pairs(), window=2))
+    assert [outputs[i]["answer"] == "yes" for i in range(len(left))] == labels
+    assert server.num_requests == num_requests + 1, server.num_requests
+    stats = t.stats()["cache"]["result"]
+    assert stats["num_hits"]["sum"] == len(left) - 1, stats
+    assert stats["num_misses"]["sum"] == 1, stats
+
+    libem.reset()
+
+print("All tests passed.")